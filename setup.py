@@ -12,10 +12,15 @@ setup(
     install_requires=[
         # Only include what's actually needed
     ],
+    entry_points={
+        'console_scripts': [
+            'callisto=src.cli:main',
+        ],
+    },
     classifiers=[
         'Programming Language :: Python :: 3',
         'License :: OSI Approved :: MIT License',
         'Operating System :: OS Independent',
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
 )
\ No newline at end of file
@@ -0,0 +1,363 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from itertools import islice
+from typing import Dict, Any, List, Optional, Union, Iterable, Tuple, Callable, AsyncIterator, Iterator
+
+from .callisto import Callisto
+from .batch import Batch
+from .embedding import Embedder
+from .user_merge import MergeStrategy
+from .log_format import Message
+
+class AsyncCallisto:
+    """
+    asyncio interface to Callisto. Every method is a coroutine that runs the
+    blocking storage work on a bounded thread pool, so the event loop never
+    waits on disk.
+    Calls that involve the same user run one after another, in the order
+    they were made (so a read sees earlier writes); calls for different
+    users run concurrently. Long maintenance jobs (pruning, retention,
+    index rebuilds) use a separate pool so they can't hold up other users'
+    requests.
+    """
+
+    def __init__(self, data_dir: str = "data", verbose: bool = False,
+                 config: Optional[Dict[str, Any]] = None, backend: str = "files",
+                 embedder: Optional[Embedder] = None,
+                 merge_strategies: Optional[Dict[str, MergeStrategy]] = None,
+                 callisto: Optional[Callisto] = None,
+                 max_workers: int = 8, maintenance_workers: int = 1):
+        """
+        Initialize with the same arguments as Callisto, or wrap an existing
+        instance. max_workers bounds the threads doing regular storage work
+        and maintenance_workers those running maintenance jobs.
+        """
+        if callisto is None:
+            callisto = Callisto(data_dir, verbose, config, backend, embedder, merge_strategies)
+        self.callisto = callisto
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="callisto-async")
+        self._maintenance_executor = ThreadPoolExecutor(
+            maintenance_workers, thread_name_prefix="callisto-maintenance"
+        )
+        # Completion future of the last call queued for each user
+        self._tails: Dict[str, asyncio.Future] = {}
+
+    async def __aenter__(self) -> "AsyncCallisto":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def _run(self, uuids: Iterable[str], function: Callable, *args,
+                   maintenance: bool = False, **kwargs) -> Any:
+        """
+        Run function on the pool after the calls already queued for any of
+        the given users have finished.
+        """
+        loop = asyncio.get_running_loop()
+        uuids = set(uuids)
+        waiting = {self._tails[uuid] for uuid in uuids if uuid in self._tails}
+        done = loop.create_future()
+        for uuid in uuids:
+            self._tails[uuid] = done
+
+        def release(_=None) -> None:
+            if not done.done():
+                done.set_result(None)
+            for uuid in uuids:
+                if self._tails.get(uuid) is done:
+                    del self._tails[uuid]
+
+        def release_threadsafe(_) -> None:
+            try:
+                loop.call_soon_threadsafe(release)
+            except RuntimeError:
+                # The loop is closed; nothing is waiting any more
+                pass
+
+        if waiting:
+            # Queued calls never fail (their futures only signal completion)
+            gate = asyncio.gather(*waiting)
+            try:
+                await asyncio.shield(gate)
+            except asyncio.CancelledError:
+                # Later calls must still wait for the earlier ones
+                gate.add_done_callback(release)
+                raise
+
+        executor = self._maintenance_executor if maintenance else self._executor
+        try:
+            job = executor.submit(function, *args, **kwargs)
+        except Exception:
+            release()
+            raise
+        job.add_done_callback(release_threadsafe)
+        return await asyncio.wrap_future(job, loop=loop)
+
+    async def _wait_for_all(self) -> None:
+        """Wait for every call queued so far."""
+        if self._tails:
+            await asyncio.gather(*set(self._tails.values()))
+
+    async def _as_completed(self, coroutines: List[Any]) -> AsyncIterator[Any]:
+        """Run coroutines concurrently and yield their results as they finish."""
+        tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    #
+    # Lifecycle
+    #
+
+    async def flush(self) -> None:
+        """Write any pending changes to disk, after the calls queued so far."""
+        await self._wait_for_all()
+        await self._run((), self.callisto.flush)
+
+    async def close(self) -> None:
+        """Wait for queued calls, close Callisto and stop the thread pools."""
+        await self._wait_for_all()
+        await self._run((), self.callisto.close)
+        self._executor.shutdown()
+        self._maintenance_executor.shutdown()
+
+    #
+    # Batched Updates
+    #
+
+    @asynccontextmanager
+    async def batch(self) -> AsyncIterator[Batch]:
+        """
+        Group updates so each touched user and log is written once.
+        Changes are committed when the block exits without an exception.
+        """
+        batch = Batch(self.callisto)
+        yield batch
+        await self._run(batch.touched_uuids(), batch.commit)
+
+    async def apply_batch(self, ops: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Apply a list of {"op": <method name>, **arguments} updates as one batch."""
+        uuids = [op["uuid"] for op in ops if isinstance(op.get("uuid"), str)]
+        return await self._run(uuids, self.callisto.apply_batch, ops)
+
+    #
+    # User Data Management
+    #
+
+    async def get_user_data(self, uuid: str) -> Optional[Dict[str, Any]]:
+        """Get all data for a user."""
+        return await self._run([uuid], self.callisto.get_user_data, uuid)
+
+    async def get_many_users(self, uuids: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """Get the data of several users concurrently, in the given order."""
+        return list(await asyncio.gather(*(self.get_user_data(uuid) for uuid in uuids)))
+
+    async def get_users_data(self, uuids: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """Same as get_many_users."""
+        return await self.get_many_users(uuids)
+
+    async def iter_many_users(self, uuids: Iterable[str]) -> AsyncIterator[Tuple[str, Optional[Dict[str, Any]]]]:
+        """Yield (uuid, data) for several users as the reads complete."""
+        async def read(uuid: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+            return uuid, await self.get_user_data(uuid)
+
+        async for result in self._as_completed([read(uuid) for uuid in uuids]):
+            yield result
+
+    async def user_exists(self, uuid: str) -> bool:
+        """Check if a user exists."""
+        return await self._run([uuid], self.callisto.user_exists, uuid)
+
+    async def create_user(self, uuid: str, initial_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Create a new user."""
+        return await self._run([uuid], self.callisto.create_user, uuid, initial_data)
+
+    async def update_user(self, uuid: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Update a user's data."""
+        return await self._run([uuid], self.callisto.update_user, uuid, data)
+
+    async def update_user_field(self, uuid: str, category: str, field: str, value: Any) -> Dict[str, Any]:
+        """Update a specific field in a user's data."""
+        return await self._run([uuid], self.callisto.update_user_field, uuid, category, field, value)
+
+    async def add_to_user_list(self, uuid: str, list_name: str, value: Any) -> Dict[str, Any]:
+        """Add an item to a list in the user's data."""
+        return await self._run([uuid], self.callisto.add_to_user_list, uuid, list_name, value)
+
+    async def patch_user(self, uuid: str, ops: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Apply several field operations to a user's data in one write."""
+        return await self._run([uuid], self.callisto.patch_user, uuid, ops)
+
+    async def delete_user(self, uuid: str) -> bool:
+        """Delete a user's data."""
+        return await self._run([uuid], self.callisto.delete_user, uuid)
+
+    async def list_users(self, offset: int = 0, limit: Optional[int] = None,
+                         order_by: str = "uuid", descending: bool = False) -> List[str]:
+        """List user UUIDs, sorted by order_by, one page at a time if limit is given."""
+        return await self._run((), self.callisto.list_users, offset, limit, order_by, descending)
+
+    async def refresh_user_registry(self) -> int:
+        """Rescan storage for users."""
+        return await self._run((), self.callisto.refresh_user_registry, maintenance=True)
+
+    async def create_user_index(self, path: str) -> int:
+        """Index a field path for find_users."""
+        return await self._run((), self.callisto.create_user_index, path, maintenance=True)
+
+    async def drop_user_index(self, path: str) -> bool:
+        """Remove a user index."""
+        return await self._run((), self.callisto.drop_user_index, path)
+
+    async def find_users(self, filters: Dict[str, Any]) -> List[str]:
+        """Find the users whose fields match all {field path: value} filters."""
+        return await self._run((), self.callisto.find_users, filters)
+
+    async def get_cache_stats(self) -> Dict[str, int]:
+        """Get the user cache counters (hits, misses, evictions, size)."""
+        # Only reads counters in memory
+        return self.callisto.get_cache_stats()
+
+    async def merge_users(self, source_uuid: str, target_uuid: str) -> Dict[str, Any]:
+        """Merge data and conversation logs from source user into target user."""
+        return await self._run(
+            [source_uuid, target_uuid], self.callisto.merge_users, source_uuid, target_uuid
+        )
+
+    async def merge_users_into(self, source_uuids: List[str], target_uuid: str) -> Dict[str, Any]:
+        """Merge several source users into the target user."""
+        return await self._run(
+            source_uuids + [target_uuid], self.callisto.merge_users_into, source_uuids, target_uuid
+        )
+
+    async def merge_many_users(self, pairs: List[Tuple[str, str]], workers: int = 8) -> List[Dict[str, Any]]:
+        """Merge many (source, target) pairs concurrently."""
+        uuids = [uuid for pair in pairs for uuid in pair]
+        return await self._run(uuids, self.callisto.merge_many_users, pairs, workers, maintenance=True)
+
+    #
+    # Conversation Management
+    #
+
+    async def get_conversation(self, uuid: str, log_name: str, as_text: bool = False) -> Optional[str]:
+        """Get a conversation log, with JSON records rendered as text lines if as_text."""
+        return await self._run([uuid], self.callisto.get_conversation, uuid, log_name, as_text)
+
+    async def get_many_conversations(self, logs: List[Tuple[str, str]]) -> List[Optional[str]]:
+        """Get several (uuid, log_name) conversation logs concurrently, in the given order."""
+        return list(await asyncio.gather(
+            *(self.get_conversation(uuid, log_name) for uuid, log_name in logs)
+        ))
+
+    async def get_conversations(self, logs: List[Tuple[str, str]]) -> List[Optional[str]]:
+        """Same as get_many_conversations."""
+        return await self.get_many_conversations(logs)
+
+    async def iter_many_conversations(self, logs: Iterable[Tuple[str, str]]) -> AsyncIterator[Tuple[Tuple[str, str], Optional[str]]]:
+        """Yield ((uuid, log_name), content) for several logs as the reads complete."""
+        async def read(uuid: str, log_name: str) -> Tuple[Tuple[str, str], Optional[str]]:
+            return (uuid, log_name), await self.get_conversation(uuid, log_name)
+
+        async for result in self._as_completed([read(uuid, log_name) for uuid, log_name in logs]):
+            yield result
+
+    async def get_recent_messages(self, uuid: str, log_name: str, n_lines: int = 20) -> Optional[List[str]]:
+        """Get the last lines of a conversation log, without its header."""
+        return await self._run([uuid], self.callisto.get_recent_messages, uuid, log_name, n_lines)
+
+    async def get_conversation_range(self, uuid: str, log_name: str,
+                                     start_date: Optional[str] = None,
+                                     end_date: Optional[str] = None) -> Optional[str]:
+        """Get the messages of a conversation log between two dates."""
+        return await self._run(
+            [uuid], self.callisto.get_conversation_range, uuid, log_name, start_date, end_date
+        )
+
+    async def iter_messages(self, uuid: str, log_name: str,
+                            since: Optional[str] = None, until: Optional[str] = None,
+                            reverse: bool = False, batch_size: int = 256) -> AsyncIterator[Message]:
+        """Iterate over the parsed messages of a conversation log, reading batch_size at a time."""
+        messages = await self._run(
+            [uuid], self.callisto.iter_messages, uuid, log_name, since, until, reverse
+        )
+        while True:
+            batch = await self._run([uuid], _take, messages, batch_size)
+            if not batch:
+                return
+            for message in batch:
+                yield message
+
+    async def store_conversation(self, uuid: str, log_name: str, content: str) -> str:
+        """Store a conversation log."""
+        return await self._run([uuid], self.callisto.store_conversation, uuid, log_name, content)
+
+    async def append_to_conversation(self, uuid: str, log_name: str,
+                                     message: str, with_timestamp: bool = True,
+                                     metadata: Optional[Dict[str, Any]] = None) -> str:
+        """Append a message to a conversation log (with metadata in the jsonl log format)."""
+        return await self._run(
+            [uuid], self.callisto.append_to_conversation, uuid, log_name, message, with_timestamp, metadata
+        )
+
+    async def store_multi_user_conversation(self, uuids: List[str], log_name: str, content: str) -> List[str]:
+        """Store a conversation log for multiple users."""
+        return await self._run(
+            uuids, self.callisto.store_multi_user_conversation, uuids, log_name, content
+        )
+
+    async def search_conversations(self, query: str, uuid: Optional[str] = None,
+                                   limit: int = 10) -> List[Dict[str, Any]]:
+        """Search conversation messages, optionally for one user only."""
+        return await self._run(
+            [uuid] if uuid else (), self.callisto.search_conversations, query, uuid, limit
+        )
+
+    async def rebuild_search_index(self) -> Dict[str, int]:
+        """Rebuild the search index from all stored logs."""
+        return await self._run((), self.callisto.rebuild_search_index, maintenance=True)
+
+    async def recall(self, uuid: str, text: str, k: int = 5) -> List[Dict[str, Any]]:
+        """Find a user's messages most similar in meaning to text."""
+        return await self._run([uuid], self.callisto.recall, uuid, text, k)
+
+    async def rebuild_vector_index(self) -> int:
+        """Re-embed all stored logs."""
+        return await self._run((), self.callisto.rebuild_vector_index, maintenance=True)
+
+    async def list_conversations(self, uuid: str) -> List[str]:
+        """List all conversation logs for a user."""
+        return await self._run([uuid], self.callisto.list_conversations, uuid)
+
+    async def delete_conversation(self, uuid: str, log_name: str) -> bool:
+        """Delete a conversation log."""
+        return await self._run([uuid], self.callisto.delete_conversation, uuid, log_name)
+
+    async def prune_conversation(self, uuid: str, log_name: str,
+                                 keep_lines: Optional[int] = None,
+                                 start_date: Optional[str] = None,
+                                 end_date: Optional[str] = None,
+                                 keep_bytes: Optional[int] = None) -> bool:
+        """Prune a conversation log."""
+        return await self._run(
+            [uuid], self.callisto.prune_conversation,
+            uuid, log_name, keep_lines, start_date, end_date, keep_bytes,
+            maintenance=True
+        )
+
+    async def apply_retention(self, policy: Dict[str, Any], workers: int = 4,
+                              checkpoint_path: Optional[str] = None,
+                              rate_limit: Optional[Union[str, int]] = None) -> Dict[str, Any]:
+        """Prune every user's logs according to a retention policy."""
+        return await self._run(
+            (), self.callisto.apply_retention, policy, workers, checkpoint_path, rate_limit,
+            maintenance=True
+        )
+
+def _take(iterator: Iterator[Any], count: int) -> List[Any]:
+    """Get up to count more items from an iterator."""
+    return list(islice(iterator, count))
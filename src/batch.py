@@ -0,0 +1,119 @@
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple, TYPE_CHECKING
+
+from .user_patch import category_field_ops, list_append_ops
+
+if TYPE_CHECKING:
+    from .callisto import Callisto
+
+class _LogChanges:
+    """Pending changes to one log: an optional replacement plus appended lines."""
+    __slots__ = ("content", "appended")
+
+    def __init__(self):
+        self.content: Optional[str] = None
+        self.appended: List[str] = []
+
+class Batch:
+    """
+    Collects mutations across many users and logs and commits them together.
+    Operations on the same user become one patch (one read and one write),
+    and operations on the same log become one write.
+    """
+
+    # Methods that can be named in Callisto.apply_batch operations
+    OPERATIONS = (
+        "update_user",
+        "update_user_field",
+        "add_to_user_list",
+        "append_to_conversation",
+        "store_conversation"
+    )
+
+    def __init__(self, callisto: "Callisto"):
+        """Initialize an empty batch for a Callisto instance."""
+        self._callisto = callisto
+        self._user_ops: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self._log_changes: "OrderedDict[Tuple[str, str], _LogChanges]" = OrderedDict()
+
+    def update_user(self, uuid: str, data: Dict[str, Any]) -> None:
+        """Queue an update of top-level fields in a user's data."""
+        self._validate_uuid(uuid)
+        ops = self._user_ops.setdefault(uuid, [])
+        for key, value in data.items():
+            if key in ["uuid", "created"]:
+                continue  # Don't allow updating these fields
+            ops.append({"op": "set", "path": [key], "value": value})
+
+    def update_user_field(self, uuid: str, category: str, field: str, value: Any) -> None:
+        """Queue an update of a field within a category in a user's data."""
+        self._validate_uuid(uuid)
+        now = datetime.now().strftime("%Y-%m-%d")
+        self._user_ops.setdefault(uuid, []).extend(category_field_ops(category, field, value, now))
+
+    def add_to_user_list(self, uuid: str, list_name: str, value: Any) -> None:
+        """Queue adding an item to a list in a user's data."""
+        self._validate_uuid(uuid)
+        now = datetime.now().strftime("%Y-%m-%d")
+        self._user_ops.setdefault(uuid, []).extend(list_append_ops(list_name, value, now))
+
+    def append_to_conversation(self, uuid: str, log_name: str,
+                               message: str, with_timestamp: bool = True,
+                               metadata: Optional[Dict[str, Any]] = None) -> None:
+        """Queue appending a message to a conversation log (timestamped now)."""
+        self._validate_uuid(uuid)
+        store = self._callisto.conversation_store
+        changes = self._log_changes.setdefault((uuid, store._log_key(log_name)), _LogChanges())
+        changes.appended.append(store.format_message(message, with_timestamp, metadata))
+
+    def store_conversation(self, uuid: str, log_name: str, content: str) -> None:
+        """Queue replacing a conversation log; earlier queued appends to it are dropped."""
+        self._validate_uuid(uuid)
+        store = self._callisto.conversation_store
+        changes = self._log_changes.setdefault((uuid, store._log_key(log_name)), _LogChanges())
+        changes.content = content
+        changes.appended = []
+
+    def apply(self, ops: List[Dict[str, Any]]) -> None:
+        """Queue operations given as {"op": <method name>, **arguments} dictionaries."""
+        for op in ops:
+            arguments = dict(op)
+            name = arguments.pop("op", None)
+            if name not in self.OPERATIONS:
+                raise ValueError(f"Invalid batch operation: {name}")
+            getattr(self, name)(**arguments)
+
+    def touched_uuids(self) -> List[str]:
+        """List the users whose data or logs have queued changes."""
+        uuids = dict.fromkeys(self._user_ops)
+        uuids.update(dict.fromkeys(uuid for uuid, _ in self._log_changes))
+        return list(uuids)
+
+    def commit(self) -> Dict[str, int]:
+        """
+        Write all queued changes, once per user and once per log, and clear the batch.
+        On the sqlite backend this is a single transaction; with files, changes
+        written before an error are kept.
+        """
+        user_store = self._callisto.user_store
+        conversation_store = self._callisto.conversation_store
+        users = len(self._user_ops)
+        logs = len(self._log_changes)
+
+        with self._callisto.backend.batch():
+            for uuid, ops in self._user_ops.items():
+                user_store.patch(uuid, ops)
+            for (uuid, log_name), changes in self._log_changes.items():
+                conversation_store.apply_log_changes(
+                    uuid, log_name, changes.content, "".join(changes.appended)
+                )
+
+        self._user_ops.clear()
+        self._log_changes.clear()
+        return {"users": users, "logs": logs}
+
+    def _validate_uuid(self, uuid: str) -> None:
+        """Reject invalid UUIDs when queued rather than at commit."""
+        if not self._callisto.user_store._is_valid_uuid(uuid):
+            raise ValueError(f"Invalid UUID: {uuid}")
@@ -1,10 +1,25 @@
 import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Dict, Any, List, Optional, Union
+from typing import Dict, Any, List, Optional, Union, Iterator, Iterable, Tuple, Callable
 
 from .user_store import UserStore
 from .conversation_store import ConversationStore
 from .file_utils import ensure_directory_exists
+from .config import load_config, parse_size
+from .storage_backend import create_backend
+from .user_patch import category_field_ops, list_append_ops
+from .batch import Batch
+from .retention import Retention
+from .search_index import create_search_index
+from .embedding import Embedder
+from .user_merge import MergeStrategy
+from .vector_index import create_vector_index
+from .locks import create_locks
+from .log_format import Message
 
 class Callisto:
     """
@@ -12,15 +27,52 @@ class Callisto:
     This serves as the primary interface for Jupiter to interact with.
     """
     
-    def __init__(self, data_dir: str = "data", verbose: bool = False):
-        """Initialize Callisto with the data directory."""
+    def __init__(self, data_dir: str = "data", verbose: bool = False,
+                 config: Optional[Dict[str, Any]] = None, backend: str = "files",
+                 embedder: Optional[Embedder] = None,
+                 merge_strategies: Optional[Dict[str, MergeStrategy]] = None):
+        """
+        Initialize Callisto with the data directory.
+        If no config is given, config/default.json is loaded.
+        backend selects the storage: "files" (JSON/text files) or "sqlite".
+        embedder replaces the built-in one used for recall.
+        merge_strategies overrides how fields are combined by merge_users
+        (see src/user_merge.py).
+        """
         self.data_dir = data_dir
         self.verbose = verbose
+        self.config = config if config is not None else load_config()
         ensure_directory_exists(data_dir)
         
         # Initialize stores
-        self.user_store = UserStore(data_dir)
-        self.conversation_store = ConversationStore(data_dir)
+        self.backend = create_backend(backend, data_dir, self.config)
+        registry_path = None
+        if self.config.get("persist_user_registry", True):
+            registry_path = f"{data_dir}/user_registry.json"
+        self.user_store = UserStore(
+            data_dir,
+            cache_size=parse_size(self.config.get("cache_size", 0)),
+            write_back=self.config.get("write_back", False),
+            auto_save_interval=self.config.get("auto_save_interval", 300),
+            backend=self.backend,
+            merge_strategies=merge_strategies,
+            registry_path=registry_path,
+            locks=create_locks(data_dir, self.config, "users")
+        )
+        for path in self.config.get("user_indexes", []):
+            self.user_store.create_index(path)
+        self.search_index = create_search_index(data_dir, self.config)
+        self.vector_index = create_vector_index(data_dir, self.config, embedder)
+        self.conversation_store = ConversationStore(
+            data_dir, backend=self.backend,
+            search_index=self.search_index, vector_index=self.vector_index,
+            locks=create_locks(data_dir, self.config, "logs"),
+            log_format=self.config.get("log_format", "text")
+        )
+        # Thread pool for get_many_users / get_many_conversations, started on first use
+        self.read_workers = max(1, self.config.get("read_workers", 8))
+        self._read_pool: Optional[ThreadPoolExecutor] = None
+        self._read_pool_lock = threading.Lock()
         self.log("Initialized Callisto with data directory: " + data_dir)
         
     def log(self, message: str) -> None:
@@ -28,6 +80,53 @@ class Callisto:
         if self.verbose:
             print(f"Callisto: {message}")
     
+    def flush(self) -> None:
+        """Write any pending changes to disk."""
+        self.log("Flushing pending changes")
+        self.user_store.flush()
+        self.backend.flush()
+        if self.search_index is not None:
+            self.search_index.flush()
+        if self.vector_index is not None:
+            self.vector_index.flush()
+    
+    def close(self) -> None:
+        """Flush pending changes and stop background work."""
+        self.log("Closing Callisto")
+        with self._read_pool_lock:
+            if self._read_pool is not None:
+                self._read_pool.shutdown()
+                self._read_pool = None
+        self.user_store.close()
+        self.backend.close()
+        if self.search_index is not None:
+            self.search_index.close()
+        if self.vector_index is not None:
+            self.vector_index.close()
+    
+    #
+    # Batched Updates
+    #
+    
+    @contextmanager
+    def batch(self) -> Iterator[Batch]:
+        """
+        Group updates so each touched user and log is written once.
+        Changes are committed when the block exits without an exception.
+        """
+        batch = Batch(self)
+        yield batch
+        result = batch.commit()
+        self.log(f"Committed batch touching {result['users']} users and {result['logs']} logs")
+    
+    def apply_batch(self, ops: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Apply a list of {"op": <method name>, **arguments} updates as one batch."""
+        batch = Batch(self)
+        batch.apply(ops)
+        result = batch.commit()
+        self.log(f"Committed batch touching {result['users']} users and {result['logs']} logs")
+        return result
+    
     #
     # User Data Management
     #
@@ -37,6 +136,24 @@ class Callisto:
         self.log(f"Getting data for user {uuid}")
         return self.user_store.get_user_data(uuid)
     
+    def get_many_users(self, uuids: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Get the data of several users, reading them in parallel on the read
+        pool (read_workers threads). Results are in the given order, with
+        None for missing users. Cached records are still served from the cache.
+        """
+        self.log(f"Getting data for {len(uuids)} users")
+        self._validate_uuids(uuids)
+        return [data for _, data in self._read_many(self.user_store.get_user_data, uuids, True)]
+    
+    def iter_many_users(self, uuids: Iterable[str]) -> Iterator[Tuple[str, Optional[Dict[str, Any]]]]:
+        """
+        Like get_many_users, but yield (uuid, data) pairs as the reads
+        complete, in whatever order that is.
+        """
+        self.log("Streaming data for many users")
+        return self._read_many(self.user_store.get_user_data, uuids, False)
+    
     def user_exists(self, uuid: str) -> bool:
         """Check if a user exists."""
         exists = self.user_store.user_exists(uuid)
@@ -56,22 +173,63 @@ class Callisto:
     def update_user_field(self, uuid: str, category: str, field: str, value: Any) -> Dict[str, Any]:
         """Update a specific field within a category in a user's data."""
         self.log(f"Updating field {category}.{field} for user {uuid}")
-        return self.user_store.update_category_field(uuid, category, field, value)
+        now = datetime.now().strftime("%Y-%m-%d")
+        return self.user_store.patch(uuid, category_field_ops(category, field, value, now))
     
     def add_to_user_list(self, uuid: str, list_name: str, value: Any) -> Dict[str, Any]:
         """Add an item to a list in the user's data."""
         self.log(f"Adding item to list {list_name} for user {uuid}")
-        return self.user_store.add_to_list(uuid, list_name, value)
+        now = datetime.now().strftime("%Y-%m-%d")
+        return self.user_store.patch(uuid, list_append_ops(list_name, value, now))
+    
+    def patch_user(self, uuid: str, ops: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Apply several field operations to a user's data in one write."""
+        self.log(f"Patching user {uuid} with {len(ops)} operations")
+        return self.user_store.patch(uuid, ops)
     
     def delete_user(self, uuid: str) -> bool:
         """Delete a user's data."""
         self.log(f"Deleting user {uuid}")
         return self.user_store.delete_user(uuid)
     
-    def list_users(self) -> List[str]:
-        """List all user UUIDs."""
+    def list_users(self, offset: int = 0, limit: Optional[int] = None,
+                   order_by: str = "uuid", descending: bool = False) -> List[str]:
+        """
+        List user UUIDs, sorted by order_by ("uuid", "created",
+        "last_modified" or "size"), one page at a time if limit is given.
+        """
         self.log("Listing all users")
-        return self.user_store.list_users()
+        return self.user_store.list_users(offset, limit, order_by, descending)
+    
+    def refresh_user_registry(self) -> int:
+        """
+        Rescan storage for users, e.g. after another process added or removed
+        user files. Returns the number of users found.
+        """
+        self.log("Refreshing the user registry")
+        return self.user_store.refresh_registry()
+    
+    def create_user_index(self, path: str) -> int:
+        """
+        Index a field path such as "preferences.theme" or "interests[].value"
+        for find_users. Returns the number of users with a value for it.
+        """
+        self.log(f"Creating user index on {path}")
+        return self.user_store.create_index(path)
+    
+    def drop_user_index(self, path: str) -> bool:
+        """Remove a user index."""
+        self.log(f"Dropping user index on {path}")
+        return self.user_store.drop_index(path)
+    
+    def find_users(self, filters: Dict[str, Any]) -> List[str]:
+        """Find the users whose fields match all {field path: value} filters."""
+        self.log(f"Finding users matching {filters}")
+        return self.user_store.find_users(filters)
+    
+    def get_cache_stats(self) -> Dict[str, int]:
+        """Get the user cache counters (hits, misses, evictions, size)."""
+        return self.user_store.cache_stats()
     
     def merge_users(self, source_uuid: str, target_uuid: str) -> Dict[str, Any]:
         """
@@ -87,14 +245,184 @@ class Callisto:
         
         return result
     
+    def merge_users_into(self, source_uuids: List[str], target_uuid: str) -> Dict[str, Any]:
+        """
+        Merge several source users into the target user, combining their
+        data in one pass. Also moves their conversation logs.
+        """
+        self.log(f"Merging users {', '.join(source_uuids)} into {target_uuid}")
+        result = self.user_store.merge_users_into(source_uuids, target_uuid)
+        
+        for source_uuid in source_uuids:
+            self.conversation_store.move_conversations(source_uuid, target_uuid)
+        
+        return result
+    
+    def merge_many_users(self, pairs: List[Tuple[str, str]], workers: int = 8) -> List[Dict[str, Any]]:
+        """
+        Merge many (source, target) pairs concurrently, e.g. from a dedup job.
+        Pairs that involve the same users are merged one after another in
+        the given order, so chains like A -> B, B -> C work. Returns one
+        result per pair, in order, with either the merged "data" or an "error".
+        """
+        self.log(f"Merging {len(pairs)} pairs of users with {workers} workers")
+        results: List[Optional[Dict[str, Any]]] = [None] * len(pairs)
+        
+        def merge_group(indexes: List[int]) -> None:
+            for index in indexes:
+                source_uuid, target_uuid = pairs[index]
+                result = {"source": source_uuid, "target": target_uuid}
+                try:
+                    result["data"] = self.merge_users(source_uuid, target_uuid)
+                except Exception as error:
+                    result["error"] = f"{type(error).__name__}: {error}"
+                results[index] = result
+        
+        groups = self._related_pair_groups(pairs)
+        if workers <= 1 or len(groups) <= 1:
+            for group in groups:
+                merge_group(group)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                # list() re-raises anything merge_group didn't catch
+                list(pool.map(merge_group, groups))
+        
+        return results
+    
+    def _related_pair_groups(self, pairs: List[Tuple[str, str]]) -> List[List[int]]:
+        """Group the indexes of pairs that share a user (directly or through other pairs)."""
+        parents: Dict[str, str] = {}
+        
+        def root(uuid: str) -> str:
+            parents.setdefault(uuid, uuid)
+            while parents[uuid] != uuid:
+                parents[uuid] = parents[parents[uuid]]
+                uuid = parents[uuid]
+            return uuid
+        
+        for source_uuid, target_uuid in pairs:
+            parents[root(source_uuid)] = root(target_uuid)
+        
+        groups: Dict[str, List[int]] = {}
+        for index, (source_uuid, _) in enumerate(pairs):
+            groups.setdefault(root(source_uuid), []).append(index)
+        return list(groups.values())
+    
+    #
+    # Parallel Reads
+    #
+    
+    def _get_read_pool(self) -> ThreadPoolExecutor:
+        """Get the thread pool for bulk reads, starting it if needed."""
+        with self._read_pool_lock:
+            if self._read_pool is None:
+                self._read_pool = ThreadPoolExecutor(
+                    max_workers=self.read_workers, thread_name_prefix="callisto-read"
+                )
+            return self._read_pool
+    
+    def _validate_uuids(self, uuids: List[str]) -> None:
+        """Reject a bulk read up front if any UUID is invalid."""
+        for uuid in uuids:
+            if not self.user_store._is_valid_uuid(uuid):
+                raise ValueError(f"Invalid UUID: {uuid}")
+    
+    def _read_many(self, read: Callable[[Any], Any], keys: Iterable[Any],
+                   ordered: bool) -> Iterator[Tuple[Any, Any]]:
+        """
+        Run read(key) for each key on the read pool and yield (key, result),
+        in key order or as completed. Only a few reads per worker are in
+        flight at once, so huge or lazy key lists aren't all queued up front.
+        The first failing read raises; reads not yet started are cancelled.
+        """
+        keys = iter(keys)
+        if self.read_workers == 1:
+            for key in keys:
+                yield key, read(key)
+            return
+        
+        pool = self._get_read_pool()
+        window = self.read_workers * 4
+        pending: Dict[Future, Any] = {}
+        queue: "deque[Future]" = deque()
+        
+        def submit() -> bool:
+            for key in keys:
+                future = pool.submit(read, key)
+                pending[future] = key
+                if ordered:
+                    queue.append(future)
+                return True
+            return False
+        
+        try:
+            while len(pending) < window and submit():
+                pass
+            while pending:
+                if ordered:
+                    done = [queue.popleft()]
+                else:
+                    done = wait(pending, return_when=FIRST_COMPLETED).done
+                for future in done:
+                    key = pending.pop(future)
+                    yield key, future.result()
+                    submit()
+        finally:
+            for future in pending:
+                future.cancel()
+    
     #
     # Conversation Management
     #
     
-    def get_conversation(self, uuid: str, log_name: str) -> Optional[str]:
-        """Get a conversation log."""
+    def get_conversation(self, uuid: str, log_name: str, as_text: bool = False) -> Optional[str]:
+        """Get a conversation log, with JSON records rendered as text lines if as_text."""
         self.log(f"Getting conversation {log_name} for user {uuid}")
-        return self.conversation_store.get_conversation(uuid, log_name)
+        return self.conversation_store.get_conversation(uuid, log_name, as_text)
+    
+    def get_many_conversations(self, logs: List[Tuple[str, str]]) -> List[Optional[str]]:
+        """
+        Get several (uuid, log_name) conversation logs, reading them in
+        parallel on the read pool. Results are in the given order, with
+        None for missing logs.
+        """
+        self.log(f"Getting {len(logs)} conversations")
+        self._validate_uuids([uuid for uuid, _ in logs])
+        return [
+            content for _, content in
+            self._read_many(self._read_conversation, [tuple(log) for log in logs], True)
+        ]
+    
+    def iter_many_conversations(self, logs: Iterable[Tuple[str, str]]) -> Iterator[Tuple[Tuple[str, str], Optional[str]]]:
+        """
+        Like get_many_conversations, but yield ((uuid, log_name), content)
+        pairs as the reads complete, in whatever order that is.
+        """
+        self.log("Streaming many conversations")
+        return self._read_many(self._read_conversation, (tuple(log) for log in logs), False)
+    
+    def _read_conversation(self, log: Tuple[str, str]) -> Optional[str]:
+        """Read one (uuid, log_name) conversation log."""
+        return self.conversation_store.get_conversation(*log)
+    
+    def get_recent_messages(self, uuid: str, log_name: str, n_lines: int = 20) -> Optional[List[str]]:
+        """Get the last lines of a conversation log, without its header."""
+        self.log(f"Getting last {n_lines} lines of conversation {log_name} for user {uuid}")
+        return self.conversation_store.tail(uuid, log_name, n_lines)
+    
+    def get_conversation_range(self, uuid: str, log_name: str,
+                               start_date: Optional[str] = None,
+                               end_date: Optional[str] = None) -> Optional[str]:
+        """Get the messages of a conversation log between two dates."""
+        self.log(f"Getting conversation {log_name} for user {uuid} from {start_date} to {end_date}")
+        return self.conversation_store.get_conversation_range(uuid, log_name, start_date, end_date)
+    
+    def iter_messages(self, uuid: str, log_name: str,
+                      since: Optional[str] = None, until: Optional[str] = None,
+                      reverse: bool = False) -> Iterator[Message]:
+        """Iterate lazily over the parsed messages of a conversation log."""
+        self.log(f"Iterating over messages of conversation {log_name} for user {uuid}")
+        return self.conversation_store.iter_messages(uuid, log_name, since, until, reverse)
     
     def store_conversation(self, uuid: str, log_name: str, content: str) -> str:
         """Store a conversation log."""
@@ -102,11 +430,12 @@ class Callisto:
         return self.conversation_store.store_conversation(uuid, log_name, content)
     
     def append_to_conversation(self, uuid: str, log_name: str, 
-                              message: str, with_timestamp: bool = True) -> str:
-        """Append a message to a conversation log."""
+                              message: str, with_timestamp: bool = True,
+                              metadata: Optional[Dict[str, Any]] = None) -> str:
+        """Append a message to a conversation log (with metadata in the jsonl log format)."""
         self.log(f"Appending to conversation {log_name} for user {uuid}")
         return self.conversation_store.append_to_conversation(
-            uuid, log_name, message, with_timestamp
+            uuid, log_name, message, with_timestamp, metadata
         )
     
     def store_multi_user_conversation(self, uuids: List[str], log_name: str, content: str) -> List[str]:
@@ -120,6 +449,29 @@ class Callisto:
         
         return self.conversation_store.store_multi_user_conversation(uuids, log_name, content)
     
+    def search_conversations(self, query: str, uuid: Optional[str] = None,
+                             limit: int = 10) -> List[Dict[str, Any]]:
+        """Search conversation messages, optionally for one user only."""
+        self.log(f"Searching conversations for '{query}'" + (f" of user {uuid}" if uuid else ""))
+        return self.conversation_store.search(query, uuid, limit)
+    
+    def rebuild_search_index(self) -> Dict[str, int]:
+        """Rebuild the search index from all stored logs."""
+        self.log("Rebuilding search index")
+        self.flush()
+        return self.conversation_store.rebuild_search_index()
+    
+    def recall(self, uuid: str, text: str, k: int = 5) -> List[Dict[str, Any]]:
+        """Find a user's messages most similar in meaning to text."""
+        self.log(f"Recalling messages of user {uuid} similar to '{text}'")
+        return self.conversation_store.recall(uuid, text, k)
+    
+    def rebuild_vector_index(self) -> int:
+        """Re-embed all stored logs, e.g. after changing the embedder."""
+        self.log("Rebuilding vector index")
+        self.flush()
+        return self.conversation_store.rebuild_vector_index()
+    
     def list_conversations(self, uuid: str) -> List[str]:
         """List all conversation logs for a user."""
         self.log(f"Listing conversations for user {uuid}")
@@ -133,9 +485,32 @@ class Callisto:
     def prune_conversation(self, uuid: str, log_name: str, 
                          keep_lines: Optional[int] = None,
                          start_date: Optional[str] = None,
-                         end_date: Optional[str] = None) -> bool:
+                         end_date: Optional[str] = None,
+                         keep_bytes: Optional[int] = None) -> bool:
         """Prune a conversation log."""
         self.log(f"Pruning conversation {log_name} for user {uuid}")
         return self.conversation_store.prune_conversation(
-            uuid, log_name, keep_lines, start_date, end_date
-        )
\ No newline at end of file
+            uuid, log_name, keep_lines, start_date, end_date, keep_bytes
+        )
+    
+    def apply_retention(self, policy: Dict[str, Any], workers: int = 4,
+                        checkpoint_path: Optional[str] = None,
+                        rate_limit: Optional[Union[str, int]] = None) -> Dict[str, Any]:
+        """
+        Prune every user's logs according to a retention policy, using a pool
+        of worker processes. Returns stats including the bytes reclaimed.
+        """
+        self.log(f"Applying retention policy {policy} with {workers} workers")
+        # Workers read the logs from disk, so buffered appends must be written first
+        self.flush()
+        stats = Retention(
+            self.backend.name,
+            self.data_dir,
+            policy,
+            config=self.config,
+            workers=workers,
+            checkpoint_path=checkpoint_path,
+            rate_limit=parse_size(rate_limit) if rate_limit else None
+        ).run()
+        self.log(f"Retention pruned {stats['pruned_logs']} logs and reclaimed {stats['bytes_reclaimed']} bytes")
+        return stats
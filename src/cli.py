@@ -0,0 +1,188 @@
+import sys
+import argparse
+from typing import Dict, Any, List, Optional
+
+from .config import load_config, parse_size
+from .migrate import migrate, parse_backend_spec
+from .retention import Retention
+from .storage_backend import FileBackend, STORAGE_LAYOUTS
+from .locks import create_locks
+
+def _print_progress(stats: Dict[str, Any]) -> None:
+    """Print a one-line progress report."""
+    print(
+        f"  {stats['users']} users, {stats['logs']} logs, {stats['lines']} lines "
+        f"({stats['lines_per_second']:.0f} lines/s, {stats['megabytes_per_second']:.1f} MB/s)",
+        flush=True
+    )
+
+def _run_migrate(args: argparse.Namespace) -> int:
+    """Handle the migrate command."""
+    print(f"Migrating {args.source} -> {args.target}")
+    stats = migrate(
+        args.source,
+        args.target,
+        checkpoint_path=args.checkpoint,
+        readers=args.readers,
+        batch_size=args.batch_size,
+        progress=_print_progress,
+        verify=not args.no_verify
+    )
+
+    print(
+        f"Migrated {stats['users']} users ({stats['skipped_users']} already done), "
+        f"{stats['logs']} logs, {stats['lines']} lines in {stats['elapsed']:.1f}s "
+        f"({stats['lines_per_second']:.0f} lines/s, {stats['megabytes_per_second']:.1f} MB/s)"
+    )
+    for error in stats["errors"]:
+        print(f"  Failed {error['uuid']}: {error['error']}", file=sys.stderr)
+
+    verification = stats.get("verification")
+    if verification is None:
+        return 1 if stats["errors"] else 0
+
+    print(
+        f"Verification: {verification['source_users']} source users, "
+        f"{verification['target_users']} target users, "
+        f"{len(verification['missing'])} missing, "
+        f"{len(verification['checksum_mismatches'])} checksum mismatches"
+    )
+    return 0 if verification["ok"] else 1
+
+def _print_retention_progress(stats: Dict[str, Any]) -> None:
+    """Print a one-line retention progress report."""
+    print(
+        f"  {stats['users']} users, {stats['pruned_logs']} logs pruned, "
+        f"{stats['bytes_reclaimed'] / (1024 * 1024):.1f} MB reclaimed "
+        f"({stats['megabytes_per_second']:.1f} MB/s scanned)",
+        flush=True
+    )
+
+def _run_retention(args: argparse.Namespace) -> int:
+    """Handle the retention command."""
+    backend_name, data_dir = parse_backend_spec(args.data)
+    policy = {
+        "max_age_days": args.max_age_days,
+        "max_lines": args.max_lines,
+        "max_size": args.max_size
+    }
+    policy = {key: value for key, value in policy.items() if value is not None}
+    
+    print(f"Applying retention to {args.data}: {policy}")
+    stats = Retention(
+        backend_name,
+        data_dir,
+        policy,
+        config=load_config(args.config),
+        workers=args.workers,
+        checkpoint_path=args.checkpoint,
+        rate_limit=parse_size(args.rate_limit) if args.rate_limit else None,
+        progress=_print_retention_progress
+    ).run()
+    
+    print(
+        f"Processed {stats['users']} users ({stats['skipped_users']} already done), "
+        f"{stats['logs']} logs: {stats['pruned_logs']} pruned, {stats['deleted_logs']} deleted, "
+        f"{stats['bytes_reclaimed'] / (1024 * 1024):.1f} MB reclaimed in {stats['elapsed']:.1f}s"
+    )
+    for pid, worker in sorted(stats["workers"].items()):
+        print(
+            f"  Worker {pid}: {worker['users']} users, {worker['logs']} logs, "
+            f"{worker['megabytes_per_second']:.1f} MB/s"
+        )
+    for error in stats["errors"]:
+        print(f"  Failed {error['uuid']}: {error['error']}", file=sys.stderr)
+    return 1 if stats["errors"] else 0
+
+def _run_reshard(args: argparse.Namespace) -> int:
+    """Handle the reshard command."""
+    print(f"Moving {args.data} to the {args.layout} layout")
+    config = load_config(args.config)
+    backend = FileBackend(
+        args.data, log_buffer_size=0, layout=args.layout,
+        fsync_policy=config.get("fsync_policy", "none")
+    )
+    try:
+        # The same locks as the stores, so running processes wait for each user's move
+        stats = backend.reshard(
+            user_locks=create_locks(args.data, config, "users"),
+            log_locks=create_locks(args.data, config, "logs")
+        )
+    finally:
+        backend.close()
+
+    print(
+        f"Moved {stats['users']} users and {stats['log_directories']} log directories, "
+        f"removed {stats['stale_users']} stale user files"
+    )
+    if stats["conflicts"]:
+        print(
+            f"  {stats['conflicts']} logs exist in both layouts and were left in place",
+            file=sys.stderr
+        )
+        return 1
+    return 0
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the command line parser."""
+    parser = argparse.ArgumentParser(prog="callisto", description="Callisto memory maintenance tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = commands.add_parser(
+        "migrate", help="Copy all users and logs from one storage backend to another."
+    )
+    migrate_parser.add_argument("--from", dest="source", required=True,
+                                help="Source as <backend>:<data_dir>, e.g. files:./data")
+    migrate_parser.add_argument("--to", dest="target", required=True,
+                                help="Target as <backend>:<data_dir>, e.g. sqlite:./data")
+    migrate_parser.add_argument("--checkpoint", default=None,
+                                help="Checkpoint file used to resume an interrupted migration.")
+    migrate_parser.add_argument("--readers", type=int, default=4,
+                                help="Number of reader threads (default: 4).")
+    migrate_parser.add_argument("--batch-size", type=int, default=500,
+                                help="Items written per commit (default: 500).")
+    migrate_parser.add_argument("--no-verify", action="store_true",
+                                help="Skip the count and checksum verification.")
+    migrate_parser.set_defaults(handler=_run_migrate)
+    
+    retention_parser = commands.add_parser(
+        "retention", help="Prune every user's conversation logs according to a retention policy."
+    )
+    retention_parser.add_argument("--data", required=True,
+                                  help="Data to prune as <backend>:<data_dir>, e.g. files:./data")
+    retention_parser.add_argument("--max-age-days", type=int, default=None,
+                                  help="Drop messages older than this many days.")
+    retention_parser.add_argument("--max-lines", type=int, default=None,
+                                  help="Keep at most this many lines per log.")
+    retention_parser.add_argument("--max-size", default=None,
+                                  help="Keep at most this much message data per log, e.g. 10MB.")
+    retention_parser.add_argument("--workers", type=int, default=4,
+                                  help="Number of worker processes (default: 4, 0 runs in-process).")
+    retention_parser.add_argument("--checkpoint", default=None,
+                                  help="Checkpoint file used to resume an interrupted run.")
+    retention_parser.add_argument("--rate-limit", default=None,
+                                  help="Maximum log data scanned per second, e.g. 20MB.")
+    retention_parser.add_argument("--config", default=None,
+                                  help="Config file (default: config/default.json).")
+    retention_parser.set_defaults(handler=_run_retention)
+
+    reshard_parser = commands.add_parser(
+        "reshard", help="Move users and logs of a files backend into another directory layout."
+    )
+    reshard_parser.add_argument("--data", required=True, help="Data directory, e.g. ./data")
+    reshard_parser.add_argument("--layout", choices=STORAGE_LAYOUTS, default="sharded",
+                                help="Layout to move to (default: sharded).")
+    reshard_parser.add_argument("--config", default=None,
+                                help="Config file with the lock settings of running processes "
+                                     "(default: config/default.json).")
+    reshard_parser.set_defaults(handler=_run_reshard)
+
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Entry point for the callisto command."""
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+import os
+import re
+from typing import Dict, Any, Optional, Union
+
+from .file_utils import read_json_file
+
+DEFAULT_CONFIG_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "config",
+    "default.json"
+)
+
+# Used when no config file can be found (e.g. installed without the config directory)
+DEFAULT_CONFIG: Dict[str, Any] = {
+    "cache_size": "256MB",
+    "auto_save_interval": 300,
+    "data_directory": "./data"
+}
+
+_SIZE_UNITS = {
+    "": 1,
+    "B": 1,
+    "KB": 1024,
+    "MB": 1024 ** 2,
+    "GB": 1024 ** 3
+}
+
+def load_config(config_path: Optional[str] = None) -> Dict[str, Any]:
+    """Load the configuration file, filling in missing keys from the defaults."""
+    config = dict(DEFAULT_CONFIG)
+    file_config = read_json_file(config_path or DEFAULT_CONFIG_PATH)
+    if file_config:
+        config.update(file_config)
+    return config
+
+def parse_size(size: Union[int, str]) -> int:
+    """Convert a size such as "256MB" or 1024 into a number of bytes."""
+    if isinstance(size, int):
+        return size
+
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMG]?B?)\s*$', str(size), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid size: {size}")
+
+    number, unit = match.groups()
+    unit = unit.upper()
+    if unit and not unit.endswith("B"):
+        unit += "B"
+    return int(float(number) * _SIZE_UNITS[unit])
@@ -1,24 +1,56 @@
 import os
 import re
+import time
 import shutil
+from collections import deque
 from datetime import datetime
-from typing import List, Optional, Set
+from typing import Dict, Any, List, Optional, Set, Iterator, Iterable, Deque, Callable
 
-from .file_utils import (
-    ensure_directory_exists,
-    read_text_file,
-    write_text_file,
-    list_files,
-    delete_file
+from .storage_backend import StorageBackend, FileBackend
+from .file_utils import split_lines
+from .log_format import (
+    LOG_FORMATS,
+    split_header,
+    drop_lines_out_of_range,
+    parse_messages,
+    Message,
+    format_message_record,
+    records_from_lines,
+    render_text
 )
+from .search_index import SearchIndex
+from .vector_index import VectorIndex
+from .locks import StripedLocks
 
 class ConversationStore:
     """Class for managing conversation log storage."""
     
-    def __init__(self, data_dir: str = "data"):
-        """Initialize the ConversationStore with the data directory."""
-        self.logs_dir = f"{data_dir}/logs"
-        ensure_directory_exists(self.logs_dir)
+    def __init__(self, data_dir: str = "data", backend: Optional[StorageBackend] = None,
+                 search_index: Optional[SearchIndex] = None,
+                 vector_index: Optional[VectorIndex] = None,
+                 locks: Optional[StripedLocks] = None,
+                 log_format: str = "text"):
+        """
+        Initialize the ConversationStore with the data directory.
+        The file layout under data_dir is used unless another backend is given.
+        Search and vector indexes, if given, are kept up to date with every change.
+        locks orders changes to each user's logs (e.g. an append and a prune);
+        pass locks with a directory to also coordinate with other processes.
+        log_format is how messages are written: "text" ("[timestamp] message"
+        lines under a "===" header) or "jsonl" (one JSON record per message,
+        see src/log_format.py). Logs in either format can be read.
+        """
+        if log_format not in LOG_FORMATS:
+            raise ValueError(f"Invalid log format: {log_format}")
+        self.log_format = log_format
+        self.backend = backend if backend is not None else FileBackend(data_dir)
+        self.search_index = search_index
+        self.vector_index = vector_index
+        self.locks = locks if locks is not None else StripedLocks()
+    
+    def _indexes(self) -> List[Any]:
+        """Get the enabled message indexes."""
+        return [index for index in (self.search_index, self.vector_index) if index is not None]
     
     def _is_valid_uuid(self, uuid_string: str) -> bool:
         """Check if the given string is a valid UUID."""
@@ -33,98 +65,237 @@ class ConversationStore:
         if not self._is_valid_uuid(uuid_string):
             raise ValueError(f"Invalid UUID: {uuid_string}")
         
-        user_logs_dir = f"{self.logs_dir}/{uuid_string}"
-        ensure_directory_exists(user_logs_dir)
-        return user_logs_dir
+        return self.backend.user_logs_location(uuid_string)
+    
+    def _log_key(self, log_name: str) -> str:
+        """Get the name a log is stored under (without the .txt extension)."""
+        if log_name.endswith(".txt"):
+            return log_name[:-len(".txt")]
+        return log_name
     
     def get_log_file_path(self, uuid_string: str, log_name: str) -> str:
         """Get the file path for a specific log."""
-        user_logs_dir = self.get_user_logs_dir(uuid_string)
-        
-        # Ensure log_name has .txt extension
-        if not log_name.endswith(".txt"):
-            log_name = f"{log_name}.txt"
+        if not self._is_valid_uuid(uuid_string):
+            raise ValueError(f"Invalid UUID: {uuid_string}")
         
-        return f"{user_logs_dir}/{log_name}"
+        return self.backend.log_location(uuid_string, self._log_key(log_name))
     
     def log_exists(self, uuid_string: str, log_name: str) -> bool:
         """Check if a log file exists."""
         if not self._is_valid_uuid(uuid_string):
             return False
-            
-        log_path = self.get_log_file_path(uuid_string, log_name)
-        return os.path.exists(log_path)
+        
+        return self.backend.log_exists(uuid_string, self._log_key(log_name))
     
     def store_conversation(self, uuid_string: str, log_name: str, content: str) -> str:
         """Store a conversation log for a user."""
         if not self._is_valid_uuid(uuid_string):
             raise ValueError(f"Invalid UUID: {uuid_string}")
         
-        log_path = self.get_log_file_path(uuid_string, log_name)
-        
-        # Add timestamp header if it doesn't already have one
+        log_key = self._log_key(log_name)
+        content = self._prepare_content(content)
+        with self.locks.write(uuid_string):
+            path = self.backend.write_log(uuid_string, log_key, content)
+            for index in self._indexes():
+                index.replace_log(uuid_string, log_key, split_lines(content))
+        return path
+    
+    def _conversation_header(self) -> str:
+        """Get the header written at the top of a new log."""
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return f"=== Conversation started on {now} ===\n\n"
+    
+    def _with_header(self, content: str) -> str:
+        """Add a timestamp header to content if it doesn't already have one."""
         if not content.strip().startswith("==="):
+            content = f"{self._conversation_header()}{content}"
+        return content
+    
+    def _prepare_content(self, content: str) -> str:
+        """Get log content ready to store: with a header, or as JSON records in the jsonl format."""
+        if self.log_format == "jsonl":
+            return "".join(records_from_lines(split_lines(content)))
+        return self._with_header(content)
+    
+    def _new_log_header(self) -> str:
+        """Get what a new log starts with before its first message."""
+        if self.log_format == "jsonl":
+            return ""
+        return self._conversation_header()
+    
+    def format_message(self, message: str, with_timestamp: bool = True,
+                       metadata: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Format a message as a log line, optionally with a timestamp.
+        metadata is stored with the message in the jsonl format.
+        """
+        if self.log_format == "jsonl":
+            timestamp = round(time.time(), 3) if with_timestamp else None
+            return format_message_record(message, timestamp, metadata)
+        if metadata:
+            raise ValueError("Message metadata needs the jsonl log format")
+        if with_timestamp:
             now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            header = f"=== Conversation started on {now} ===\n\n"
-            content = f"{header}{content}"
-        
-        write_text_file(log_path, content)
-        return log_path
+            return f"[{now}] {message}\n"
+        return f"{message}\n"
     
     def append_to_conversation(self, uuid_string: str, log_name: str, 
-                              message: str, with_timestamp: bool = True) -> str:
+                              message: str, with_timestamp: bool = True,
+                              metadata: Optional[Dict[str, Any]] = None) -> str:
         """Append a message to a conversation log."""
         if not self._is_valid_uuid(uuid_string):
             raise ValueError(f"Invalid UUID: {uuid_string}")
         
-        log_path = self.get_log_file_path(uuid_string, log_name)
+        log_key = self._log_key(log_name)
         
-        # Create log if it doesn't exist
-        if not os.path.exists(log_path):
-            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            header = f"=== Conversation started on {now} ===\n\n"
-            write_text_file(log_path, header)
+        formatted_message = self.format_message(message, with_timestamp, metadata)
         
-        # Format message with timestamp if needed
-        if with_timestamp:
-            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            formatted_message = f"[{now}] {message}\n"
-        else:
-            formatted_message = f"{message}\n"
+        with self.locks.write(uuid_string):
+            # Start the log with a header if it doesn't exist
+            if not self.backend.log_exists(uuid_string, log_key):
+                formatted_message = self._new_log_header() + formatted_message
+            
+            # Append to the log
+            path = self.backend.append_log(uuid_string, log_key, formatted_message)
+            self._index_appended(uuid_string, log_key, formatted_message)
+        return path
+    
+    def apply_log_changes(self, uuid_string: str, log_name: str,
+                          content: Optional[str], appended: str) -> str:
+        """
+        Apply coalesced changes to a log with a single write: replace it with
+        content (if given) and then append already formatted messages.
+        """
+        if not self._is_valid_uuid(uuid_string):
+            raise ValueError(f"Invalid UUID: {uuid_string}")
         
-        # Append to the file
-        with open(log_path, 'a', encoding='utf-8') as file:
-            file.write(formatted_message)
+        log_key = self._log_key(log_name)
+        with self.locks.write(uuid_string):
+            if content is not None or not self.backend.log_exists(uuid_string, log_key):
+                if content is not None:
+                    content = self._prepare_content(content) + appended
+                else:
+                    content = self._new_log_header() + appended
+                path = self.backend.write_log(uuid_string, log_key, content)
+                for index in self._indexes():
+                    index.replace_log(uuid_string, log_key, split_lines(content))
+                return path
+            
+            path = self.backend.append_log(uuid_string, log_key, appended)
+            self._index_appended(uuid_string, log_key, appended)
+            return path
+    
+    def _index_appended(self, uuid_string: str, log_key: str, text: str) -> None:
+        """Add appended text to the indexes, for every user sharing the log."""
+        indexes = self._indexes()
+        if not indexes:
+            return
+        for reference_uuid, reference_log in self.backend.log_references(uuid_string, log_key):
+            for index in indexes:
+                index.add_lines(reference_uuid, reference_log, split_lines(text))
+    
+    def get_conversation(self, uuid_string: str, log_name: str, as_text: bool = False) -> Optional[str]:
+        """
+        Get the content of a conversation log. With as_text, JSON records are
+        rendered as "[timestamp] speaker: text" lines.
+        """
+        if not self._is_valid_uuid(uuid_string):
+            raise ValueError(f"Invalid UUID: {uuid_string}")
         
-        return log_path
+        with self.locks.read(uuid_string):
+            content = self.backend.read_log(uuid_string, self._log_key(log_name))
+        if as_text and content is not None:
+            content = render_text(content)
+        return content
     
-    def get_conversation(self, uuid_string: str, log_name: str) -> Optional[str]:
-        """Get the content of a conversation log."""
+    def tail(self, uuid_string: str, log_name: str, n_lines: int = 20) -> Optional[List[str]]:
+        """
+        Get the last n_lines message lines of a conversation log (excluding the
+        header) without reading the whole log. Returns None if the log doesn't exist.
+        """
+        if not self._is_valid_uuid(uuid_string):
+            raise ValueError(f"Invalid UUID: {uuid_string}")
+        
+        with self.locks.read(uuid_string):
+            return self.backend.tail_log(uuid_string, self._log_key(log_name), n_lines)
+    
+    def get_conversation_range(self, uuid_string: str, log_name: str,
+                               start_date: Optional[str] = None,
+                               end_date: Optional[str] = None) -> Optional[str]:
+        """
+        Get the messages of a conversation log timestamped between two dates
+        (inclusive, e.g. "2025-03-01" or "2025-03-01 14:00:00"), without the header.
+        Returns None if the log doesn't exist.
+        """
         if not self._is_valid_uuid(uuid_string):
             raise ValueError(f"Invalid UUID: {uuid_string}")
         
-        log_path = self.get_log_file_path(uuid_string, log_name)
-        return read_text_file(log_path)
+        with self.locks.read(uuid_string):
+            return self.backend.read_log_range(uuid_string, self._log_key(log_name), start_date, end_date)
+    
+    def iter_messages(self, uuid_string: str, log_name: str,
+                      since: Optional[str] = None, until: Optional[str] = None,
+                      reverse: bool = False) -> Iterator[Message]:
+        """
+        Iterate over the messages of a conversation log as Message records
+        (timestamp, speaker, text, byte offset), oldest first or newest first
+        if reverse, optionally only those timestamped between since and until
+        as in get_conversation_range. The log is read lazily, so memory use
+        doesn't grow with its size; the iterator keeps reading the version of
+        the log it started on. Yields nothing if the log doesn't exist.
+        """
+        if not self._is_valid_uuid(uuid_string):
+            raise ValueError(f"Invalid UUID: {uuid_string}")
+        
+        with self.locks.read(uuid_string):
+            entries = self.backend.iter_log_offsets(
+                uuid_string, self._log_key(log_name), since, until, reverse
+            )
+        return parse_messages(entries, reverse)
+    
+    def search(self, query: str, uuid_string: Optional[str] = None,
+               limit: int = 10) -> List[Dict[str, Any]]:
+        """Search the messages of one user (or all users) with BM25 ranking."""
+        if self.search_index is None:
+            raise ValueError("Search index is disabled")
+        if uuid_string is not None and not self._is_valid_uuid(uuid_string):
+            raise ValueError(f"Invalid UUID: {uuid_string}")
+        
+        return self.search_index.search(query, uuid_string, limit)
+    
+    def recall(self, uuid_string: str, text: str, k: int = 5) -> List[Dict[str, Any]]:
+        """Find a user's k messages most similar in meaning to text."""
+        if self.vector_index is None:
+            raise ValueError("Vector index is disabled")
+        if not self._is_valid_uuid(uuid_string):
+            raise ValueError(f"Invalid UUID: {uuid_string}")
+        
+        return self.vector_index.recall(uuid_string, text, k)
     
     def list_conversations(self, uuid_string: str) -> List[str]:
         """List all conversation logs for a user."""
         if not self._is_valid_uuid(uuid_string):
             raise ValueError(f"Invalid UUID: {uuid_string}")
         
-        user_logs_dir = self.get_user_logs_dir(uuid_string)
-        files = list_files(user_logs_dir, ".txt")
-        return [file.replace(".txt", "") for file in files]
+        return self.backend.list_logs(uuid_string)
     
     def delete_conversation(self, uuid_string: str, log_name: str) -> bool:
         """Delete a conversation log."""
         if not self._is_valid_uuid(uuid_string):
             raise ValueError(f"Invalid UUID: {uuid_string}")
         
-        log_path = self.get_log_file_path(uuid_string, log_name)
-        return delete_file(log_path)
+        log_key = self._log_key(log_name)
+        with self.locks.write(uuid_string):
+            deleted = self.backend.delete_log(uuid_string, log_key)
+            for index in self._indexes():
+                index.delete_log(uuid_string, log_key)
+        return deleted
     
     def store_multi_user_conversation(self, uuids: List[str], log_name: str, content: str) -> List[str]:
-        """Store a conversation log for multiple users."""
+        """
+        Store a conversation log for multiple users. On the file backend it is
+        stored once and linked into each user's log directory.
+        """
         if not uuids:
             raise ValueError("At least one UUID is required")
         
@@ -133,20 +304,23 @@ class ConversationStore:
             if not self._is_valid_uuid(uuid_string):
                 raise ValueError(f"Invalid UUID: {uuid_string}")
         
-        paths = []
         now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
         # Add multi-user header if it doesn't already have one
-        if not content.strip().startswith("==="):
+        if self.log_format == "jsonl":
+            content = self._prepare_content(content)
+        elif not content.strip().startswith("==="):
             header = f"=== Multi-user conversation started on {now} ===\n"
             header += f"=== Participants: {', '.join(uuids)} ===\n\n"
             content = f"{header}{content}"
         
-        # Store in each user's directory
-        for uuid_string in uuids:
-            log_path = self.get_log_file_path(uuid_string, log_name)
-            write_text_file(log_path, content)
-            paths.append(log_path)
+        # Store once, shared by every participant where the backend supports it
+        log_key = self._log_key(log_name)
+        with self.locks.write(*uuids), self.backend.batch():
+            paths = self.backend.write_shared_log(uuids, log_key, content)
+            for uuid_string in uuids:
+                for index in self._indexes():
+                    index.replace_log(uuid_string, log_key, split_lines(content))
         
         return paths
     
@@ -161,88 +335,120 @@ class ConversationStore:
         if source_uuid == target_uuid:
             raise ValueError("Source and target UUIDs must be different")
         
-        source_dir = self.get_user_logs_dir(source_uuid)
-        target_dir = self.get_user_logs_dir(target_uuid)
-        
-        moved_logs = []
-        
-        # List all logs in source directory
-        logs = list_files(source_dir, ".txt")
-        
-        for log_name in logs:
-            source_path = f"{source_dir}/{log_name}"
-            target_path = f"{target_dir}/{log_name}"
+        with self.locks.write(source_uuid, target_uuid):
+            # If the target has no logs, all of them move in one step
+            moved_logs = self.backend.move_all_logs(source_uuid, target_uuid)
+            if moved_logs is not None:
+                for index in self._indexes():
+                    index.move_user(source_uuid, target_uuid)
+                return moved_logs
             
-            # If target already has a log with same name, rename the source log
-            if os.path.exists(target_path):
-                timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-                base_name = log_name.replace(".txt", "")
-                new_log_name = f"{base_name}_merged_{timestamp}.txt"
-                target_path = f"{target_dir}/{new_log_name}"
+            moved_logs = []
             
-            # Copy source to target
-            shutil.copy2(source_path, target_path)
-            moved_logs.append(target_path)
+            # List all logs of the source user
+            logs = self.backend.list_logs(source_uuid)
             
-            # Delete the source log
-            os.remove(source_path)
-        
-        return moved_logs
+            with self.backend.batch():
+                for log_name in logs:
+                    target_log_name = log_name
+                    
+                    # If target already has a log with same name, rename the source log
+                    if self.backend.log_exists(target_uuid, log_name):
+                        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+                        target_log_name = f"{log_name}_merged_{timestamp}"
+                        # Merges within the same second would otherwise overwrite each other
+                        suffix = 1
+                        while self.backend.log_exists(target_uuid, target_log_name):
+                            suffix += 1
+                            target_log_name = f"{log_name}_merged_{timestamp}_{suffix}"
+                    
+                    moved_logs.append(
+                        self.backend.move_log(source_uuid, log_name, target_uuid, target_log_name)
+                    )
+                    for index in self._indexes():
+                        index.move_log(source_uuid, log_name, target_uuid, target_log_name)
+            
+            return moved_logs
     
     def prune_conversation(self, uuid_string: str, log_name: str, 
                          keep_lines: Optional[int] = None, 
                          start_date: Optional[str] = None,
-                         end_date: Optional[str] = None) -> bool:
+                         end_date: Optional[str] = None,
+                         keep_bytes: Optional[int] = None) -> bool:
         """
         Prune a conversation log by keeping only a certain number of lines
-        or entries between specific dates.
+        or entries between specific dates, and at most keep_bytes of messages.
+        Date pruning only drops timestamped lines; lines without a timestamp
+        are kept.
+        The log is streamed into a temporary copy that replaces it, so memory
+        use is bounded by keep_lines or keep_bytes rather than by the size of the log.
         """
         if not self._is_valid_uuid(uuid_string):
             raise ValueError(f"Invalid UUID: {uuid_string}")
         
-        if not self.log_exists(uuid_string, log_name):
-            return False
-        
-        log_path = self.get_log_file_path(uuid_string, log_name)
-        content = read_text_file(log_path)
+        log_key = self._log_key(log_name)
         
-        if not content:
+        def prune(lines: Iterator[str]) -> Iterator[str]:
+            header_lines, conversation_lines = split_header(lines)
+            yield from header_lines
+            
+            # Apply pruning filters
+            if keep_lines is not None:
+                conversation_lines = deque(conversation_lines, maxlen=max(keep_lines, 0))
+            if start_date or end_date:
+                conversation_lines = drop_lines_out_of_range(conversation_lines, start_date, end_date)
+            if keep_bytes is not None:
+                conversation_lines = self._newest_lines_within(conversation_lines, keep_bytes)
+            yield from conversation_lines
+        
+        with self.locks.write(uuid_string):
+            return self._rewrite_log(uuid_string, log_key, prune)
+    
+    def _rewrite_log(self, uuid_string: str, log_key: str,
+                     transform: Callable[[Iterator[str]], Iterable[str]]) -> bool:
+        """Rewrite a log through the backend and reindex it."""
+        if not self.backend.rewrite_log_lines(uuid_string, log_key, transform):
             return False
+        for index in self._indexes():
+            index.replace_log(
+                uuid_string, log_key, self.backend.iter_log_lines(uuid_string, log_key)
+            )
+        return True
+    
+    def rebuild_search_index(self) -> Dict[str, int]:
+        """Rebuild the search index from every stored log, e.g. after a migration."""
+        if self.search_index is None:
+            raise ValueError("Search index is disabled")
         
-        lines = content.split('\n')
-        header_lines = []
-        conversation_lines = []
+        self._reindex(self.search_index)
+        return self.search_index.stats()
+    
+    def rebuild_vector_index(self) -> int:
+        """Re-embed every stored log, e.g. after changing the embedder. Returns the number of logs."""
+        if self.vector_index is None:
+            raise ValueError("Vector index is disabled")
         
-        # Separate header from conversation
-        in_header = True
+        return self._reindex(self.vector_index)
+    
+    def _reindex(self, index: Any) -> int:
+        """Clear an index and feed it every stored log."""
+        index.clear()
+        logs = 0
+        for uuid_string in self.backend.list_log_owners():
+            with self.locks.read(uuid_string):
+                for log_key in self.backend.list_logs(uuid_string):
+                    index.replace_log(uuid_string, log_key, self.backend.iter_log_lines(uuid_string, log_key))
+                    logs += 1
+        index.flush()
+        return logs
+    
+    def _newest_lines_within(self, lines: Iterator[str], max_bytes: int) -> Deque[str]:
+        """Keep the newest lines whose combined UTF-8 size is at most max_bytes."""
+        kept: Deque[str] = deque()
+        size = 0
         for line in lines:
-            if in_header:
-                header_lines.append(line)
-                if line.strip() == "":
-                    in_header = False
-            else:
-                conversation_lines.append(line)
-        
-        # Apply pruning filters
-        if keep_lines is not None:
-            conversation_lines = conversation_lines[-keep_lines:]
-        
-        if start_date or end_date:
-            filtered_lines = []
-            for line in conversation_lines:
-                # Check if line has a timestamp
-                timestamp_match = re.match(r'\[([\d-]+ [\d:]+)\]', line)
-                if timestamp_match:
-                    line_date = timestamp_match.group(1)
-                    if start_date and line_date < start_date:
-                        continue
-                    if end_date and line_date > end_date:
-                        continue
-                filtered_lines.append(line)
-            conversation_lines = filtered_lines
-        
-        # Combine header and pruned conversation
-        pruned_content = '\n'.join(header_lines + conversation_lines)
-        write_text_file(log_path, pruned_content)
-        
-        return True
\ No newline at end of file
+            kept.append(line)
+            size += len(line.encode('utf-8'))
+            while size > max_bytes:
+                size -= len(kept.popleft().encode('utf-8'))
+        return kept
@@ -0,0 +1,60 @@
+import math
+import re
+import zlib
+from typing import List, Sequence
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+class Embedder:
+    """
+    Interface for turning text into fixed-size vectors for recall.
+    name and dimensions are stored with the vectors, so vectors made by a
+    different embedder are never compared with each other.
+    """
+
+    name = "base"
+    dimensions = 0
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        """Embed a batch of texts. Vectors should be L2-normalized."""
+        raise NotImplementedError
+
+class HashedNgramEmbedder(Embedder):
+    """
+    Deterministic embedder with no model or external service: character
+    n-grams and whole words are hashed into a fixed number of signed buckets
+    (the "hashing trick"), so texts sharing words and word fragments get
+    similar vectors. Cheap enough to run on every appended message.
+    """
+
+    name = "hashed-ngram"
+
+    def __init__(self, dimensions: int = 256, ngram: int = 3, word_weight: float = 2.0):
+        """Initialize the embedder with the vector size and n-gram length."""
+        self.dimensions = dimensions
+        self.ngram = ngram
+        self.word_weight = word_weight
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        """Embed a batch of texts."""
+        return [self._embed_one(text) for text in texts]
+
+    def _embed_one(self, text: str) -> List[float]:
+        """Embed one text as an L2-normalized vector."""
+        vector = [0.0] * self.dimensions
+        for word in _WORD.findall(text.lower()):
+            self._add(vector, word, self.word_weight)
+            padded = f" {word} "
+            for start in range(max(1, len(padded) - self.ngram + 1)):
+                self._add(vector, padded[start:start + self.ngram], 1.0)
+
+        norm = math.sqrt(sum(value * value for value in vector))
+        if norm == 0:
+            return vector
+        return [value / norm for value in vector]
+
+    def _add(self, vector: List[float], feature: str, weight: float) -> None:
+        """Add a feature to its hashed bucket, with a hashed sign to reduce collisions' bias."""
+        hashed = zlib.crc32(feature.encode("utf-8"))
+        bucket = hashed % self.dimensions
+        vector[bucket] += weight if hashed & 0x80000000 else -weight
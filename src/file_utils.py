@@ -1,12 +1,248 @@
 import os
 import json
+import errno
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Iterator, Iterable, BinaryIO, Tuple
+
+# How hard writes try to survive a power loss, passed to each write function
+# by its caller (usually a backend, from the "fsync_policy" config):
+#   "none" - atomic replace only (safe against process crashes)
+#   "data" - also fsync file contents before the replace
+#   "full" - also fsync the containing directory after the replace
+FSYNC_POLICIES = ("none", "data", "full")
+
+# Per-thread state for fsync_batch()
+_batch_state = threading.local()
+
+def _current_umask() -> int:
+    """Read the process umask (there is no way to read it without setting it)."""
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+_DEFAULT_FILE_MODE = 0o666 & ~_current_umask()
+
+def check_fsync_policy(policy: str) -> str:
+    """Returns policy if it is one of FSYNC_POLICIES, raising ValueError otherwise."""
+    if policy not in FSYNC_POLICIES:
+        raise ValueError(f"Invalid fsync policy: {policy}")
+    return policy
 
 def ensure_directory_exists(directory_path: str) -> None:
     """Ensures that the specified directory exists, creating it if necessary."""
     Path(directory_path).mkdir(parents=True, exist_ok=True)
 
+def _fsync_file(file) -> None:
+    """Flushes an open file's contents to disk."""
+    file.flush()
+    _fsync_descriptor(file.fileno())
+
+def _fsync_descriptor(fd: int) -> None:
+    """Flushes a file descriptor's contents to disk."""
+    if hasattr(os, "fdatasync"):
+        os.fdatasync(fd)
+    else:
+        os.fsync(fd)
+
+def _fsync_directory(directory_path: str) -> None:
+    """Flushes a directory entry to disk (no-op where directories can't be opened)."""
+    try:
+        fd = os.open(directory_path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _fsync_path(file_path: str) -> None:
+    """Flushes a file's contents to disk by path."""
+    try:
+        with open(file_path, 'rb+') as file:
+            _fsync_file(file)
+    except FileNotFoundError:
+        pass
+
+def _in_batch() -> bool:
+    """Checks if the current thread is inside fsync_batch()."""
+    return getattr(_batch_state, "depth", 0) > 0
+
+def _sync_after_write(file, file_path: str, fsync_policy: str) -> None:
+    """Applies the fsync policy to a file that was just written in place."""
+    if fsync_policy == "none":
+        return
+    if _in_batch():
+        _batch_state.files.add(file_path)
+        return
+    _fsync_file(file)
+
+def _sync_before_replace(file, fsync_policy: str) -> None:
+    """
+    Applies the fsync policy to a temporary file about to be renamed over its
+    target. This is never deferred to a batch: if the rename reached the disk
+    before the data, a crash could leave an empty file under the target's name.
+    """
+    if fsync_policy == "none":
+        return
+    _fsync_file(file)
+
+def sync_descriptor(fd: int, file_path: str, fsync_policy: str = "none") -> None:
+    """Applies an fsync policy to a raw file descriptor that was just written."""
+    if fsync_policy == "none":
+        return
+    if _in_batch():
+        _batch_state.files.add(file_path)
+        return
+    _fsync_descriptor(fd)
+
+def _sync_after_replace(file_path: str, fsync_policy: str) -> None:
+    """Applies the fsync policy to the directory of a file that was just replaced."""
+    if fsync_policy != "full":
+        return
+    directory_path = os.path.dirname(file_path) or "."
+    if _in_batch():
+        _batch_state.directories.add(directory_path)
+        return
+    _fsync_directory(directory_path)
+
+@contextmanager
+def fsync_batch() -> Iterator[None]:
+    """
+    Defers the directory fsyncs of replaced files, and the fsyncs of files
+    appended to in place, to the end of the batch, so each directory and
+    file is synced once however often it was written. Replaced files still
+    have their contents synced before the rename. Changes are visible right
+    away, but only durable once the batch exits. Each write still follows
+    the policy it was given. A batch covers the writes of the thread that
+    entered it; other threads sync as usual. Batches nest; only the
+    outermost one syncs.
+    """
+    if not _in_batch():
+        _batch_state.files = set()
+        _batch_state.directories = set()
+    _batch_state.depth = getattr(_batch_state, "depth", 0) + 1
+    try:
+        yield
+    finally:
+        _batch_state.depth -= 1
+        if _batch_state.depth == 0:
+            files = _batch_state.files
+            directories = _batch_state.directories
+            _batch_state.files = set()
+            _batch_state.directories = set()
+            for file_path in files:
+                _fsync_path(file_path)
+            for directory_path in directories:
+                _fsync_directory(directory_path)
+
+def atomic_write_text(file_path: str, text: str, fsync_policy: str = "none") -> None:
+    """
+    Writes text to a temporary file in the same directory and renames it over
+    the target, so readers never see a partially written file.
+    """
+    atomic_write_lines(file_path, (text,), fsync_policy)
+
+def atomic_write_lines(file_path: str, lines: Iterable[str], fsync_policy: str = "none") -> None:
+    """Like atomic_write_text, but streams the content from an iterable of strings."""
+    directory_path = os.path.dirname(file_path) or "."
+    ensure_directory_exists(directory_path)
+    
+    try:
+        mode = os.stat(file_path).st_mode & 0o777
+    except FileNotFoundError:
+        mode = _DEFAULT_FILE_MODE
+    
+    fd, temp_path = tempfile.mkstemp(
+        prefix=f".{os.path.basename(file_path)}.", suffix=".tmp", dir=directory_path
+    )
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.writelines(lines)
+            _sync_before_replace(file, fsync_policy)
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    
+    _sync_after_replace(file_path, fsync_policy)
+
+# errno values meaning the filesystem can't hard-link the file
+_LINK_UNSUPPORTED = {errno.EPERM, errno.EXDEV, errno.EMLINK, errno.EOPNOTSUPP, errno.ENOTSUP}
+
+def link_file(source_path: str, target_path: str, fsync_policy: str = "none") -> bool:
+    """
+    Atomically makes target_path a hard link to source_path, replacing any
+    existing file. Returns False if the filesystem doesn't support hard links.
+    """
+    directory_path = os.path.dirname(target_path) or "."
+    ensure_directory_exists(directory_path)
+    
+    # Link under a temporary name first, since os.link won't replace a file.
+    # The name is random, and os.link fails rather than reuse an existing one.
+    while True:
+        temp_path = os.path.join(
+            directory_path, f".{os.path.basename(target_path)}.{os.urandom(8).hex()}.lnk"
+        )
+        try:
+            os.link(source_path, temp_path)
+            break
+        except FileExistsError:
+            continue
+        except OSError as error:
+            if error.errno in _LINK_UNSUPPORTED:
+                return False
+            raise
+    
+    try:
+        os.replace(temp_path, target_path)
+    finally:
+        # rename() leaves both names in place if they were already links to the same file
+        delete_file(temp_path)
+    
+    _sync_after_replace(target_path, fsync_policy)
+    return True
+
+def move_file(source_path: str, target_path: str, fsync_policy: str = "none") -> None:
+    """
+    Moves a file (or directory) with an atomic rename, replacing any existing
+    target file. Files are copied instead only when the target is on another
+    filesystem.
+    """
+    directory_path = os.path.dirname(target_path) or "."
+    ensure_directory_exists(directory_path)
+    
+    try:
+        os.replace(source_path, target_path)
+    except OSError as error:
+        if error.errno != errno.EXDEV or os.path.isdir(source_path):
+            raise
+        fd, temp_path = tempfile.mkstemp(
+            prefix=f".{os.path.basename(target_path)}.", suffix=".tmp", dir=directory_path
+        )
+        os.close(fd)
+        try:
+            shutil.copy2(source_path, temp_path)
+            if fsync_policy != "none":
+                _fsync_path(temp_path)
+            os.replace(temp_path, target_path)
+        except BaseException:
+            delete_file(temp_path)
+            raise
+        os.remove(source_path)
+    
+    _sync_after_replace(source_path, fsync_policy)
+    _sync_after_replace(target_path, fsync_policy)
+
 def read_json_file(file_path: str) -> Optional[Dict[str, Any]]:
     """Reads and returns the contents of a JSON file."""
     try:
@@ -18,11 +254,9 @@ def read_json_file(file_path: str) -> Optional[Dict[str, Any]]:
         # If the file exists but isn't valid JSON, return None
         return None
 
-def write_json_file(file_path: str, data: Dict[str, Any]) -> None:
-    """Writes data to a JSON file."""
-    ensure_directory_exists(os.path.dirname(file_path))
-    with open(file_path, 'w', encoding='utf-8') as file:
-        json.dump(data, file, indent=2)
+def write_json_file(file_path: str, data: Dict[str, Any], fsync_policy: str = "none") -> None:
+    """Writes data to a JSON file atomically."""
+    atomic_write_text(file_path, json.dumps(data, indent=2), fsync_policy)
 
 def read_text_file(file_path: str) -> Optional[str]:
     """Reads and returns the contents of a text file."""
@@ -32,11 +266,164 @@ def read_text_file(file_path: str) -> Optional[str]:
     except FileNotFoundError:
         return None
 
-def write_text_file(file_path: str, text: str, mode: str = 'w') -> None:
-    """Writes text to a file."""
+def write_text_file(file_path: str, text: str, mode: str = 'w', fsync_policy: str = "none") -> None:
+    """Writes text to a file. Overwrites ('w') are atomic."""
+    if mode == 'w':
+        atomic_write_text(file_path, text, fsync_policy)
+        return
+    
     ensure_directory_exists(os.path.dirname(file_path))
     with open(file_path, mode, encoding='utf-8') as file:
         file.write(text)
+        _sync_after_write(file, file_path, fsync_policy)
+
+def iter_text_lines(file_path: str) -> Iterator[str]:
+    """Yields the lines of a text file (with line endings); nothing if it doesn't exist."""
+    try:
+        file = open(file_path, 'r', encoding='utf-8')
+    except FileNotFoundError:
+        return
+    with file:
+        yield from file
+
+def iter_byte_range_lines(file_path: str, start: int, end: int) -> Iterator[str]:
+    """
+    Yields the lines of a text file between two byte offsets, which must fall
+    on line boundaries. Yields nothing if the file doesn't exist.
+    """
+    try:
+        file = open(file_path, 'rb')
+    except FileNotFoundError:
+        return
+    with file:
+        file.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            line = file.readline(remaining)
+            if not line:
+                break
+            remaining -= len(line)
+            yield line.decode('utf-8')
+
+def iter_line_offsets(file_path: str, start: int = 0,
+                      end: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+    """
+    Yields (byte offset, line) for the lines of a text file between two byte
+    offsets on line boundaries (to the end of the file if end is None).
+    The file is opened right away, so the lines come from the version of the
+    file that existed when this was called. Yields nothing if it doesn't exist.
+    """
+    try:
+        file = open(file_path, 'rb')
+    except FileNotFoundError:
+        return iter(())
+    return _read_line_offsets(file, start, end)
+
+def _read_line_offsets(file: BinaryIO, start: int, end: Optional[int]) -> Iterator[Tuple[int, str]]:
+    """Read (offset, line) pairs forwards from an open file."""
+    with file:
+        file.seek(start)
+        offset = start
+        for line in iter(file.readline, b''):
+            if end is not None and offset >= end:
+                break
+            yield offset, line.decode('utf-8')
+            offset += len(line)
+
+def iter_line_offsets_reversed(file_path: str, start: int = 0, end: Optional[int] = None,
+                               block_size: int = 64 * 1024) -> Iterator[Tuple[int, str]]:
+    """
+    Like iter_line_offsets, but yields the lines last first, reading the
+    file backwards in blocks so memory use is bounded by the longest line.
+    """
+    try:
+        file = open(file_path, 'rb')
+    except FileNotFoundError:
+        return iter(())
+    return _read_line_offsets_reversed(file, start, end, block_size)
+
+def _read_line_offsets_reversed(file: BinaryIO, start: int, end: Optional[int],
+                                block_size: int) -> Iterator[Tuple[int, str]]:
+    """Read (offset, line) pairs backwards from an open file."""
+    with file:
+        position = file.seek(0, os.SEEK_END) if end is None else end
+        # Bytes read but not yielded yet; they start at position
+        pending = b''
+        while position > start:
+            size = min(block_size, position - start)
+            position -= size
+            file.seek(position)
+            pending = file.read(size) + pending
+            
+            # Until the start is reached the first line may be incomplete
+            cut = 0
+            if position > start:
+                cut = pending.find(b'\n') + 1
+                if cut == 0:
+                    continue
+            
+            lines = pending[cut:].split(b'\n')
+            offset = position + len(pending)
+            if lines[-1] == b'':
+                lines.pop()
+            else:
+                # A last line without a newline
+                offset -= len(lines[-1])
+                yield offset, lines.pop().decode('utf-8')
+            for line in reversed(lines):
+                offset -= len(line) + 1
+                yield offset, (line + b'\n').decode('utf-8')
+            pending = pending[:cut]
+
+def read_tail_lines(file_path: str, n_lines: int, start_offset: int = 0,
+                    block_size: int = 64 * 1024) -> Optional[List[str]]:
+    """
+    Returns the last n_lines lines of a text file (without line endings),
+    reading backwards from the end in blocks so only the tail is loaded.
+    Bytes before start_offset are never returned. Returns None if the file
+    doesn't exist.
+    """
+    try:
+        file = open(file_path, 'rb')
+    except FileNotFoundError:
+        return None
+    
+    blocks = []
+    with file:
+        if n_lines <= 0:
+            return []
+        position = file.seek(0, os.SEEK_END)
+        newlines = 0
+        # One newline more than needed guarantees the first wanted line is complete
+        while position > start_offset and newlines <= n_lines:
+            size = min(block_size, position - start_offset)
+            position -= size
+            file.seek(position)
+            block = file.read(size)
+            blocks.append(block)
+            newlines += block.count(b'\n')
+    
+    # Splitting on b'\n' never cuts a UTF-8 character, so each line decodes cleanly
+    lines = b''.join(reversed(blocks)).split(b'\n')
+    if lines[-1] == b'':
+        lines.pop()
+    if position > start_offset:
+        lines = lines[1:]
+    return [
+        (line[:-1] if line.endswith(b'\r') else line).decode('utf-8')
+        for line in lines[-n_lines:]
+    ]
+
+def split_lines(text: str) -> List[str]:
+    """
+    Splits text into lines that keep their trailing newline, so joining them
+    gives back the original text. Empty text gives one empty line.
+    """
+    lines = text.split('\n')
+    result = [line + '\n' for line in lines[:-1]]
+    if lines[-1] or not result:
+        result.append(lines[-1])
+    return result
 
 def list_files(directory_path: str, extension: Optional[str] = None) -> List[str]:
     """Lists all files in a directory with an optional extension filter."""
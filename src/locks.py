@@ -0,0 +1,235 @@
+import os
+import threading
+from threading import get_ident
+from zlib import crc32
+from typing import Dict, Any, List, Optional
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; locks then only cover the current process
+    fcntl = None
+
+from .file_utils import ensure_directory_exists
+
+class ReadWriteLock:
+    """
+    A lock held by any number of readers or by one writer. Both are
+    reentrant, and the writer may also read; upgrading a read to a write is
+    an error because two upgrading readers would deadlock. Waiting writers
+    keep new readers out so they aren't starved.
+    With a path, the write lock is also held across processes by an
+    advisory flock on that file. Readers don't take it: stores replace
+    files atomically (or append whole messages), so a reader in another
+    process always sees a complete version, and skipping the system calls
+    keeps reads cheap.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """Initialize the lock, shared with other processes through path if given."""
+        self.path = path if fcntl is not None else None
+        self._mutex = threading.Lock()
+        self._condition = threading.Condition(self._mutex)
+        self._readers = 0
+        # Read depth of each thread holding a read lock
+        self._read_depths: Dict[int, int] = {}
+        self._writer: Optional[int] = None
+        self._writer_depth = 0
+        self._writers_waiting = 0
+        self._fd: Optional[int] = None
+        self._fd_pid = 0
+        # Reusable context managers, so the common single-key case allocates nothing
+        self.reading = _Reading(self)
+        self.writing = _Writing(self)
+
+    def acquire_read(self) -> None:
+        """Wait until there's no writer (other than this thread) and take a read lock."""
+        me = get_ident()
+        with self._mutex:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+
+            depth = self._read_depths.get(me, 0)
+            if depth == 0:
+                while self._writer is not None or self._writers_waiting:
+                    self._condition.wait()
+            self._readers += 1
+            self._read_depths[me] = depth + 1
+
+    def release_read(self) -> None:
+        """Release a read lock."""
+        me = get_ident()
+        with self._mutex:
+            if self._writer == me:
+                # A read nested in this thread's write
+                self._writer_depth -= 1
+                return
+
+            depth = self._read_depths.pop(me) - 1
+            if depth:
+                self._read_depths[me] = depth
+            self._readers -= 1
+            if self._readers == 0 and self._writers_waiting:
+                self._condition.notify_all()
+
+    def acquire_write(self) -> None:
+        """Wait until there are no other readers or writer and take the write lock."""
+        me = get_ident()
+        with self._mutex:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            if me in self._read_depths:
+                raise RuntimeError("Cannot upgrade a read lock to a write lock")
+
+            if self._writer is not None or self._readers:
+                self._writers_waiting += 1
+                try:
+                    while self._writer is not None or self._readers:
+                        self._condition.wait()
+                finally:
+                    self._writers_waiting -= 1
+
+            # Reserve the lock in this process before waiting for other processes
+            self._writer = me
+            self._writer_depth = 1
+
+        if self.path is not None:
+            # Outside the mutex, so other threads can still release reads
+            # and queue up while this one waits for the file lock
+            try:
+                self._lock_file()
+            except BaseException:
+                with self._mutex:
+                    self._writer = None
+                    self._writer_depth = 0
+                    self._condition.notify_all()
+                raise
+
+    def release_write(self) -> None:
+        """Release the write lock."""
+        with self._mutex:
+            self._writer_depth -= 1
+            if self._writer_depth == 0:
+                self._writer = None
+                if self.path is not None:
+                    self._unlock_file()
+                self._condition.notify_all()
+
+    def _lock_file(self) -> None:
+        """Take the lock file, blocking until other processes release it."""
+        if self._fd is None or self._fd_pid != os.getpid():
+            # A descriptor inherited through fork shares its lock with the parent
+            try:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            except FileNotFoundError:
+                ensure_directory_exists(os.path.dirname(self.path))
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            self._fd_pid = os.getpid()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def _unlock_file(self) -> None:
+        """Release the lock file."""
+        if self._fd_pid == os.getpid():
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+class StripedLocks:
+    """
+    Reader/writer locks by key (e.g. UUID). Keys are hashed onto a fixed
+    number of stripes, so memory use doesn't grow with the number of keys;
+    unrelated keys sharing a stripe just wait for each other occasionally.
+    Several keys are locked in stripe order, so multi-key callers can't
+    deadlock each other. With a directory, each stripe is also locked
+    across processes through a lock file there.
+    """
+
+    def __init__(self, stripes: int = 64, directory: Optional[str] = None, name: str = "locks"):
+        """Initialize the stripes, with lock files <directory>/<name>-<n>.lock if given."""
+        self._stripes = [
+            ReadWriteLock(f"{directory}/{name}-{stripe}.lock" if directory else None)
+            for stripe in range(max(1, stripes))
+        ]
+
+    def _locks_for(self, keys: tuple) -> List[ReadWriteLock]:
+        """Get the stripes for some keys, without duplicates, in a fixed order."""
+        stripes = sorted({crc32(key.encode("utf-8")) % len(self._stripes) for key in keys})
+        return [self._stripes[stripe] for stripe in stripes]
+
+    def read(self, *keys: str) -> Any:
+        """Get a context manager that holds read locks for the keys."""
+        if len(keys) == 1:
+            return self._stripes[crc32(keys[0].encode("utf-8")) % len(self._stripes)].reading
+        return _Held(self._locks_for(keys), exclusive=False)
+
+    def write(self, *keys: str) -> Any:
+        """Get a context manager that holds write locks for the keys."""
+        if len(keys) == 1:
+            return self._stripes[crc32(keys[0].encode("utf-8")) % len(self._stripes)].writing
+        return _Held(self._locks_for(keys), exclusive=True)
+
+class _Reading:
+    """Context manager holding a read lock."""
+    __slots__ = ("lock",)
+
+    def __init__(self, lock: ReadWriteLock):
+        self.lock = lock
+
+    def __enter__(self) -> None:
+        self.lock.acquire_read()
+
+    def __exit__(self, *exc_info) -> None:
+        self.lock.release_read()
+
+class _Writing:
+    """Context manager holding a write lock."""
+    __slots__ = ("lock",)
+
+    def __init__(self, lock: ReadWriteLock):
+        self.lock = lock
+
+    def __enter__(self) -> None:
+        self.lock.acquire_write()
+
+    def __exit__(self, *exc_info) -> None:
+        self.lock.release_write()
+
+class _Held:
+    """Context manager that acquires locks in order and releases them in reverse."""
+    __slots__ = ("locks", "exclusive", "acquired")
+
+    def __init__(self, locks: List[ReadWriteLock], exclusive: bool):
+        self.locks = locks
+        self.exclusive = exclusive
+        self.acquired = 0
+
+    def __enter__(self) -> None:
+        try:
+            for lock in self.locks:
+                if self.exclusive:
+                    lock.acquire_write()
+                else:
+                    lock.acquire_read()
+                self.acquired += 1
+        except BaseException:
+            self.__exit__()
+            raise
+
+    def __exit__(self, *exc_info) -> None:
+        while self.acquired:
+            self.acquired -= 1
+            lock = self.locks[self.acquired]
+            if self.exclusive:
+                lock.release_write()
+            else:
+                lock.release_read()
+
+def create_locks(data_dir: str, config: Dict[str, Any], name: str) -> StripedLocks:
+    """
+    Create the locks for one store from the config: lock_stripes stripes,
+    shared with other processes through data/.locks unless process_locks is false.
+    """
+    directory = None
+    if config.get("process_locks", True):
+        directory = f"{data_dir}/.locks"
+    return StripedLocks(config.get("lock_stripes", 64), directory, name)
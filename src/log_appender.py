@@ -0,0 +1,190 @@
+import os
+import time
+import atexit
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Hashable
+
+from .file_utils import check_fsync_policy, ensure_directory_exists, sync_descriptor
+
+_APPEND_FLAGS = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0)
+
+class _OpenLog:
+    """An open append handle together with the messages buffered for it."""
+    __slots__ = ("path", "fd", "buffer", "buffered_bytes", "first_buffered")
+
+    def __init__(self, path: str, fd: int):
+        self.path = path
+        self.fd = fd
+        self.buffer: List[bytes] = []
+        self.buffered_bytes = 0
+        self.first_buffered = 0.0
+
+class LogAppender:
+    """
+    Appends to log files through a bounded pool of open handles.
+    Messages are buffered per log and written with a single O_APPEND write
+    once buffer_size bytes are pending, flush_interval seconds have passed,
+    or flush() is called. The least recently used handles are closed to stay
+    under max_handles. A buffer_size of 0 writes every message immediately.
+    Files with several hard links (shared logs) are never buffered, since
+    they are appended to through more than one key. Each write is synced
+    according to fsync_policy.
+    """
+
+    def __init__(self, max_handles: int = 128, buffer_size: int = 64 * 1024,
+                 flush_interval: float = 1.0, fsync_policy: str = "none"):
+        """Initialize the appender and start the background flusher if buffering."""
+        self.max_handles = max(1, max_handles)
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.fsync_policy = check_fsync_policy(fsync_policy)
+        self._logs: "OrderedDict[Hashable, _OpenLog]" = OrderedDict()
+        self._lock = threading.RLock()
+
+        self._stop_event = threading.Event()
+        self._flusher = None
+        if buffer_size > 0 and flush_interval > 0:
+            self._flusher = threading.Thread(
+                target=self._flush_periodically,
+                name="callisto-log-flusher",
+                daemon=True
+            )
+            self._flusher.start()
+            atexit.register(self.close)
+
+    def append(self, key: Hashable, path: str, text: str) -> None:
+        """Buffer text for the log identified by key, stored at path."""
+        data = text.encode("utf-8")
+        with self._lock:
+            log = self._open(key, path)
+            if not log.buffer:
+                log.first_buffered = time.monotonic()
+            log.buffer.append(data)
+            log.buffered_bytes += len(data)
+            if log.buffered_bytes >= self.buffer_size or self._is_shared(log):
+                self._write(log)
+
+    def is_open(self, key: Hashable) -> bool:
+        """Check if a handle is open for a log (meaning the file exists)."""
+        with self._lock:
+            return key in self._logs
+
+    def flush(self, key: Optional[Hashable] = None) -> None:
+        """Write buffered messages for one log, or for every log."""
+        with self._lock:
+            if key is not None:
+                log = self._logs.get(key)
+                if log is not None:
+                    self._write(log)
+                return
+            for log in self._logs.values():
+                self._write(log)
+
+    def release(self, key: Hashable) -> None:
+        """
+        Flush and close the handle for a log. Must be called before the file
+        is replaced, moved or deleted, or later appends would go to the old file.
+        """
+        with self._lock:
+            log = self._logs.pop(key, None)
+            if log is not None:
+                self._close(log)
+
+    def release_matching(self, prefix: Hashable) -> None:
+        """Release every log whose key is a tuple starting with prefix (e.g. a UUID)."""
+        with self._lock:
+            for key in [key for key in self._logs if isinstance(key, tuple) and key[0] == prefix]:
+                self._close(self._logs.pop(key))
+
+    def close(self) -> None:
+        """Stop the background flusher, flush everything and close all handles."""
+        if self._flusher is not None:
+            self._stop_event.set()
+            self._flusher.join()
+            self._flusher = None
+            atexit.unregister(self.close)
+        with self._lock:
+            while self._logs:
+                self._close(self._logs.popitem(last=False)[1])
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the number of open handles and buffered bytes."""
+        with self._lock:
+            return {
+                "open_handles": len(self._logs),
+                "buffered_bytes": sum(log.buffered_bytes for log in self._logs.values())
+            }
+
+    def _open(self, key: Hashable, path: str) -> _OpenLog:
+        """Get the open handle for a log, opening it (and closing the LRU one) if needed."""
+        log = self._logs.get(key)
+        if log is not None:
+            if log.path == path:
+                self._logs.move_to_end(key)
+                return log
+            # The log moved (e.g. by a reshard in another process)
+            self._close(self._logs.pop(key))
+
+        log = _OpenLog(path, self._open_descriptor(path))
+        self._logs[key] = log
+        while len(self._logs) > self.max_handles:
+            self._close(self._logs.popitem(last=False)[1])
+        return log
+
+    def _open_descriptor(self, path: str) -> int:
+        """Open a log file for appending, creating it (and its directory) if needed."""
+        try:
+            return os.open(path, _APPEND_FLAGS, 0o666)
+        except FileNotFoundError:
+            ensure_directory_exists(os.path.dirname(path))
+            return os.open(path, _APPEND_FLAGS, 0o666)
+
+    def _is_shared(self, log: _OpenLog) -> bool:
+        """
+        Check if a log's file is linked under other names, whose buffers would
+        be written out of order with this one's.
+        """
+        return os.fstat(log.fd).st_nlink > 1
+
+    def _write(self, log: _OpenLog) -> None:
+        """Write a log's buffer with one append."""
+        if not log.buffer:
+            return
+        try:
+            current_inode = os.stat(log.path).st_ino
+        except FileNotFoundError:
+            current_inode = None
+        if current_inode != os.fstat(log.fd).st_ino:
+            # Another process replaced or deleted the file; append to the current one
+            fd = self._open_descriptor(log.path)
+            os.close(log.fd)
+            log.fd = fd
+        data = b"".join(log.buffer)
+        view = memoryview(data)
+        while view:
+            written = os.write(log.fd, view)
+            view = view[written:]
+        log.buffer = []
+        log.buffered_bytes = 0
+        sync_descriptor(log.fd, log.path, self.fsync_policy)
+
+    def _close(self, log: _OpenLog) -> None:
+        """Flush and close a handle."""
+        try:
+            self._write(log)
+        finally:
+            os.close(log.fd)
+
+    def _flush_periodically(self) -> None:
+        """Background loop that writes buffers older than flush_interval."""
+        while not self._stop_event.wait(self.flush_interval / 2):
+            now = time.monotonic()
+            with self._lock:
+                for log in self._logs.values():
+                    if log.buffer and now - log.first_buffered >= self.flush_interval:
+                        try:
+                            self._write(log)
+                        except OSError:
+                            # The buffer is kept and retried on the next pass
+                            pass
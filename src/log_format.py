@@ -0,0 +1,369 @@
+import re
+import json
+from datetime import datetime
+from itertools import chain
+from typing import Dict, Any, List, Iterable, Iterator, Optional, Tuple, NamedTuple
+
+# Logs start with one or more "=== ... ===" lines followed by a blank line
+HEADER_PREFIX = "==="
+
+# Timestamped messages look like "[2025-03-01 14:05:09] message"
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+TIMESTAMP_LENGTH = 19
+_TIMESTAMP_END = TIMESTAMP_LENGTH + 1
+
+# Logs in the "jsonl" format hold one JSON record per line instead, like
+# {"ts":1740837909.0,"speaker":"User","text":"...","metadata":{}} with ts
+# in epoch seconds (or null). ts always comes first so records can be
+# recognized, and their timestamps read, without decoding the whole line.
+LOG_FORMATS = ("text", "jsonl")
+RECORD_PREFIX = '{"ts":'
+_RECORD_PREFIX_BYTES = RECORD_PREFIX.encode()
+
+# Messages often start with who said them, e.g. "User: ..." or "Jupiter: ..."
+_SPEAKER_PATTERN = re.compile(r"([A-Za-z][\w .'-]{0,31}): ")
+
+class Message(NamedTuple):
+    """
+    A message parsed from a log. timestamp and speaker are None if the
+    message has none; offset is where it starts in the log, in bytes.
+    metadata is only set for messages stored as JSON records.
+    """
+    timestamp: Optional[str]
+    speaker: Optional[str]
+    text: str
+    offset: int
+    metadata: Optional[Dict[str, Any]] = None
+
+def header_line_count(lines: Iterable[str]) -> int:
+    """
+    Count the header lines at the start of a log: the "===" lines up to and
+    including the first blank line. Returns 0 if the log has no header.
+    """
+    count = 0
+    for line in lines:
+        if count == 0 and not line.startswith(HEADER_PREFIX):
+            return 0
+        count += 1
+        if line.strip() == "":
+            break
+    return count
+
+def split_header(lines: Iterable[str]) -> Tuple[List[str], Iterator[str]]:
+    """
+    Read the header lines from the start of a stream of lines. Returns them
+    with an iterator over the remaining lines, without reading any further.
+    """
+    lines = iter(lines)
+    header = []
+    for line in lines:
+        if not header and not line.startswith(HEADER_PREFIX):
+            return header, chain((line,), lines)
+        header.append(line)
+        if line.strip() == "":
+            break
+    return header, lines
+
+def body_lines(content: str) -> List[str]:
+    """Split log content into message lines, dropping the header and the final newline."""
+    lines = content.split('\n')
+    if lines and lines[-1] == "":
+        lines.pop()
+    return lines[header_line_count(lines):]
+
+def header_byte_length(file_path: str) -> Optional[int]:
+    """
+    Get the size in bytes of the header at the start of a log file, reading
+    only the header itself. Returns None if the file doesn't exist.
+    """
+    try:
+        file = open(file_path, 'rb')
+    except FileNotFoundError:
+        return None
+    
+    length = 0
+    with file:
+        for line in iter(file.readline, b''):
+            if length == 0 and not line.startswith(HEADER_PREFIX.encode()):
+                return 0
+            length += len(line)
+            if line.strip() == b'':
+                break
+    return length
+
+def line_timestamp(line: str) -> Optional[str]:
+    """
+    Get the "YYYY-MM-DD HH:MM:SS" timestamp of a message line (text or JSON
+    record, in local time), or None if it has none.
+    """
+    if len(line) > _TIMESTAMP_END and line[0] == "[" and line[_TIMESTAMP_END] == "]" \
+            and line[5] == "-" and line[11] == " ":
+        return line[1:_TIMESTAMP_END]
+    if line.startswith(RECORD_PREFIX):
+        return _record_timestamp(line[len(RECORD_PREFIX):line.find(",", len(RECORD_PREFIX))])
+    return None
+
+def line_timestamp_bytes(line: bytes) -> Optional[bytes]:
+    """Like line_timestamp, for a line read in binary mode."""
+    if len(line) > _TIMESTAMP_END and line[0] == 0x5B and line[_TIMESTAMP_END] == 0x5D \
+            and line[5] == 0x2D and line[11] == 0x20:
+        return line[1:_TIMESTAMP_END]
+    if line.startswith(_RECORD_PREFIX_BYTES):
+        start = len(_RECORD_PREFIX_BYTES)
+        timestamp = _record_timestamp(line[start:line.find(b",", start)].decode("ascii", "replace"))
+        return timestamp.encode() if timestamp is not None else None
+    return None
+
+def _record_timestamp(epoch: Any) -> Optional[str]:
+    """Format the ts of a JSON record as a local timestamp, or None if it's null or invalid."""
+    try:
+        # Same result as strftime(TIMESTAMP_FORMAT), several times faster
+        return datetime.fromtimestamp(float(epoch)).isoformat(" ", "seconds")
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+
+def in_date_range(timestamp: str, start_date: Optional[str], end_date: Optional[str]) -> bool:
+    """
+    Check a timestamp against optional bounds. Bounds are compared as strings,
+    so "2025-03-01" as an end date excludes messages later on that day.
+    """
+    if start_date and timestamp < start_date:
+        return False
+    if end_date and timestamp > end_date:
+        return False
+    return True
+
+def lines_in_range(lines: Iterable[str], start_date: Optional[str],
+                   end_date: Optional[str]) -> Iterator[str]:
+    """
+    Yield the message lines timestamped within the dates, together with the
+    untimestamped lines that follow them (continuations of the same message).
+    """
+    keep = not start_date
+    for line in lines:
+        timestamp = line_timestamp(line)
+        if timestamp is not None:
+            keep = in_date_range(timestamp, start_date, end_date)
+        if keep:
+            yield line
+
+def drop_lines_out_of_range(lines: Iterable[str], start_date: Optional[str],
+                            end_date: Optional[str]) -> Iterator[str]:
+    """
+    Yield lines, dropping the timestamped ones outside the dates. Untimestamped
+    lines are always kept, as date pruning has always done.
+    """
+    for line in lines:
+        timestamp = line_timestamp(line)
+        if timestamp is None or in_date_range(timestamp, start_date, end_date):
+            yield line
+
+def lines_with_offsets(lines: Iterable[str], offset: int = 0) -> Iterator[Tuple[int, str]]:
+    """Pair lines with their byte offsets (in UTF-8), the first being at offset."""
+    for line in lines:
+        yield offset, line
+        offset += len(line.encode('utf-8'))
+
+def offset_lines_in_range(entries: Iterable[Tuple[int, str]], start_date: Optional[str],
+                          end_date: Optional[str], reverse: bool = False) -> Iterator[Tuple[int, str]]:
+    """
+    Like lines_in_range, for (offset, line) pairs. With reverse the pairs come
+    newest first, so untimestamped lines are held until the timestamped line
+    they follow shows whether they're kept.
+    """
+    if not reverse:
+        keep = not start_date
+        for entry in entries:
+            timestamp = line_timestamp(entry[1])
+            if timestamp is not None:
+                keep = in_date_range(timestamp, start_date, end_date)
+            if keep:
+                yield entry
+        return
+    
+    held = []
+    for entry in entries:
+        timestamp = line_timestamp(entry[1])
+        if timestamp is None:
+            held.append(entry)
+            continue
+        if in_date_range(timestamp, start_date, end_date):
+            yield from held
+            yield entry
+        held = []
+    if not start_date:
+        yield from held
+
+def starts_message(line: str) -> bool:
+    """
+    Check if a line starts a new message: it's a JSON record, has a
+    timestamp or begins with a speaker.
+    """
+    return line.startswith(RECORD_PREFIX) or line_timestamp(line) is not None \
+        or _SPEAKER_PATTERN.match(line) is not None
+
+def parse_message(offset: int, lines: List[str]) -> Optional[Message]:
+    """Parse the lines of one message, or return None if they're all blank."""
+    if lines[0].startswith(RECORD_PREFIX):
+        record = parse_record(lines[0])
+        if record is not None:
+            return Message(
+                _record_timestamp(record.get("ts")), record.get("speaker"),
+                record.get("text", ""), offset, record.get("metadata")
+            )
+    
+    first = lines[0].rstrip('\r\n')
+    timestamp = line_timestamp(first)
+    if timestamp is not None:
+        first = first[_TIMESTAMP_END + 1:]
+        if first.startswith(" "):
+            first = first[1:]
+    speaker = None
+    match = _SPEAKER_PATTERN.match(first)
+    if match:
+        speaker = match.group(1)
+        first = first[match.end():]
+    
+    text = "\n".join(chain((first,), (line.rstrip('\r\n') for line in lines[1:]))).rstrip("\n")
+    if timestamp is None and speaker is None and not text.strip():
+        return None
+    return Message(timestamp, speaker, text, offset)
+
+def parse_messages(entries: Iterable[Tuple[int, str]], reverse: bool = False) -> Iterator[Message]:
+    """
+    Group the (offset, line) pairs of a log body into messages. A message
+    starts at a line that starts_message, and untimestamped lines without a
+    speaker continue the message before them. With reverse the pairs come
+    newest first, and so do the messages.
+    """
+    held: List[str] = []
+    start = 0
+    if reverse:
+        for offset, line in entries:
+            if held and line.startswith(RECORD_PREFIX):
+                # Records hold whole messages, so lines after one are a message of their own
+                held.reverse()
+                message = parse_message(start, held)
+                if message is not None:
+                    yield message
+                held = []
+            held.append(line)
+            start = offset
+            if starts_message(line):
+                held.reverse()
+                message = parse_message(offset, held)
+                if message is not None:
+                    yield message
+                held = []
+        if held:
+            held.reverse()
+            message = parse_message(start, held)
+            if message is not None:
+                yield message
+        return
+    
+    for offset, line in entries:
+        if held and (starts_message(line) or held[0].startswith(RECORD_PREFIX)):
+            message = parse_message(start, held)
+            if message is not None:
+                yield message
+            held = []
+        if not held:
+            start = offset
+        held.append(line)
+    if held:
+        message = parse_message(start, held)
+        if message is not None:
+            yield message
+
+#
+# JSON records
+#
+
+def format_record(text: str, timestamp: Optional[float] = None, speaker: Optional[str] = None,
+                  metadata: Optional[Dict[str, Any]] = None) -> str:
+    """Format a message as a JSON record line."""
+    record = {"ts": timestamp, "speaker": speaker, "text": text, "metadata": metadata or {}}
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+def format_message_record(message: str, timestamp: Optional[float] = None,
+                          metadata: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Format a message as a JSON record line. The text is stored as given; the
+    speaker comes only from a "speaker" key in metadata, which is moved out
+    of the record's metadata into its speaker field.
+    """
+    speaker = None
+    if metadata and "speaker" in metadata:
+        metadata = dict(metadata)
+        speaker = metadata.pop("speaker")
+        if speaker is not None and not isinstance(speaker, str):
+            raise ValueError(f"Invalid speaker: {speaker!r}")
+    return format_record(message, timestamp, speaker, metadata)
+
+def parse_record(line: str) -> Optional[Dict[str, Any]]:
+    """Decode a JSON record line, or return None if the line isn't one."""
+    if not line.startswith(RECORD_PREFIX):
+        return None
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    return record if isinstance(record, dict) else None
+
+def render_line(line: str) -> str:
+    """Render a JSON record line as "[timestamp] speaker: text"; other lines are returned as they are."""
+    record = parse_record(line)
+    if record is None:
+        return line
+    text = record.get("text", "")
+    if record.get("speaker"):
+        text = f"{record['speaker']}: {text}"
+    timestamp = _record_timestamp(record.get("ts"))
+    if timestamp is not None:
+        text = f"[{timestamp}] {text}"
+    return text + "\n"
+
+def render_text(content: str) -> str:
+    """Render log content in the text format, converting any JSON records."""
+    if RECORD_PREFIX not in content:
+        return content
+    # Split on "\n" only: record text may hold other line separators, like U+2028
+    lines = content.split("\n")
+    rendered = [render_line(line + "\n") for line in lines[:-1]]
+    if lines[-1]:
+        rendered.append(render_line(lines[-1]).rstrip("\n"))
+    return "".join(rendered)
+
+def message_parts(line: str) -> Tuple[Optional[str], str]:
+    """Split a message line (text or JSON record) into its timestamp and its message."""
+    if line.startswith(RECORD_PREFIX):
+        line = render_line(line).rstrip("\n")
+    timestamp = line_timestamp(line)
+    return timestamp, (line[TIMESTAMP_LENGTH + 3:] if timestamp else line)
+
+def records_from_lines(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Convert log lines to JSON record lines, dropping the header. Lines that
+    are already records are kept as they are; text lines are grouped into
+    messages as by parse_messages, and their text (including any "Name: "
+    prefix) is kept verbatim.
+    """
+    _, lines = split_header(lines)
+    text_lines: List[str] = []
+    for line in chain(lines, [None]):
+        if line is not None and not line.startswith(RECORD_PREFIX):
+            text_lines.append(line)
+            continue
+        for message in parse_messages(lines_with_offsets(text_lines)):
+            text = f"{message.speaker}: {message.text}" if message.speaker else message.text
+            yield format_record(text, _epoch(message.timestamp))
+        text_lines = []
+        if line is not None:
+            yield line if line.endswith("\n") else line + "\n"
+
+def _epoch(timestamp: Optional[str]) -> Optional[float]:
+    """Convert a local "YYYY-MM-DD HH:MM:SS" timestamp to epoch seconds."""
+    if timestamp is None:
+        return None
+    return datetime.strptime(timestamp, TIMESTAMP_FORMAT).timestamp()
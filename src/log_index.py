@@ -0,0 +1,177 @@
+import os
+import struct
+from typing import Optional, Tuple
+
+from .log_format import TIMESTAMP_LENGTH, header_byte_length, line_timestamp_bytes
+
+# Index file layout: a header describing how much of the log is covered,
+# followed by one fixed-size record per timestamped message line.
+_MAGIC = b"CLXIDX01"
+_HEADER = struct.Struct("<8sQqQ?")  # magic, covered size, log mtime, records, sorted
+_RECORD = struct.Struct(f"<Q{TIMESTAMP_LENGTH}s")  # line offset, timestamp
+
+def index_path_for(log_path: str) -> str:
+    """Get the path of the sidecar index for a log file (a hidden file next to it)."""
+    directory_path, file_name = os.path.split(log_path)
+    return os.path.join(directory_path, f".{file_name}.idx")
+
+class LogIndex:
+    """
+    Sidecar index of the byte offset and timestamp of every message in a log
+    file, so date ranges can be found by binary search instead of a scan.
+    The index is brought up to date on refresh(): new lines appended to the
+    log are indexed incrementally, and the index is rebuilt if it is missing
+    or doesn't match the log (it shrank, or was changed behind our back).
+    Whoever rewrites a log must call invalidate().
+    """
+
+    def __init__(self, log_path: str):
+        """Initialize the index for a log file."""
+        self.log_path = log_path
+        self.index_path = index_path_for(log_path)
+        self.log_size = 0
+        self.records = 0
+        self.sorted = True
+
+    def invalidate(self) -> None:
+        """Delete the index so it is rebuilt on the next refresh."""
+        try:
+            os.remove(self.index_path)
+        except FileNotFoundError:
+            pass
+
+    def refresh(self) -> bool:
+        """Bring the index up to date with the log. Returns False if the log doesn't exist."""
+        try:
+            stat = os.stat(self.log_path)
+        except FileNotFoundError:
+            self.invalidate()
+            return False
+        self.log_size = stat.st_size
+
+        header = self._read_header()
+        if header is not None:
+            covered, mtime, records, is_sorted = header
+            if covered == stat.st_size and mtime == stat.st_mtime_ns:
+                self.records = records
+                self.sorted = is_sorted
+                return True
+            # A log that changed without growing was edited in place, not appended to
+            if covered < stat.st_size and self._still_matches(covered, records):
+                self._extend(covered, records, is_sorted)
+                return True
+
+        self._rebuild()
+        return True
+
+    def offset_range(self, start_date: Optional[str] = None,
+                     end_date: Optional[str] = None) -> Optional[Tuple[int, int]]:
+        """
+        Get the byte range of the log holding messages timestamped between the
+        dates (inclusive, compared as strings), with the untimestamped lines
+        that follow them. Call refresh() first. Returns None if the timestamps
+        are out of order, in which case the range isn't contiguous.
+        """
+        if not self.sorted:
+            return None
+
+        with open(self.index_path, 'rb') as file:
+            if start_date:
+                first = self._lower_bound(file, start_date.encode(), strict=False)
+                start = self._record(file, first)[0] if first < self.records else self.log_size
+            else:
+                start = header_byte_length(self.log_path) or 0
+
+            if end_date:
+                last = self._lower_bound(file, end_date.encode(), strict=True)
+                end = self._record(file, last)[0] if last < self.records else self.log_size
+            else:
+                end = self.log_size
+
+        return (start, max(start, end))
+
+    def _read_header(self) -> Optional[Tuple[int, int, int, bool]]:
+        """Read the index header, or None if the index is missing or corrupt."""
+        try:
+            with open(self.index_path, 'rb') as file:
+                data = file.read(_HEADER.size)
+                size = os.fstat(file.fileno()).st_size
+        except FileNotFoundError:
+            return None
+
+        if len(data) < _HEADER.size:
+            return None
+        magic, covered, mtime, records, is_sorted = _HEADER.unpack(data)
+        if magic != _MAGIC or size < _HEADER.size + records * _RECORD.size:
+            return None
+        return covered, mtime, records, is_sorted
+
+    def _still_matches(self, covered: int, records: int) -> bool:
+        """Check that the covered part of the log looks unchanged, so it can be extended."""
+        if covered == 0:
+            return True
+        with open(self.log_path, 'rb') as log_file:
+            log_file.seek(covered - 1)
+            if log_file.read(1) != b'\n':
+                return False
+            if records == 0:
+                return True
+            with open(self.index_path, 'rb') as index_file:
+                offset, timestamp = self._record(index_file, records - 1)
+            log_file.seek(offset)
+            return line_timestamp_bytes(log_file.readline()) == timestamp
+
+    def _rebuild(self) -> None:
+        """Index the whole log from scratch."""
+        with open(self.index_path, 'wb') as file:
+            file.write(_HEADER.pack(_MAGIC, 0, 0, 0, True))
+        self._extend(0, 0, True)
+
+    def _extend(self, covered: int, records: int, is_sorted: bool) -> None:
+        """Index the complete lines written to the log after covered."""
+        with open(self.index_path, 'r+b') as index_file:
+            last_timestamp = None
+            if records > 0:
+                last_timestamp = self._record(index_file, records - 1)[1]
+
+            index_file.seek(_HEADER.size + records * _RECORD.size)
+            index_file.truncate()
+            with open(self.log_path, 'rb') as log_file:
+                mtime = os.fstat(log_file.fileno()).st_mtime_ns
+                log_file.seek(covered)
+                offset = covered
+                for line in log_file:
+                    if not line.endswith(b'\n'):
+                        break  # Partly written; indexed once it is complete
+                    timestamp = line_timestamp_bytes(line)
+                    if timestamp is not None:
+                        if last_timestamp is not None and timestamp < last_timestamp:
+                            is_sorted = False
+                        index_file.write(_RECORD.pack(offset, timestamp))
+                        last_timestamp = timestamp
+                        records += 1
+                    offset += len(line)
+
+            # The header goes last, so a crash leaves at worst unused records
+            index_file.seek(0)
+            index_file.write(_HEADER.pack(_MAGIC, offset, mtime, records, is_sorted))
+
+        self.records = records
+        self.sorted = is_sorted
+
+    def _record(self, file, position: int) -> Tuple[int, bytes]:
+        """Read the record at a position in the index."""
+        file.seek(_HEADER.size + position * _RECORD.size)
+        return _RECORD.unpack(file.read(_RECORD.size))
+
+    def _lower_bound(self, file, date: bytes, strict: bool) -> int:
+        """Find the first record whose timestamp is >= date (or > date if strict)."""
+        low, high = 0, self.records
+        while low < high:
+            middle = (low + high) // 2
+            timestamp = self._record(file, middle)[1]
+            if timestamp < date or (strict and timestamp == date):
+                low = middle + 1
+            else:
+                high = middle
+        return low
@@ -0,0 +1,300 @@
+import os
+import json
+import queue
+import hashlib
+import threading
+import time
+from contextlib import ExitStack
+from typing import Dict, Any, List, Optional, Tuple, Callable, Iterable
+
+from .storage_backend import StorageBackend, create_backend
+
+# Queue items are ("user", uuid, data), ("log", uuid, log_name, lines, first),
+# ("done", uuid, checksum) or ("error", uuid, message)
+_QUEUE_SIZE = 64
+
+def parse_backend_spec(spec: str) -> Tuple[str, str]:
+    """Split a backend spec such as "files:./data" into ("files", "./data")."""
+    name, separator, path = spec.partition(":")
+    if not separator or not name or not path:
+        raise ValueError(f"Invalid backend spec: {spec} (expected <backend>:<data_dir>)")
+    return name, path
+
+def open_backend(spec: str) -> StorageBackend:
+    """Create the backend described by a spec such as "sqlite:./data"."""
+    name, path = parse_backend_spec(spec)
+    return create_backend(name, path)
+
+class _UserDigest:
+    """SHA-256 over a user's record and logs, independent of how lines are chunked."""
+
+    def __init__(self):
+        self._hash = hashlib.sha256()
+
+    def add_record(self, data: Optional[Dict[str, Any]]) -> None:
+        record = json.dumps(data, sort_keys=True) if data is not None else "<no record>"
+        self._hash.update(record.encode("utf-8"))
+
+    def add_log(self, log_name: str) -> None:
+        self._hash.update(f"\0log:{log_name}\0".encode("utf-8"))
+
+    def add_text(self, text: str) -> None:
+        self._hash.update(text.encode("utf-8"))
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+def checksum_user(backend: StorageBackend, uuid_string: str) -> str:
+    """Compute the migration checksum of a user's record and logs."""
+    digest = _UserDigest()
+    digest.add_record(backend.read_user(uuid_string))
+    for log_name in sorted(backend.list_logs(uuid_string)):
+        digest.add_log(log_name)
+        for line in backend.iter_log_lines(uuid_string, log_name):
+            digest.add_text(line)
+    return digest.hexdigest()
+
+class _Checkpoint:
+    """Append-only file of fully migrated users and their checksums."""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.done: Dict[str, str] = {}
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    parts = line.split()
+                    if len(parts) == 2:
+                        self.done[parts[0]] = parts[1]
+
+    def record(self, entries: List[Tuple[str, str]]) -> None:
+        """Record users whose data has been committed to the target."""
+        for uuid_string, checksum in entries:
+            self.done[uuid_string] = checksum
+        if not self.path or not entries:
+            return
+        with open(self.path, 'a', encoding='utf-8') as file:
+            file.writelines(f"{uuid_string} {checksum}\n" for uuid_string, checksum in entries)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def clear(self) -> None:
+        """Forget every recorded user and remove the file."""
+        self.done = {}
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+class Migration:
+    """
+    Copies every user record and conversation log from one backend to another.
+    Reader threads stream data into a bounded queue and a writer thread commits
+    it to the target in batches, so memory stays flat regardless of log size.
+    With a checkpoint file, an interrupted migration resumes where it left off.
+    """
+
+    def __init__(self, source: StorageBackend, target: StorageBackend,
+                 checkpoint_path: Optional[str] = None, readers: int = 4,
+                 batch_size: int = 500, chunk_lines: int = 1000,
+                 progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 report_interval: float = 5.0):
+        """Initialize the migration. progress is called with the stats every report_interval seconds."""
+        self.source = source
+        self.target = target
+        self.checkpoint = _Checkpoint(checkpoint_path)
+        self.readers = max(1, readers)
+        self.batch_size = max(1, batch_size)
+        self.chunk_lines = max(1, chunk_lines)
+        self.progress = progress
+        self.report_interval = report_interval
+
+        self.stats: Dict[str, Any] = {
+            "users": 0,
+            "skipped_users": 0,
+            "logs": 0,
+            "lines": 0,
+            "bytes": 0,
+            "errors": [],
+            "elapsed": 0.0
+        }
+        self._queue: "queue.Queue[tuple]" = queue.Queue(maxsize=_QUEUE_SIZE)
+        self._stop = threading.Event()
+        self._started = 0.0
+
+    def run(self, verify: bool = True) -> Dict[str, Any]:
+        """Run the migration and return its stats (including verification results)."""
+        self._started = time.monotonic()
+        uuids = sorted(set(self.source.list_users()) | set(self.source.list_log_owners()))
+        pending = [uuid_string for uuid_string in uuids if uuid_string not in self.checkpoint.done]
+        self.stats["skipped_users"] = len(uuids) - len(pending)
+
+        work: "queue.Queue[str]" = queue.Queue()
+        for uuid_string in pending:
+            work.put(uuid_string)
+
+        threads = [
+            threading.Thread(target=self._read_users, args=(work,), daemon=True)
+            for _ in range(min(self.readers, max(1, len(pending))))
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            self._write_items(expected=len(pending))
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+
+        self._update_throughput()
+        if verify:
+            self.stats["verification"] = self.verify(uuids)
+        return self.stats
+
+    def verify(self, uuids: Iterable[str]) -> Dict[str, Any]:
+        """Compare user counts and per-user checksums between the checkpoint and the target."""
+        uuids = list(uuids)
+        target_uuids = set(self.target.list_users()) | set(self.target.list_log_owners())
+        missing = [uuid_string for uuid_string in uuids if uuid_string not in target_uuids]
+        mismatched = [
+            uuid_string for uuid_string in uuids
+            if uuid_string in self.checkpoint.done and uuid_string in target_uuids
+            and checksum_user(self.target, uuid_string) != self.checkpoint.done[uuid_string]
+        ]
+        return {
+            "source_users": len(uuids),
+            "target_users": len(target_uuids),
+            "missing": missing,
+            "checksum_mismatches": mismatched,
+            "ok": not missing and not mismatched and not self.stats["errors"]
+        }
+
+    def _put(self, item: tuple) -> bool:
+        """Queue an item for the writer; gives up if the migration is stopping."""
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _read_users(self, work: "queue.Queue[str]") -> None:
+        """Reader thread: stream users from the source into the queue."""
+        while not self._stop.is_set():
+            try:
+                uuid_string = work.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                if not self._read_user(uuid_string):
+                    return
+            except Exception as error:
+                if not self._put(("error", uuid_string, f"{type(error).__name__}: {error}")):
+                    return
+
+    def _read_user(self, uuid_string: str) -> bool:
+        """Stream one user's record and logs. Returns False if the migration stopped."""
+        digest = _UserDigest()
+        data = self.source.read_user(uuid_string)
+        digest.add_record(data)
+        if data is not None and not self._put(("user", uuid_string, data)):
+            return False
+
+        for log_name in sorted(self.source.list_logs(uuid_string)):
+            digest.add_log(log_name)
+            chunk: List[str] = []
+            first = True
+            for line in self.source.iter_log_lines(uuid_string, log_name):
+                digest.add_text(line)
+                chunk.append(line)
+                if len(chunk) >= self.chunk_lines:
+                    if not self._put(("log", uuid_string, log_name, chunk, first)):
+                        return False
+                    chunk = []
+                    first = False
+            if first or chunk:
+                if not self._put(("log", uuid_string, log_name, chunk, first)):
+                    return False
+
+        return self._put(("done", uuid_string, digest.hexdigest()))
+
+    def _write_items(self, expected: int) -> None:
+        """Writer loop: apply queued items to the target, committing every batch_size items."""
+        finished = 0
+        last_report = time.monotonic()
+        with ExitStack() as batch:
+            batch.enter_context(self.target.batch())
+            in_batch = 0
+            completed: List[Tuple[str, str]] = []
+
+            while finished < expected:
+                try:
+                    item = self._queue.get(timeout=1.0)
+                except queue.Empty:
+                    item = None
+
+                if item is not None:
+                    kind = item[0]
+                    if kind == "user":
+                        self.target.write_user(item[1], item[2])
+                    elif kind == "log":
+                        self._write_log_chunk(*item[1:])
+                    elif kind == "done":
+                        completed.append((item[1], item[2]))
+                        self.stats["users"] += 1
+                        finished += 1
+                    elif kind == "error":
+                        self.stats["errors"].append({"uuid": item[1], "error": item[2]})
+                        finished += 1
+                    in_batch += 1
+
+                if in_batch >= self.batch_size or (item is None and in_batch):
+                    # Commit, then checkpoint the users that are now durable
+                    batch.close()
+                    self.checkpoint.record(completed)
+                    completed = []
+                    in_batch = 0
+                    batch.enter_context(self.target.batch())
+
+                if self.progress and time.monotonic() - last_report >= self.report_interval:
+                    last_report = time.monotonic()
+                    self._update_throughput()
+                    self.progress(dict(self.stats))
+
+            batch.close()
+            self.checkpoint.record(completed)
+
+    def _write_log_chunk(self, uuid_string: str, log_name: str,
+                         lines: List[str], first: bool) -> None:
+        """Write one chunk of a log; the first chunk replaces any existing content."""
+        if first:
+            self.target.write_log_lines(uuid_string, log_name, lines)
+            self.stats["logs"] += 1
+        else:
+            self.target.append_log(uuid_string, log_name, "".join(lines))
+        self.stats["lines"] += len(lines)
+        self.stats["bytes"] += sum(len(line.encode("utf-8")) for line in lines)
+
+    def _update_throughput(self) -> None:
+        """Refresh the elapsed time and rates in the stats."""
+        elapsed = time.monotonic() - self._started
+        self.stats["elapsed"] = elapsed
+        self.stats["users_per_second"] = self.stats["users"] / elapsed if elapsed else 0.0
+        self.stats["lines_per_second"] = self.stats["lines"] / elapsed if elapsed else 0.0
+        self.stats["megabytes_per_second"] = (
+            self.stats["bytes"] / (1024 * 1024) / elapsed if elapsed else 0.0
+        )
+
+def migrate(source_spec: str, target_spec: str, **options: Any) -> Dict[str, Any]:
+    """Migrate between two backend specs such as "files:./data" and "sqlite:./new_data"."""
+    verify = options.pop("verify", True)
+    if parse_backend_spec(source_spec) == parse_backend_spec(target_spec):
+        raise ValueError("Source and target must be different")
+
+    source = open_backend(source_spec)
+    target = open_backend(target_spec)
+    try:
+        return Migration(source, target, **options).run(verify=verify)
+    finally:
+        source.close()
+        target.close()
@@ -0,0 +1,294 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Callable
+
+from .config import parse_size
+from .conversation_store import ConversationStore
+from .locks import create_locks
+from .log_format import TIMESTAMP_FORMAT, line_timestamp
+from .migrate import _Checkpoint
+from .search_index import create_search_index
+from .storage_backend import create_backend
+from .vector_index import create_vector_index
+
+# Supported policy keys:
+#   "max_age_days" - drop messages older than this many days
+#   "max_lines"    - keep at most this many lines per log
+#   "max_size"     - keep at most this many bytes of messages per log ("10MB" or an int)
+# Logs left without any messages are deleted.
+POLICY_KEYS = ("max_age_days", "max_lines", "max_size")
+
+# Per-process conversation store used by pool workers
+_worker_store: Optional[ConversationStore] = None
+
+def normalize_policy(policy: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate a retention policy and convert max_size to bytes."""
+    unknown = [key for key in policy if key not in POLICY_KEYS]
+    if unknown:
+        raise ValueError(f"Invalid retention policy keys: {', '.join(unknown)}")
+    if not any(policy.get(key) is not None for key in POLICY_KEYS):
+        raise ValueError("Retention policy must set at least one of: " + ", ".join(POLICY_KEYS))
+
+    normalized = dict(policy)
+    if normalized.get("max_size") is not None:
+        normalized["max_size"] = parse_size(normalized["max_size"])
+    return normalized
+
+def retention_cutoff(policy: Dict[str, Any], now: Optional[datetime] = None) -> Optional[str]:
+    """Get the timestamp before which messages are dropped, or None if there is no age limit."""
+    if policy.get("max_age_days") is None:
+        return None
+    now = now or datetime.now()
+    return (now - timedelta(days=policy["max_age_days"])).strftime(TIMESTAMP_FORMAT)
+
+def apply_retention_to_user(store: ConversationStore, uuid_string: str,
+                            policy: Dict[str, Any], cutoff: Optional[str]) -> Dict[str, Any]:
+    """Apply a normalized policy to every log of one user and report what changed."""
+    started = time.monotonic()
+    backend = store.backend
+    result = {
+        "uuid": uuid_string,
+        "worker": os.getpid(),
+        "logs": 0,
+        "pruned_logs": 0,
+        "deleted_logs": 0,
+        "bytes_before": 0,
+        "bytes_after": 0
+    }
+
+    for log_name in backend.list_logs(uuid_string):
+        size = backend.log_size(uuid_string, log_name)
+        if size is None:
+            continue
+        result["logs"] += 1
+        result["bytes_before"] += size
+
+        if not _needs_pruning(store, uuid_string, log_name, size, policy, cutoff):
+            result["bytes_after"] += size
+            continue
+
+        store.prune_conversation(
+            uuid_string, log_name,
+            keep_lines=policy.get("max_lines"),
+            start_date=cutoff,
+            keep_bytes=policy.get("max_size")
+        )
+        result["pruned_logs"] += 1
+
+        if store.tail(uuid_string, log_name, 1) == []:
+            store.delete_conversation(uuid_string, log_name)
+            result["deleted_logs"] += 1
+            continue
+        result["bytes_after"] += backend.log_size(uuid_string, log_name) or 0
+
+    result["elapsed"] = time.monotonic() - started
+    return result
+
+def _needs_pruning(store: ConversationStore, uuid_string: str, log_name: str,
+                   size: int, policy: Dict[str, Any], cutoff: Optional[str]) -> bool:
+    """Check cheaply whether a log breaks the policy, so compliant logs aren't rewritten."""
+    if policy.get("max_size") is not None and size > policy["max_size"]:
+        return True
+
+    max_lines = policy.get("max_lines")
+    if max_lines is not None:
+        tail = store.tail(uuid_string, log_name, max_lines + 1)
+        if tail is not None and len(tail) > max_lines:
+            return True
+
+    if cutoff is not None:
+        # Messages are in time order, so only the oldest one matters
+        for line in store.backend.iter_log_range(uuid_string, log_name):
+            timestamp = line_timestamp(line)
+            if timestamp is not None:
+                return timestamp < cutoff
+
+    return False
+
+def _open_store(backend_name: str, data_dir: str, config: Dict[str, Any]) -> ConversationStore:
+    """Open a conversation store of its own (with the search and vector indexes, if enabled)."""
+    # Retention never appends, so it doesn't need a buffering appender
+    backend = create_backend(backend_name, data_dir, dict(config, log_buffer_size=0))
+    return ConversationStore(
+        data_dir, backend=backend,
+        search_index=create_search_index(data_dir, config),
+        vector_index=create_vector_index(data_dir, config),
+        locks=create_locks(data_dir, config, "logs"),
+        log_format=config.get("log_format", "text")
+    )
+
+def _init_worker(backend_name: str, data_dir: str, config: Dict[str, Any]) -> None:
+    """Pool initializer: open this worker's own store."""
+    global _worker_store
+    _worker_store = _open_store(backend_name, data_dir, config)
+
+def _apply_in_worker(uuid_string: str, policy: Dict[str, Any], cutoff: Optional[str]) -> Dict[str, Any]:
+    """Pool task: apply the policy to one user."""
+    return apply_retention_to_user(_worker_store, uuid_string, policy, cutoff)
+
+class Retention:
+    """
+    Applies a retention policy to the logs of every user with a pool of
+    worker processes. With a checkpoint file, an interrupted run resumes
+    where it left off; the file is removed once every user has been
+    processed without errors. rate_limit caps the log bytes scanned per second,
+    so the job can run alongside normal traffic.
+    """
+
+    def __init__(self, backend_name: str, data_dir: str, policy: Dict[str, Any],
+                 config: Optional[Dict[str, Any]] = None, workers: int = 4,
+                 checkpoint_path: Optional[str] = None,
+                 rate_limit: Optional[int] = None,
+                 progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 report_interval: float = 5.0):
+        """
+        Initialize the job. workers=0 runs in this process instead of a pool.
+        progress is called with the stats every report_interval seconds.
+        """
+        self.backend_name = backend_name
+        self.data_dir = data_dir
+        self.policy = normalize_policy(policy)
+        self.config = config or {}
+        self.workers = max(0, workers)
+        self.checkpoint = _Checkpoint(checkpoint_path)
+        self.rate_limit = rate_limit
+        self.progress = progress
+        self.report_interval = report_interval
+
+        self.stats: Dict[str, Any] = {
+            "users": 0,
+            "skipped_users": 0,
+            "logs": 0,
+            "pruned_logs": 0,
+            "deleted_logs": 0,
+            "bytes_before": 0,
+            "bytes_after": 0,
+            "bytes_reclaimed": 0,
+            "errors": [],
+            "workers": {},
+            "elapsed": 0.0
+        }
+        self._started = 0.0
+
+    def run(self) -> Dict[str, Any]:
+        """Run the job and return its stats."""
+        self._started = time.monotonic()
+        cutoff = retention_cutoff(self.policy)
+
+        store = _open_store(self.backend_name, self.data_dir, self.config)
+        try:
+            uuids = sorted(store.backend.list_log_owners())
+            if self.workers == 0:
+                pending = self._pending(uuids)
+                last_report = time.monotonic()
+                for uuid_string in pending:
+                    try:
+                        self._record(apply_retention_to_user(store, uuid_string, self.policy, cutoff))
+                    except Exception as error:
+                        self._record_error(uuid_string, error)
+                    self._throttle()
+                    last_report = self._report(last_report)
+            else:
+                self._run_pool(self._pending(uuids), cutoff)
+        finally:
+            store.backend.close()
+            for index in store._indexes():
+                index.close()
+
+        # The checkpoint only resumes this run, so a later run with the same
+        # file must start over; users that failed keep it for a retry
+        if not self.stats["errors"]:
+            self.checkpoint.clear()
+        self._update_throughput()
+        return self.stats
+
+    def _pending(self, uuids: List[str]) -> List[str]:
+        """Filter out users finished by an earlier run."""
+        pending = [uuid_string for uuid_string in uuids if uuid_string not in self.checkpoint.done]
+        self.stats["skipped_users"] = len(uuids) - len(pending)
+        return pending
+
+    def _run_pool(self, pending: List[str], cutoff: Optional[str]) -> None:
+        """Hand users to the worker processes, keeping a bounded number in flight."""
+        last_report = time.monotonic()
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(self.backend_name, self.data_dir, self.config)
+        ) as pool:
+            in_flight: Dict[Future, str] = {}
+            remaining = iter(pending)
+            exhausted = False
+
+            while in_flight or not exhausted:
+                while not exhausted and len(in_flight) < self.workers * 2:
+                    uuid_string = next(remaining, None)
+                    if uuid_string is None:
+                        exhausted = True
+                        break
+                    in_flight[pool.submit(_apply_in_worker, uuid_string, self.policy, cutoff)] = uuid_string
+
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, timeout=self.report_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    uuid_string = in_flight.pop(future)
+                    try:
+                        self._record(future.result())
+                    except Exception as error:
+                        self._record_error(uuid_string, error)
+                if done:
+                    self._throttle()
+                last_report = self._report(last_report)
+
+    def _record(self, result: Dict[str, Any]) -> None:
+        """Add one user's result to the stats and the checkpoint."""
+        self.stats["users"] += 1
+        for key in ("logs", "pruned_logs", "deleted_logs", "bytes_before", "bytes_after"):
+            self.stats[key] += result[key]
+        reclaimed = result["bytes_before"] - result["bytes_after"]
+        self.stats["bytes_reclaimed"] += reclaimed
+
+        worker = self.stats["workers"].setdefault(
+            result["worker"], {"users": 0, "logs": 0, "bytes": 0, "busy_seconds": 0.0}
+        )
+        worker["users"] += 1
+        worker["logs"] += result["logs"]
+        worker["bytes"] += result["bytes_before"]
+        worker["busy_seconds"] += result["elapsed"]
+        self.checkpoint.record([(result["uuid"], str(reclaimed))])
+
+    def _record_error(self, uuid_string: str, error: Exception) -> None:
+        """Record a user that failed; it isn't checkpointed, so a rerun retries it."""
+        self.stats["errors"].append({"uuid": uuid_string, "error": f"{type(error).__name__}: {error}"})
+
+    def _throttle(self) -> None:
+        """Sleep long enough to keep the bytes scanned under rate_limit per second."""
+        if not self.rate_limit:
+            return
+        expected = self.stats["bytes_before"] / self.rate_limit
+        elapsed = time.monotonic() - self._started
+        if expected > elapsed:
+            time.sleep(expected - elapsed)
+
+    def _report(self, last_report: float) -> float:
+        """Call the progress callback if report_interval has passed."""
+        if not self.progress or time.monotonic() - last_report < self.report_interval:
+            return last_report
+        self._update_throughput()
+        self.progress(dict(self.stats))
+        return time.monotonic()
+
+    def _update_throughput(self) -> None:
+        """Refresh the elapsed time and rates in the stats."""
+        elapsed = time.monotonic() - self._started
+        self.stats["elapsed"] = elapsed
+        self.stats["users_per_second"] = self.stats["users"] / elapsed if elapsed else 0.0
+        self.stats["megabytes_per_second"] = (
+            self.stats["bytes_before"] / (1024 * 1024) / elapsed if elapsed else 0.0
+        )
+        for worker in self.stats["workers"].values():
+            busy = worker["busy_seconds"]
+            worker["megabytes_per_second"] = worker["bytes"] / (1024 * 1024) / busy if busy else 0.0
@@ -0,0 +1,210 @@
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Iterable, Iterator, Tuple
+
+from .file_utils import ensure_directory_exists
+from .log_format import HEADER_PREFIX, message_parts
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    uuid TEXT NOT NULL,
+    log_name TEXT NOT NULL,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS documents_by_log ON documents (uuid, log_name);
+CREATE VIRTUAL TABLE IF NOT EXISTS postings USING fts5(
+    message,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+# Words in a query; everything else is ignored so user input can't break FTS5 syntax
+_QUERY_TERM = re.compile(r"\w+", re.UNICODE)
+
+class SearchIndex:
+    """
+    Full-text index of conversation messages, ranked with BM25.
+    Each message line is a document recording the user, log and timestamp
+    it came from. The inverted index is an SQLite FTS5 table, so it lives on
+    disk and queries don't depend on the total size of the logs.
+    Lines are written as soon as they are added, under the caller's lock on
+    the log, so none are lost in a crash and another process reindexing the
+    same log can't index them twice.
+    """
+
+    def __init__(self, db_path: str):
+        """Initialize the index, creating the database if needed."""
+        self.db_path = db_path
+        ensure_directory_exists(os.path.dirname(db_path) or ".")
+        self._connection = sqlite3.connect(
+            db_path, isolation_level=None, timeout=30, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        try:
+            self._connection.executescript(_SCHEMA)
+        except sqlite3.OperationalError as error:
+            self._connection.close()
+            if "fts5" not in str(error):
+                raise
+            raise RuntimeError(
+                f"SQLite {sqlite3.sqlite_version} was built without FTS5, which the search index "
+                "needs; set \"search_index\": false in the config"
+            ) from error
+        self._lock = threading.RLock()
+
+    def add_lines(self, uuid_string: str, log_name: str, lines: Iterable[str]) -> None:
+        """Index lines appended to a log."""
+        with self._lock:
+            with self._transaction():
+                self._insert((uuid_string, log_name, line) for line in lines)
+
+    def replace_log(self, uuid_string: str, log_name: str, lines: Iterable[str]) -> None:
+        """Reindex a log whose content was replaced."""
+        with self._lock:
+            with self._transaction():
+                self._delete(uuid_string, log_name)
+                self._insert((uuid_string, log_name, line) for line in lines)
+
+    def delete_log(self, uuid_string: str, log_name: str) -> None:
+        """Remove a log from the index."""
+        with self._lock:
+            with self._transaction():
+                self._delete(uuid_string, log_name)
+
+    def move_log(self, source_uuid: str, log_name: str,
+                 target_uuid: str, target_log_name: str) -> None:
+        """Record that a log was moved to another user or name."""
+        with self._lock:
+            with self._transaction():
+                self._delete(target_uuid, target_log_name)
+                self._connection.execute(
+                    "UPDATE documents SET uuid = ?, log_name = ? WHERE uuid = ? AND log_name = ?",
+                    (target_uuid, target_log_name, source_uuid, log_name)
+                )
+
+    def move_user(self, source_uuid: str, target_uuid: str) -> None:
+        """Record that all of a user's logs were moved to a user without logs."""
+        with self._lock:
+            with self._transaction():
+                self._connection.execute(
+                    "DELETE FROM postings WHERE rowid IN (SELECT id FROM documents WHERE uuid = ?)",
+                    (target_uuid,)
+                )
+                self._connection.execute("DELETE FROM documents WHERE uuid = ?", (target_uuid,))
+                self._connection.execute(
+                    "UPDATE documents SET uuid = ? WHERE uuid = ?", (target_uuid, source_uuid)
+                )
+
+    def flush(self) -> None:
+        """Nothing is queued, since lines are written as they are added."""
+
+    def search(self, query: str, uuid_string: Optional[str] = None,
+               limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Find the messages that best match the words in query, optionally for
+        one user only. Results are ordered by BM25 score, best first.
+        """
+        terms = _QUERY_TERM.findall(query)
+        if not terms or limit <= 0:
+            return []
+        match = " OR ".join(f'"{term}"' for term in terms)
+
+        sql = (
+            "SELECT documents.uuid, documents.log_name, documents.timestamp, "
+            "postings.message, bm25(postings) AS rank "
+            "FROM postings JOIN documents ON documents.id = postings.rowid "
+            "WHERE postings MATCH ?"
+        )
+        parameters: List[Any] = [match]
+        if uuid_string is not None:
+            sql += " AND documents.uuid = ?"
+            parameters.append(uuid_string)
+        sql += " ORDER BY rank LIMIT ?"
+        parameters.append(limit)
+
+        with self._lock:
+            rows = self._connection.execute(sql, parameters).fetchall()
+
+        return [
+            {
+                "uuid": row[0],
+                "log_name": row[1],
+                "timestamp": row[2],
+                "line": f"[{row[2]}] {row[3]}" if row[2] else row[3],
+                # FTS5 reports BM25 negated so that smaller sorts first
+                "score": -row[4]
+            }
+            for row in rows
+        ]
+
+    def stats(self) -> Dict[str, int]:
+        """Get the number of indexed messages and logs."""
+        with self._lock:
+            documents, logs = self._connection.execute(
+                "SELECT count(*), count(DISTINCT uuid || '/' || log_name) FROM documents"
+            ).fetchone()
+        return {"messages": documents, "logs": logs}
+
+    def clear(self) -> None:
+        """Remove everything from the index."""
+        with self._lock:
+            with self._transaction():
+                self._connection.execute("DELETE FROM documents")
+                self._connection.execute("DELETE FROM postings")
+
+    def close(self) -> None:
+        """Close the database."""
+        with self._lock:
+            self._connection.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run statements in a transaction."""
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._connection
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
+
+    def _insert(self, entries: Iterable[Tuple[str, str, str]]) -> None:
+        """Index message lines, skipping blank lines and log headers."""
+        cursor = self._connection.cursor()
+        for uuid_string, log_name, line in entries:
+            line = line.rstrip("\n")
+            if not line.strip() or line.startswith(HEADER_PREFIX):
+                continue
+            # The timestamp is stored separately so its digits don't match queries
+            timestamp, message = message_parts(line)
+            cursor.execute(
+                "INSERT INTO documents (uuid, log_name, timestamp) VALUES (?, ?, ?)",
+                (uuid_string, log_name, timestamp)
+            )
+            cursor.execute(
+                "INSERT INTO postings (rowid, message) VALUES (?, ?)",
+                (cursor.lastrowid, message)
+            )
+
+    def _delete(self, uuid_string: str, log_name: str) -> None:
+        """Remove every document of a log."""
+        self._connection.execute(
+            "DELETE FROM postings WHERE rowid IN "
+            "(SELECT id FROM documents WHERE uuid = ? AND log_name = ?)",
+            (uuid_string, log_name)
+        )
+        self._connection.execute(
+            "DELETE FROM documents WHERE uuid = ? AND log_name = ?",
+            (uuid_string, log_name)
+        )
+
+def create_search_index(data_dir: str, config: Dict[str, Any]) -> Optional[SearchIndex]:
+    """Create the search index described by config, or None if it isn't enabled."""
+    if not config.get("search_index", False):
+        return None
+    return SearchIndex(os.path.join(data_dir, "search.db"))
@@ -0,0 +1,460 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple, Iterator, Iterable, Callable
+
+from .file_utils import check_fsync_policy, ensure_directory_exists, split_lines
+from .storage_backend import StorageBackend
+from .log_format import HEADER_PREFIX, offset_lines_in_range
+
+# Rows fetched per query by iter_log_offsets
+_PAGE_SIZE = 512
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    uuid TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    uuid TEXT NOT NULL,
+    log_name TEXT NOT NULL,
+    line TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_by_log ON messages (uuid, log_name, id);
+"""
+
+class SQLiteBackend(StorageBackend):
+    """
+    Stores users and logs in a single SQLite database in WAL mode.
+    Each log is a run of rows in the messages table, one row per line,
+    so appends are single inserts. A log always has at least one row,
+    and only its last row may lack a trailing newline.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, db_path: str, fsync_policy: str = "none"):
+        """
+        Initialize the backend, creating the database if needed. Any
+        fsync_policy but "none" makes every commit durable (synchronous=FULL).
+        """
+        self.db_path = db_path
+        self.fsync_policy = check_fsync_policy(fsync_policy)
+        ensure_directory_exists(os.path.dirname(db_path) or ".")
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's connection, opening it on first use."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Autocommit mode; multi-statement writes use explicit transactions
+            connection = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            synchronous = "NORMAL" if self.fsync_policy == "none" else "FULL"
+            connection.execute(f"PRAGMA synchronous={synchronous}")
+            self._local.connection = connection
+            self._local.depth = 0
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run statements in a transaction, joining an enclosing batch if there is one."""
+        connection = self._connection()
+        if self._local.depth > 0:
+            yield connection
+            return
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Group writes from this thread into a single transaction."""
+        connection = self._connection()
+        if self._local.depth == 0:
+            connection.execute("BEGIN IMMEDIATE")
+        self._local.depth += 1
+        try:
+            yield
+        except BaseException:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                connection.execute("ROLLBACK")
+            raise
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            connection.execute("COMMIT")
+
+    def close(self) -> None:
+        """Close every connection opened by this backend."""
+        with self._connections_lock:
+            for connection in self._connections:
+                try:
+                    connection.close()
+                except sqlite3.ProgrammingError:
+                    # Connections can only be closed from their own thread
+                    pass
+            self._connections = []
+        self._local = threading.local()
+
+    #
+    # Users
+    #
+
+    def user_location(self, uuid_string: str) -> str:
+        """Get a description of where a user's data is stored."""
+        return f"{self.db_path}#users/{uuid_string}"
+
+    def user_version(self, uuid_string: str) -> Optional[Tuple[int, int]]:
+        """Get the (version, size) of a user row."""
+        row = self._connection().execute(
+            "SELECT version, length(data) FROM users WHERE uuid = ?", (uuid_string,)
+        ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def user_exists(self, uuid_string: str) -> bool:
+        """Check if a user row exists."""
+        row = self._connection().execute(
+            "SELECT 1 FROM users WHERE uuid = ?", (uuid_string,)
+        ).fetchone()
+        return row is not None
+
+    def read_user(self, uuid_string: str) -> Optional[Dict[str, Any]]:
+        """Read a user row."""
+        row = self._connection().execute(
+            "SELECT data FROM users WHERE uuid = ?", (uuid_string,)
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            return json.loads(row[0])
+        except json.JSONDecodeError:
+            return None
+
+    def write_user(self, uuid_string: str, data: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+        """Write a user row and return its new version."""
+        text = json.dumps(data, indent=2)
+        version = time.time_ns()
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO users (uuid, data, version) VALUES (?, ?, ?)",
+                (uuid_string, text, version)
+            )
+        return (version, len(text))
+
+    def delete_user(self, uuid_string: str) -> bool:
+        """Delete a user row."""
+        with self._transaction() as connection:
+            cursor = connection.execute("DELETE FROM users WHERE uuid = ?", (uuid_string,))
+        return cursor.rowcount > 0
+
+    def list_users(self) -> List[str]:
+        """List all user UUIDs."""
+        rows = self._connection().execute("SELECT uuid FROM users").fetchall()
+        return [row[0] for row in rows]
+
+    def scan_users(self) -> Iterator[Tuple[str, Any, int]]:
+        """Yield (uuid, version, size) for every user row in one query."""
+        rows = self._connection().execute(
+            "SELECT uuid, version, length(data) FROM users"
+        ).fetchall()
+        for row in rows:
+            yield row[0], row[1], row[2]
+
+    #
+    # Conversation logs
+    #
+
+    def user_logs_location(self, uuid_string: str) -> str:
+        """Get a description of where a user's logs are stored."""
+        return f"{self.db_path}#logs/{uuid_string}"
+
+    def list_log_owners(self) -> List[str]:
+        """List the UUIDs that have rows in the messages table."""
+        rows = self._connection().execute("SELECT DISTINCT uuid FROM messages").fetchall()
+        return [row[0] for row in rows]
+
+    def log_location(self, uuid_string: str, log_name: str) -> str:
+        """Get a description of where a log is stored."""
+        return f"{self.db_path}#logs/{uuid_string}/{log_name}.txt"
+
+    def log_exists(self, uuid_string: str, log_name: str) -> bool:
+        """Check if a log has any rows."""
+        row = self._connection().execute(
+            "SELECT 1 FROM messages WHERE uuid = ? AND log_name = ? LIMIT 1",
+            (uuid_string, log_name)
+        ).fetchone()
+        return row is not None
+
+    def log_size(self, uuid_string: str, log_name: str) -> Optional[int]:
+        """Get the size of a log in bytes from its rows."""
+        row = self._connection().execute(
+            "SELECT count(*), sum(length(CAST(line AS BLOB))) FROM messages "
+            "WHERE uuid = ? AND log_name = ?",
+            (uuid_string, log_name)
+        ).fetchone()
+        return row[1] if row[0] else None
+
+    def read_log(self, uuid_string: str, log_name: str) -> Optional[str]:
+        """Read a log by joining its rows in order."""
+        rows = self._connection().execute(
+            "SELECT line FROM messages WHERE uuid = ? AND log_name = ? ORDER BY id",
+            (uuid_string, log_name)
+        ).fetchall()
+        if not rows:
+            return None
+        return "".join(row[0] for row in rows)
+
+    def write_log(self, uuid_string: str, log_name: str, content: str) -> str:
+        """Replace a log's rows."""
+        with self._transaction() as connection:
+            connection.execute(
+                "DELETE FROM messages WHERE uuid = ? AND log_name = ?",
+                (uuid_string, log_name)
+            )
+            self._insert_lines(connection, uuid_string, log_name, split_lines(content))
+        return self.log_location(uuid_string, log_name)
+
+    def iter_log_lines(self, uuid_string: str, log_name: str) -> Iterator[str]:
+        """Yield a log's rows in order without loading them all."""
+        cursor = self._connection().execute(
+            "SELECT line FROM messages WHERE uuid = ? AND log_name = ? ORDER BY id",
+            (uuid_string, log_name)
+        )
+        for row in cursor:
+            yield row[0]
+
+    def write_log_lines(self, uuid_string: str, log_name: str, lines: Iterable[str]) -> str:
+        """Replace a log's rows from a stream of lines."""
+        with self._transaction() as connection:
+            connection.execute(
+                "DELETE FROM messages WHERE uuid = ? AND log_name = ?",
+                (uuid_string, log_name)
+            )
+            inserted = self._insert_lines(connection, uuid_string, log_name, lines)
+            if inserted == 0:
+                # Keep a row so the empty log still exists
+                self._insert_lines(connection, uuid_string, log_name, [""])
+        return self.log_location(uuid_string, log_name)
+
+    def tail_log(self, uuid_string: str, log_name: str, n_lines: int) -> Optional[List[str]]:
+        """Read the last lines of a log by walking its rows backwards from the newest."""
+        connection = self._connection()
+        body_start = self._body_start_id(connection, uuid_string, log_name)
+        if body_start is None:
+            return None
+        if n_lines <= 0:
+            return []
+        
+        cursor = connection.execute(
+            "SELECT line FROM messages WHERE uuid = ? AND log_name = ? AND id >= ? ORDER BY id DESC",
+            (uuid_string, log_name, body_start)
+        )
+        rows = []
+        newlines = 0
+        complete = True
+        for (line,) in cursor:
+            if newlines > n_lines:
+                complete = False
+                break
+            rows.append(line)
+            newlines += line.count("\n")
+        cursor.close()
+        
+        lines = "".join(reversed(rows)).split("\n")
+        if lines[-1] == "":
+            lines.pop()
+        if not complete:
+            # The oldest row read may continue a line from an earlier row
+            lines = lines[1:]
+        return lines[-n_lines:]
+
+    def iter_log_offsets(self, uuid_string: str, log_name: str,
+                         start_date: Optional[str] = None,
+                         end_date: Optional[str] = None,
+                         reverse: bool = False) -> Iterator[Tuple[int, str]]:
+        """
+        Read a log's rows a page at a time, walking them backwards from the
+        newest for reverse. No query stays open between pages, so the
+        iterator can be used from any thread.
+        """
+        connection = self._connection()
+        body_start = self._body_start_id(connection, uuid_string, log_name)
+        if body_start is None:
+            return iter(())
+        
+        if reverse:
+            offset = self.log_size(uuid_string, log_name) or 0
+        else:
+            offset = connection.execute(
+                "SELECT coalesce(sum(length(CAST(line AS BLOB))), 0) FROM messages "
+                "WHERE uuid = ? AND log_name = ? AND id < ?",
+                (uuid_string, log_name, body_start)
+            ).fetchone()[0]
+        entries = self._iter_row_offsets(uuid_string, log_name, body_start, offset, reverse)
+        if start_date or end_date:
+            entries = offset_lines_in_range(entries, start_date, end_date, reverse)
+        return entries
+
+    def _iter_row_offsets(self, uuid_string: str, log_name: str, body_start: int,
+                          offset: int, reverse: bool) -> Iterator[Tuple[int, str]]:
+        """Yield (offset, row) from body_start on, or back to it, offset being where the walk starts."""
+        if reverse:
+            query = ("SELECT id, line FROM messages WHERE uuid = ? AND log_name = ? "
+                     "AND id >= ? AND id < ? ORDER BY id DESC LIMIT ?")
+            last_id = 2 ** 63 - 1
+        else:
+            query = ("SELECT id, line FROM messages WHERE uuid = ? AND log_name = ? "
+                     "AND id >= ? AND id > ? ORDER BY id LIMIT ?")
+            last_id = body_start - 1
+        
+        while True:
+            rows = self._connection().execute(
+                query, (uuid_string, log_name, body_start, last_id, _PAGE_SIZE)
+            ).fetchall()
+            for last_id, line in rows:
+                size = len(line.encode("utf-8"))
+                if reverse:
+                    offset -= size
+                yield offset, line
+                if not reverse:
+                    offset += size
+            if len(rows) < _PAGE_SIZE:
+                return
+
+    def rewrite_log_lines(self, uuid_string: str, log_name: str,
+                          transform: Callable[[Iterator[str]], Iterable[str]]) -> bool:
+        """
+        Stream a log's rows through transform into rows under a temporary name,
+        then swap them in, all in one transaction.
+        """
+        # Log names can't contain NUL, so this can't collide with a real log
+        temp_name = f"{log_name}\0rewrite"
+        with self._transaction() as connection:
+            if not self.log_exists(uuid_string, log_name):
+                return False
+            inserted = self._insert_lines(
+                connection, uuid_string, temp_name,
+                transform(self.iter_log_lines(uuid_string, log_name))
+            )
+            if inserted == 0:
+                self._insert_lines(connection, uuid_string, temp_name, [""])
+            connection.execute(
+                "DELETE FROM messages WHERE uuid = ? AND log_name = ?",
+                (uuid_string, log_name)
+            )
+            connection.execute(
+                "UPDATE messages SET log_name = ? WHERE uuid = ? AND log_name = ?",
+                (log_name, uuid_string, temp_name)
+            )
+        return True
+
+    def append_log(self, uuid_string: str, log_name: str, text: str) -> str:
+        """Append rows to a log."""
+        lines = split_lines(text)
+        with self._transaction() as connection:
+            last = connection.execute(
+                "SELECT id, line FROM messages WHERE uuid = ? AND log_name = ? "
+                "ORDER BY id DESC LIMIT 1",
+                (uuid_string, log_name)
+            ).fetchone()
+            if last is not None and not last[1].endswith("\n"):
+                # Continue an unterminated last line, so rows stay whole lines
+                connection.execute(
+                    "UPDATE messages SET line = line || ? WHERE id = ?", (lines[0], last[0])
+                )
+                lines = lines[1:]
+            self._insert_lines(connection, uuid_string, log_name, lines)
+        return self.log_location(uuid_string, log_name)
+
+    def delete_log(self, uuid_string: str, log_name: str) -> bool:
+        """Delete a log's rows."""
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "DELETE FROM messages WHERE uuid = ? AND log_name = ?",
+                (uuid_string, log_name)
+            )
+        return cursor.rowcount > 0
+
+    def list_logs(self, uuid_string: str) -> List[str]:
+        """List the names of a user's logs."""
+        rows = self._connection().execute(
+            "SELECT DISTINCT log_name FROM messages WHERE uuid = ?", (uuid_string,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def move_log(self, source_uuid: str, log_name: str,
+                 target_uuid: str, target_log_name: str) -> str:
+        """Move a log by relabelling its rows."""
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE messages SET uuid = ?, log_name = ? WHERE uuid = ? AND log_name = ?",
+                (target_uuid, target_log_name, source_uuid, log_name)
+            )
+        return self.log_location(target_uuid, target_log_name)
+
+    def move_all_logs(self, source_uuid: str, target_uuid: str) -> Optional[List[str]]:
+        """Relabel all of a user's rows with one update, if the target user has no logs."""
+        with self._transaction() as connection:
+            if connection.execute(
+                "SELECT 1 FROM messages WHERE uuid = ? LIMIT 1", (target_uuid,)
+            ).fetchone() is not None:
+                return None
+            log_names = [
+                row[0] for row in connection.execute(
+                    "SELECT DISTINCT log_name FROM messages WHERE uuid = ? ORDER BY log_name",
+                    (source_uuid,)
+                )
+            ]
+            connection.execute(
+                "UPDATE messages SET uuid = ? WHERE uuid = ?", (target_uuid, source_uuid)
+            )
+        return [self.log_location(target_uuid, log_name) for log_name in log_names]
+
+    def _body_start_id(self, connection: sqlite3.Connection, uuid_string: str,
+                       log_name: str) -> Optional[int]:
+        """Get the id of the first row after a log's header, or None if the log doesn't exist."""
+        cursor = connection.execute(
+            "SELECT id, line FROM messages WHERE uuid = ? AND log_name = ? ORDER BY id",
+            (uuid_string, log_name)
+        )
+        try:
+            first = cursor.fetchone()
+            if first is None:
+                return None
+            if not first[1].startswith(HEADER_PREFIX):
+                return first[0]
+            
+            row = first
+            while row is not None:
+                if row[1].strip() == "":
+                    return row[0] + 1
+                last_id = row[0]
+                row = cursor.fetchone()
+            return last_id + 1
+        finally:
+            cursor.close()
+
+    def _insert_lines(self, connection: sqlite3.Connection, uuid_string: str,
+                      log_name: str, lines: Iterable[str]) -> int:
+        """Insert lines at the end of a log. Returns the number of rows inserted."""
+        cursor = connection.executemany(
+            "INSERT INTO messages (uuid, log_name, line) VALUES (?, ?, ?)",
+            ((uuid_string, log_name, line) for line in lines)
+        )
+        return cursor.rowcount
@@ -0,0 +1,872 @@
+import os
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple, Iterator, Iterable, Callable
+
+from .file_utils import (
+    check_fsync_policy,
+    ensure_directory_exists,
+    read_json_file,
+    write_json_file,
+    read_text_file,
+    write_text_file,
+    link_file,
+    move_file,
+    atomic_write_lines,
+    iter_text_lines,
+    iter_byte_range_lines,
+    iter_line_offsets,
+    iter_line_offsets_reversed,
+    split_lines,
+    read_tail_lines,
+    list_files,
+    delete_file,
+    fsync_batch
+)
+from .log_appender import LogAppender
+from .log_format import (
+    body_lines,
+    header_byte_length,
+    split_header,
+    lines_in_range,
+    lines_with_offsets,
+    offset_lines_in_range
+)
+from .log_index import LogIndex, index_path_for
+from .locks import StripedLocks
+
+class StorageBackend:
+    """
+    Interface for the storage behind UserStore and ConversationStore.
+    Backends only move data; UUID validation, headers, timestamps and
+    merging stay in the stores. Log names are given without the .txt extension.
+    """
+
+    name = "base"
+
+    #
+    # Users
+    #
+
+    def user_location(self, uuid_string: str) -> str:
+        """Get a description of where a user's data is stored."""
+        raise NotImplementedError
+
+    def user_version(self, uuid_string: str) -> Optional[Tuple[int, int]]:
+        """
+        Get a (version token, size in bytes) pair for a user record, or None if
+        it doesn't exist. The token changes whenever the record is rewritten.
+        """
+        raise NotImplementedError
+
+    def user_exists(self, uuid_string: str) -> bool:
+        """Check if a user record exists."""
+        raise NotImplementedError
+
+    def read_user(self, uuid_string: str) -> Optional[Dict[str, Any]]:
+        """Read a user record, or None if it doesn't exist or is unreadable."""
+        raise NotImplementedError
+
+    def write_user(self, uuid_string: str, data: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+        """Write a user record and return its new version."""
+        raise NotImplementedError
+
+    def delete_user(self, uuid_string: str) -> bool:
+        """Delete a user record. Returns False if it didn't exist."""
+        raise NotImplementedError
+
+    def list_users(self) -> List[str]:
+        """List the UUIDs of all stored users."""
+        raise NotImplementedError
+
+    def scan_users(self) -> Iterator[Tuple[str, Any, int]]:
+        """Yield (uuid, version token, size) for every stored user."""
+        for uuid_string in self.list_users():
+            version = self.user_version(uuid_string)
+            if version is not None:
+                yield uuid_string, version[0], version[1]
+
+    #
+    # Conversation logs
+    #
+
+    def user_logs_location(self, uuid_string: str) -> str:
+        """Get a description of where a user's logs are stored."""
+        raise NotImplementedError
+
+    def list_log_owners(self) -> List[str]:
+        """List the UUIDs that have logs stored (with or without a user record)."""
+        raise NotImplementedError
+
+    def log_location(self, uuid_string: str, log_name: str) -> str:
+        """Get a description of where a log is stored."""
+        raise NotImplementedError
+
+    def log_exists(self, uuid_string: str, log_name: str) -> bool:
+        """Check if a log exists."""
+        raise NotImplementedError
+
+    def read_log(self, uuid_string: str, log_name: str) -> Optional[str]:
+        """Read the full content of a log, or None if it doesn't exist."""
+        raise NotImplementedError
+
+    def write_log(self, uuid_string: str, log_name: str, content: str) -> str:
+        """Replace the content of a log. Returns the log's location."""
+        raise NotImplementedError
+
+    def iter_log_lines(self, uuid_string: str, log_name: str) -> Iterator[str]:
+        """
+        Yield the content of a log in pieces (normally one line each, with its
+        newline) whose concatenation is the full log. Yields nothing if it doesn't exist.
+        """
+        content = self.read_log(uuid_string, log_name)
+        if content is not None:
+            yield from split_lines(content)
+
+    def write_log_lines(self, uuid_string: str, log_name: str, lines: Iterable[str]) -> str:
+        """Replace the content of a log from a stream of lines. Returns the log's location."""
+        return self.write_log(uuid_string, log_name, "".join(lines))
+
+    def tail_log(self, uuid_string: str, log_name: str, n_lines: int) -> Optional[List[str]]:
+        """
+        Get the last n_lines lines of a log after its header, without line
+        endings, or None if it doesn't exist.
+        """
+        content = self.read_log(uuid_string, log_name)
+        if content is None:
+            return None
+        return body_lines(content)[-n_lines:] if n_lines > 0 else []
+
+    def log_size(self, uuid_string: str, log_name: str) -> Optional[int]:
+        """Get the size of a log in bytes (UTF-8), or None if it doesn't exist."""
+        if not self.log_exists(uuid_string, log_name):
+            return None
+        return sum(len(line.encode("utf-8")) for line in self.iter_log_lines(uuid_string, log_name))
+
+    def read_log_header(self, uuid_string: str, log_name: str) -> Optional[str]:
+        """Read the "===" header at the start of a log, or None if the log doesn't exist."""
+        if not self.log_exists(uuid_string, log_name):
+            return None
+        header, _ = split_header(self.iter_log_lines(uuid_string, log_name))
+        return "".join(header)
+
+    def read_log_range(self, uuid_string: str, log_name: str,
+                       start_date: Optional[str] = None,
+                       end_date: Optional[str] = None) -> Optional[str]:
+        """
+        Read the messages of a log timestamped between the dates (inclusive),
+        without the header. Returns None if the log doesn't exist.
+        """
+        if not self.log_exists(uuid_string, log_name):
+            return None
+        return "".join(self.iter_log_range(uuid_string, log_name, start_date, end_date))
+
+    def iter_log_range(self, uuid_string: str, log_name: str,
+                       start_date: Optional[str] = None,
+                       end_date: Optional[str] = None) -> Iterator[str]:
+        """Like read_log_range, but yields the lines. Yields nothing if the log doesn't exist."""
+        _, lines = split_header(self.iter_log_lines(uuid_string, log_name))
+        return lines_in_range(lines, start_date, end_date)
+
+    def iter_log_offsets(self, uuid_string: str, log_name: str,
+                         start_date: Optional[str] = None,
+                         end_date: Optional[str] = None,
+                         reverse: bool = False) -> Iterator[Tuple[int, str]]:
+        """
+        Yield (byte offset, line) for the lines of a log after its header,
+        optionally only those in a date range as in iter_log_range. Lines come
+        newest first if reverse. Yields nothing if the log doesn't exist.
+        """
+        header, lines = split_header(self.iter_log_lines(uuid_string, log_name))
+        entries = lines_with_offsets(lines, sum(len(line.encode("utf-8")) for line in header))
+        if start_date or end_date:
+            entries = offset_lines_in_range(entries, start_date, end_date)
+        if reverse:
+            return reversed(list(entries))
+        return entries
+
+    def rewrite_log_lines(self, uuid_string: str, log_name: str,
+                          transform: Callable[[Iterator[str]], Iterable[str]]) -> bool:
+        """
+        Replace a log with transform(lines of the log). Backends that can
+        stream do so without holding the log in memory. Returns False if the
+        log doesn't exist.
+        """
+        if not self.log_exists(uuid_string, log_name):
+            return False
+        lines = list(self.iter_log_lines(uuid_string, log_name))
+        self.write_log_lines(uuid_string, log_name, transform(iter(lines)))
+        return True
+
+    def append_log(self, uuid_string: str, log_name: str, text: str) -> str:
+        """Append text to a log, creating it if needed. Returns the log's location."""
+        raise NotImplementedError
+
+    def delete_log(self, uuid_string: str, log_name: str) -> bool:
+        """Delete a log. Returns False if it didn't exist."""
+        raise NotImplementedError
+
+    def list_logs(self, uuid_string: str) -> List[str]:
+        """List the names of a user's logs."""
+        raise NotImplementedError
+
+    def move_log(self, source_uuid: str, log_name: str,
+                 target_uuid: str, target_log_name: str) -> str:
+        """Move a log to another user, possibly renaming it. Returns the new location."""
+        raise NotImplementedError
+
+    def move_all_logs(self, source_uuid: str, target_uuid: str) -> Optional[List[str]]:
+        """
+        Move all of a user's logs to a user without logs in one step. Returns
+        the new locations, or None if the backend can't (the target has logs,
+        or moving them at once isn't supported) and they must be moved one by one.
+        """
+        return None
+
+    def write_shared_log(self, uuids: List[str], log_name: str, content: str) -> List[str]:
+        """
+        Write the same log for several users and return its locations.
+        Backends that can store it once and share it between the users do
+        so; by default every user gets a copy.
+        """
+        return [self.write_log(uuid_string, log_name, content) for uuid_string in uuids]
+
+    def log_references(self, uuid_string: str, log_name: str) -> List[Tuple[str, str]]:
+        """
+        Get the (uuid, log name) pairs sharing a log's storage, itself first.
+        Appending through any of them changes all of them.
+        """
+        return [(uuid_string, log_name)]
+
+    #
+    # Lifecycle
+    #
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Group writes so they are committed together."""
+        yield
+
+    def flush(self) -> None:
+        """Write any buffered data."""
+        pass
+
+    def close(self) -> None:
+        """Release any resources held by the backend."""
+        pass
+
+# "flat" puts every user directly under users/ and logs/; "sharded" nests
+# them by UUID prefix (users/ab/cd/<uuid>.json, logs/ab/cd/<uuid>/), which
+# keeps directories small with hundreds of thousands of users
+STORAGE_LAYOUTS = ("flat", "sharded")
+
+def shard_prefix(uuid_string: str) -> str:
+    """Get the shard directories of a UUID in the sharded layout ("ab/cd" for "abcd...")."""
+    return f"{uuid_string[0:2]}/{uuid_string[2:4]}"
+
+class FileBackend(StorageBackend):
+    """
+    Stores users as data/users/<uuid>.json and logs as
+    data/logs/<uuid>/<log_name>.txt. This is the default layout.
+    Appends go through a LogAppender, so they may be buffered in memory
+    until flush(); reads through this backend always see them.
+    Multi-user logs are stored once in data/logs/.shared and hard-linked
+    into each participant's directory (see write_shared_log).
+    With the "sharded" layout, users and their log directories are nested
+    by UUID prefix. Either way, users found in the other layout are read
+    and written where they are, so layouts can be switched while running
+    and reshard() moves existing data over.
+    """
+
+    name = "files"
+
+    def __init__(self, data_dir: str = "data", max_open_logs: int = 128,
+                 log_buffer_size: int = 64 * 1024, log_flush_interval: float = 1.0,
+                 layout: str = "flat", fsync_policy: str = "none"):
+        """
+        Initialize the backend with the data directory, appender settings,
+        layout and fsync policy (see file_utils.FSYNC_POLICIES).
+        """
+        if layout not in STORAGE_LAYOUTS:
+            raise ValueError(f"Invalid storage layout: {layout}")
+        self.data_dir = data_dir
+        self.layout = layout
+        self.fsync_policy = check_fsync_policy(fsync_policy)
+        self.users_dir = f"{data_dir}/users"
+        self.logs_dir = f"{data_dir}/logs"
+        self.shared_logs_dir = f"{self.logs_dir}/.shared"
+        ensure_directory_exists(self.users_dir)
+        ensure_directory_exists(self.logs_dir)
+        self.appender = LogAppender(max_open_logs, log_buffer_size, log_flush_interval, fsync_policy)
+        self._index_lock = threading.Lock()
+        self._shared_lock = threading.Lock()
+        # Inode -> key of shared logs seen so far
+        self._shared_keys: Dict[int, str] = {}
+
+    def user_location(self, uuid_string: str) -> str:
+        """Get the file path for a user's data."""
+        return self._resolve(self.users_dir, uuid_string, ".json")
+
+    def user_version(self, uuid_string: str) -> Optional[Tuple[Any, int]]:
+        """Get the ((mtime, inode), size) of a user file, or None if it doesn't exist."""
+        try:
+            stat = os.stat(self.user_location(uuid_string))
+        except FileNotFoundError:
+            return None
+        # Every write replaces the file, so the inode changes even when two
+        # writes land within the filesystem's timestamp granularity
+        return ((stat.st_mtime_ns, stat.st_ino), stat.st_size)
+
+    def user_exists(self, uuid_string: str) -> bool:
+        """Check if a user file exists."""
+        return os.path.exists(self.user_location(uuid_string))
+
+    def read_user(self, uuid_string: str) -> Optional[Dict[str, Any]]:
+        """Read a user file."""
+        return read_json_file(self.user_location(uuid_string))
+
+    def write_user(self, uuid_string: str, data: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+        """Write a user file and return its new version."""
+        write_json_file(self.user_location(uuid_string), data, self.fsync_policy)
+        return self.user_version(uuid_string)
+
+    def delete_user(self, uuid_string: str) -> bool:
+        """Delete a user file (in either layout)."""
+        deleted = False
+        for path in self._layout_paths(self.users_dir, uuid_string, ".json"):
+            deleted = delete_file(path) or deleted
+        return deleted
+
+    def list_users(self) -> List[str]:
+        """List user UUIDs from the users directory (in either layout)."""
+        return [
+            entry.name[:-len(".json")] for entry in self._scan_users(self.users_dir)
+            if entry.name.endswith(".json") and entry.is_file()
+        ]
+
+    def scan_users(self) -> Iterator[Tuple[str, Any, int]]:
+        """Yield (uuid, (mtime, inode), size) for every user file in one directory scan."""
+        for entry in self._scan_users(self.users_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            yield entry.name[:-len(".json")], (stat.st_mtime_ns, stat.st_ino), stat.st_size
+
+    def list_log_owners(self) -> List[str]:
+        """List the per-user directories under the logs directory (in either layout)."""
+        return [entry.name for entry in self._scan_users(self.logs_dir) if entry.is_dir()]
+
+    def user_logs_location(self, uuid_string: str) -> str:
+        """Get the directory for a user's logs, creating it if needed."""
+        user_logs_dir = self._user_logs_dir(uuid_string)
+        ensure_directory_exists(user_logs_dir)
+        return user_logs_dir
+
+    def _user_logs_dir(self, uuid_string: str) -> str:
+        """Get the directory for a user's logs without creating it."""
+        return self._resolve(self.logs_dir, uuid_string)
+
+    def log_location(self, uuid_string: str, log_name: str) -> str:
+        """Get the file path for a log, creating the user's log directory if needed."""
+        return f"{self.user_logs_location(uuid_string)}/{log_name}.txt"
+
+    def _log_path(self, uuid_string: str, log_name: str) -> str:
+        """Get the file path for a log without creating anything."""
+        return f"{self._user_logs_dir(uuid_string)}/{log_name}.txt"
+
+    def log_exists(self, uuid_string: str, log_name: str) -> bool:
+        """Check if a log file exists."""
+        if self.appender.is_open((uuid_string, log_name)):
+            return True
+        return os.path.exists(self._log_path(uuid_string, log_name))
+
+    def log_size(self, uuid_string: str, log_name: str) -> Optional[int]:
+        """Get the size of a log file."""
+        self._flush_log(uuid_string, log_name)
+        try:
+            return os.path.getsize(self._log_path(uuid_string, log_name))
+        except FileNotFoundError:
+            return None
+
+    def read_log(self, uuid_string: str, log_name: str) -> Optional[str]:
+        """Read a log file."""
+        self._flush_log(uuid_string, log_name)
+        return read_text_file(self._log_path(uuid_string, log_name))
+
+    def write_log(self, uuid_string: str, log_name: str, content: str) -> str:
+        """Replace a log file."""
+        self.appender.release((uuid_string, log_name))
+        log_path = self.log_location(uuid_string, log_name)
+        shared_key = self._shared_key(log_path)
+        write_text_file(log_path, content, fsync_policy=self.fsync_policy)
+        self._invalidate_index(log_path)
+        self._release_shared(shared_key)
+        return log_path
+
+    def iter_log_lines(self, uuid_string: str, log_name: str) -> Iterator[str]:
+        """Yield the lines of a log file without reading it all."""
+        self._flush_log(uuid_string, log_name)
+        return iter_text_lines(self._log_path(uuid_string, log_name))
+
+    def write_log_lines(self, uuid_string: str, log_name: str, lines: Iterable[str]) -> str:
+        """Replace a log file from a stream of lines."""
+        self.appender.release((uuid_string, log_name))
+        log_path = self.log_location(uuid_string, log_name)
+        shared_key = self._shared_key(log_path)
+        atomic_write_lines(log_path, lines, self.fsync_policy)
+        self._invalidate_index(log_path)
+        self._release_shared(shared_key)
+        return log_path
+
+    def tail_log(self, uuid_string: str, log_name: str, n_lines: int) -> Optional[List[str]]:
+        """Read the last lines of a log file by seeking back from its end."""
+        self._flush_log(uuid_string, log_name)
+        log_path = self._log_path(uuid_string, log_name)
+        header_length = header_byte_length(log_path)
+        if header_length is None:
+            return None
+        return read_tail_lines(log_path, n_lines, start_offset=header_length)
+
+    def iter_log_range(self, uuid_string: str, log_name: str,
+                       start_date: Optional[str] = None,
+                       end_date: Optional[str] = None) -> Iterator[str]:
+        """Yield a date range of a log file, located with its sidecar index."""
+        self._flush_log(uuid_string, log_name)
+        log_path = self._log_path(uuid_string, log_name)
+        with self._index_lock:
+            index = LogIndex(log_path)
+            if not index.refresh():
+                return iter(())
+            offsets = index.offset_range(start_date, end_date)
+        if offsets is None:
+            # Timestamps out of order: the range isn't contiguous, so scan instead
+            return super().iter_log_range(uuid_string, log_name, start_date, end_date)
+        return iter_byte_range_lines(log_path, *offsets)
+
+    def iter_log_offsets(self, uuid_string: str, log_name: str,
+                         start_date: Optional[str] = None,
+                         end_date: Optional[str] = None,
+                         reverse: bool = False) -> Iterator[Tuple[int, str]]:
+        """
+        Read a log file lazily from an open handle, seeking to a date range
+        with the sidecar index and reading backwards from the end for reverse.
+        """
+        self._flush_log(uuid_string, log_name)
+        log_path = self._log_path(uuid_string, log_name)
+        if start_date or end_date:
+            with self._index_lock:
+                index = LogIndex(log_path)
+                if not index.refresh():
+                    return iter(())
+                offsets = index.offset_range(start_date, end_date)
+            if offsets is None:
+                # Timestamps out of order: scan the whole body and filter it
+                header_length = header_byte_length(log_path) or 0
+                if reverse:
+                    entries = iter_line_offsets_reversed(log_path, header_length)
+                else:
+                    entries = iter_line_offsets(log_path, header_length)
+                return offset_lines_in_range(entries, start_date, end_date, reverse)
+        else:
+            header_length = header_byte_length(log_path)
+            if header_length is None:
+                return iter(())
+            offsets = (header_length, None)
+        
+        if reverse:
+            return iter_line_offsets_reversed(log_path, *offsets)
+        return iter_line_offsets(log_path, *offsets)
+
+    def rewrite_log_lines(self, uuid_string: str, log_name: str,
+                          transform: Callable[[Iterator[str]], Iterable[str]]) -> bool:
+        """Stream a log file through transform into a temporary file and swap it in."""
+        self.appender.release((uuid_string, log_name))
+        log_path = self._log_path(uuid_string, log_name)
+        if not os.path.exists(log_path):
+            return False
+        shared_key = self._shared_key(log_path)
+        # The old file stays readable through its open handle until the swap
+        atomic_write_lines(log_path, transform(iter_text_lines(log_path)), self.fsync_policy)
+        self._invalidate_index(log_path)
+        self._release_shared(shared_key)
+        return True
+
+    def append_log(self, uuid_string: str, log_name: str, text: str) -> str:
+        """Append to a log file through the pooled, buffered appender."""
+        log_path = self._log_path(uuid_string, log_name)
+        self.appender.append((uuid_string, log_name), log_path, text)
+        return log_path
+
+    def delete_log(self, uuid_string: str, log_name: str) -> bool:
+        """Delete a log file."""
+        self.appender.release((uuid_string, log_name))
+        log_path = self._log_path(uuid_string, log_name)
+        shared_key = self._shared_key(log_path)
+        self._invalidate_index(log_path)
+        deleted = delete_file(log_path)
+        self._release_shared(shared_key)
+        return deleted
+
+    def list_logs(self, uuid_string: str) -> List[str]:
+        """List log names from a user's log directory."""
+        files = list_files(self.user_logs_location(uuid_string), ".txt")
+        return [file.replace(".txt", "") for file in files]
+
+    def move_log(self, source_uuid: str, log_name: str,
+                 target_uuid: str, target_log_name: str) -> str:
+        """Move a log file into another user's log directory with a rename."""
+        self.appender.release((source_uuid, log_name))
+        self.appender.release((target_uuid, target_log_name))
+        source_path = self._log_path(source_uuid, log_name)
+        target_path = self.log_location(target_uuid, target_log_name)
+        shared_key = self._shared_key(source_path)
+        replaced_key = self._shared_key(target_path)
+
+        # Renaming keeps the data in place, and a shared log stays linked
+        move_file(source_path, target_path, self.fsync_policy)
+        self._move_index(source_path, target_path)
+        if shared_key is not None:
+            self._add_shared_reference(shared_key, target_uuid, target_log_name)
+        self._release_shared(replaced_key)
+        return target_path
+
+    def move_all_logs(self, source_uuid: str, target_uuid: str) -> Optional[List[str]]:
+        """Rename a user's whole log directory, if the target user has no logs."""
+        if self.list_logs(target_uuid):
+            return None
+        log_names = self.list_logs(source_uuid)
+        self.appender.release_matching(source_uuid)
+
+        shared_keys = {}
+        for log_name in log_names:
+            key = self._shared_key(self._log_path(source_uuid, log_name))
+            if key is not None:
+                shared_keys[log_name] = key
+
+        # Index sidecars move with the directory and stay valid
+        target_dir = self._user_logs_dir(target_uuid)
+        try:
+            os.rmdir(target_dir)
+            move_file(self._user_logs_dir(source_uuid), target_dir, self.fsync_policy)
+        except OSError:
+            # The target directory holds other files, or is on another filesystem
+            ensure_directory_exists(target_dir)
+            return None
+
+        for log_name, key in shared_keys.items():
+            self._add_shared_reference(key, target_uuid, log_name)
+        return [self._log_path(target_uuid, log_name) for log_name in log_names]
+
+    #
+    # Layouts
+    #
+
+    def reshard(self, user_locks: Optional[StripedLocks] = None,
+                log_locks: Optional[StripedLocks] = None) -> Dict[str, int]:
+        """
+        Move users and log directories stored in the other layout into this
+        backend's layout, one rename per user. Each user's moves hold that
+        user's write lock from user_locks and log_locks, so with the locks
+        the stores use (see create_locks) it can run while Callisto is in use.
+        Where both layouts hold a user file, the one in this layout is current
+        (writes go to it first), so the other is deleted. Logs that exist in
+        both are left in place and counted as conflicts.
+        """
+        user_locks = user_locks if user_locks is not None else StripedLocks()
+        log_locks = log_locks if log_locks is not None else StripedLocks()
+        stats = {"users": 0, "log_directories": 0, "stale_users": 0, "conflicts": 0}
+
+        for uuid_string in self.list_users():
+            with user_locks.write(uuid_string):
+                self._reshard_user(uuid_string, stats)
+
+        for uuid_string in self.list_log_owners():
+            with log_locks.write(uuid_string):
+                self._reshard_logs(uuid_string, stats)
+
+        return stats
+
+    def _reshard_user(self, uuid_string: str, stats: Dict[str, int]) -> None:
+        """Move a user file into this layout, or delete it if it's stale."""
+        preferred, other = self._layout_paths(self.users_dir, uuid_string, ".json")
+        if not os.path.exists(other):
+            return
+        if os.path.exists(preferred):
+            delete_file(other)
+            stats["stale_users"] += 1
+        else:
+            move_file(other, preferred, self.fsync_policy)
+            stats["users"] += 1
+        self._remove_empty_shards(other)
+
+    def _reshard_logs(self, uuid_string: str, stats: Dict[str, int]) -> None:
+        """Move a user's log directory (or the logs missing from this layout) into this layout."""
+        preferred, other = self._layout_paths(self.logs_dir, uuid_string)
+        if not os.path.isdir(other):
+            return
+        self.appender.release_matching(uuid_string)
+        if not os.path.exists(preferred):
+            move_file(other, preferred, self.fsync_policy)
+            stats["log_directories"] += 1
+        else:
+            # Both exist: move over whatever isn't there yet
+            with os.scandir(other) as entries:
+                for entry in list(entries):
+                    target_path = f"{preferred}/{entry.name}"
+                    if not os.path.exists(target_path):
+                        move_file(entry.path, target_path, self.fsync_policy)
+                    elif entry.name.endswith(".txt"):
+                        stats["conflicts"] += 1
+            try:
+                os.rmdir(other)
+                stats["log_directories"] += 1
+            except OSError:
+                return
+        self._remove_empty_shards(other)
+
+    def _layout_paths(self, base_dir: str, uuid_string: str, suffix: str = "") -> Tuple[str, str]:
+        """Get the path of a user's file or directory in this layout and in the other one."""
+        flat_path = f"{base_dir}/{uuid_string}{suffix}"
+        sharded_path = f"{base_dir}/{shard_prefix(uuid_string)}/{uuid_string}{suffix}"
+        if self.layout == "sharded":
+            return sharded_path, flat_path
+        return flat_path, sharded_path
+
+    def _resolve(self, base_dir: str, uuid_string: str, suffix: str = "") -> str:
+        """
+        Find a user's file or directory: the path in this layout unless only
+        the other layout has it.
+        """
+        preferred, other = self._layout_paths(base_dir, uuid_string, suffix)
+        if os.path.exists(preferred) or not os.path.exists(other):
+            return preferred
+        return other
+
+    def _scan_users(self, base_dir: str) -> Iterator[os.DirEntry]:
+        """Yield the entries for users under base_dir in both layouts."""
+        ensure_directory_exists(base_dir)
+        with os.scandir(base_dir) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                # UUIDs are longer than two characters, so these are shard directories
+                if len(entry.name) == 2 and entry.is_dir():
+                    yield from self._scan_shard(entry.path)
+                else:
+                    yield entry
+
+    def _scan_shard(self, shard_dir: str) -> Iterator[os.DirEntry]:
+        """Yield the entries in the second-level directories of a shard."""
+        with os.scandir(shard_dir) as shards:
+            for shard in shards:
+                if len(shard.name) == 2 and shard.is_dir():
+                    with os.scandir(shard.path) as entries:
+                        yield from (entry for entry in entries if not entry.name.startswith("."))
+
+    def _remove_empty_shards(self, path: str) -> None:
+        """Remove the shard directories a moved path was in, if they are now empty."""
+        if self.layout == "sharded":
+            # The path was in the flat layout
+            return
+        shard_dir = os.path.dirname(path)
+        try:
+            os.rmdir(shard_dir)
+            os.rmdir(os.path.dirname(shard_dir))
+        except OSError:
+            pass
+
+    #
+    # Shared multi-user logs
+    #
+
+    def write_shared_log(self, uuids: List[str], log_name: str, content: str) -> List[str]:
+        """
+        Store a multi-user log once as logs/.shared/<key>.txt and hard-link it
+        into each user's log directory. The key is a hash of the content, log
+        name and participants, so storing the same conversation again reuses
+        it. Appends by any participant are seen by all of them; rewriting or
+        deleting one participant's log only affects that participant. The
+        shared file is removed with its last reference. Users get a copy
+        instead if the filesystem can't hard-link.
+        """
+        digest = hashlib.sha256()
+        for part in (log_name, *sorted(uuids)):
+            digest.update(part.encode("utf-8") + b"\0")
+        digest.update(content.encode("utf-8"))
+        key = digest.hexdigest()
+        shared_path = self._shared_path(key)
+
+        with self._shared_lock:
+            if read_text_file(shared_path) != content:
+                write_text_file(shared_path, content, fsync_policy=self.fsync_policy)
+            write_json_file(
+                self._shared_references_path(key),
+                [[uuid_string, log_name] for uuid_string in uuids],
+                self.fsync_policy
+            )
+
+        paths = []
+        for uuid_string in uuids:
+            self.appender.release((uuid_string, log_name))
+            log_path = self.log_location(uuid_string, log_name)
+            previous_key = self._shared_key(log_path)
+            if not link_file(shared_path, log_path, self.fsync_policy):
+                write_text_file(log_path, content, fsync_policy=self.fsync_policy)
+            self._invalidate_index(log_path)
+            if previous_key != key:
+                self._release_shared(previous_key)
+            paths.append(log_path)
+
+        # Nothing links to the shared file if linking isn't supported
+        self._release_shared(key)
+        return paths
+
+    def log_references(self, uuid_string: str, log_name: str) -> List[Tuple[str, str]]:
+        """Get the users' logs linked to the same shared file as this one."""
+        log_path = self._log_path(uuid_string, log_name)
+        key = self._shared_key(log_path)
+        references = [(uuid_string, log_name)]
+        if key is None:
+            return references
+
+        # The list may be stale: participants' logs that were rewritten no longer share the file
+        for reference_uuid, reference_log in read_json_file(self._shared_references_path(key)) or []:
+            if (reference_uuid, reference_log) in references:
+                continue
+            try:
+                if os.path.samefile(self._log_path(reference_uuid, reference_log), log_path):
+                    references.append((reference_uuid, reference_log))
+            except FileNotFoundError:
+                continue
+        return references
+
+    def _shared_path(self, key: str) -> str:
+        """Get the path of a shared log."""
+        return f"{self.shared_logs_dir}/{key}.txt"
+
+    def _shared_references_path(self, key: str) -> str:
+        """Get the path of the list of logs linked to a shared log."""
+        return f"{self.shared_logs_dir}/{key}.refs"
+
+    def _shared_key(self, log_path: str) -> Optional[str]:
+        """Get the key of the shared file a log is linked to, or None if it isn't shared."""
+        try:
+            stat = os.stat(log_path)
+        except FileNotFoundError:
+            return None
+        if stat.st_nlink < 2:
+            return None
+
+        key = self._shared_keys.get(stat.st_ino)
+        if key is not None:
+            try:
+                if os.stat(self._shared_path(key)).st_ino == stat.st_ino:
+                    return key
+            except FileNotFoundError:
+                pass
+
+        # Find the shared file by inode; scandir gets inodes without a stat per file
+        try:
+            entries = os.scandir(self.shared_logs_dir)
+        except FileNotFoundError:
+            return None
+        with entries:
+            for entry in entries:
+                if entry.name.endswith(".txt") and entry.inode() == stat.st_ino:
+                    key = entry.name[:-len(".txt")]
+                    self._shared_keys[stat.st_ino] = key
+                    return key
+        return None
+
+    def _add_shared_reference(self, key: str, uuid_string: str, log_name: str) -> None:
+        """Record another log linked to a shared log (e.g. after a move)."""
+        with self._shared_lock:
+            references_path = self._shared_references_path(key)
+            references = read_json_file(references_path) or []
+            references.append([uuid_string, log_name])
+            write_json_file(references_path, references, self.fsync_policy)
+
+    def _release_shared(self, key: Optional[str]) -> None:
+        """Delete a shared log once no user's log is linked to it any more."""
+        if key is None:
+            return
+        with self._shared_lock:
+            shared_path = self._shared_path(key)
+            try:
+                if os.stat(shared_path).st_nlink > 1:
+                    return
+            except FileNotFoundError:
+                return
+            delete_file(shared_path)
+            delete_file(self._shared_references_path(key))
+
+    def _flush_log(self, uuid_string: str, log_name: str) -> None:
+        """
+        Write a log's buffered appends before reading it. A shared log may
+        have appends buffered under other participants' names, so those are
+        written too.
+        """
+        try:
+            shared = os.stat(self._log_path(uuid_string, log_name)).st_nlink > 1
+        except FileNotFoundError:
+            shared = False
+        if shared:
+            self.appender.flush()
+        else:
+            self.appender.flush((uuid_string, log_name))
+
+    def _move_index(self, source_path: str, target_path: str) -> None:
+        """Move the sidecar index of a renamed log; it stays valid since the content didn't change."""
+        with self._index_lock:
+            try:
+                move_file(index_path_for(source_path), index_path_for(target_path), self.fsync_policy)
+            except FileNotFoundError:
+                LogIndex(target_path).invalidate()
+
+    def _invalidate_index(self, log_path: str) -> None:
+        """Drop the sidecar index of a log that was rewritten, moved or deleted."""
+        with self._index_lock:
+            LogIndex(log_path).invalidate()
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Group writes so they share one fsync; buffered appends are written at the end."""
+        with fsync_batch():
+            yield
+            self.appender.flush()
+
+    def flush(self) -> None:
+        """Write all buffered appends."""
+        self.appender.flush()
+
+    def close(self) -> None:
+        """Flush buffered appends and close all open log handles."""
+        self.appender.close()
+
+def create_backend(name: str, data_dir: str = "data",
+                   config: Optional[Dict[str, Any]] = None) -> StorageBackend:
+    """Create a storage backend by name ("files" or "sqlite"), with settings from config."""
+    config = config or {}
+    if name == "files":
+        from .config import parse_size
+        # With process locks, each append must be written while its log's lock
+        # is held, so other processes can't replace the file under a pending buffer
+        log_buffer_size = parse_size(config.get("log_buffer_size", 0))
+        if log_buffer_size and config.get("process_locks", True):
+            raise ValueError("Invalid config: log_buffer_size requires \"process_locks\": false")
+        return FileBackend(
+            data_dir,
+            max_open_logs=config.get("max_open_logs", 128),
+            log_buffer_size=log_buffer_size,
+            log_flush_interval=config.get("log_flush_interval", 1.0),
+            layout=config.get("storage_layout", "flat"),
+            fsync_policy=config.get("fsync_policy", "none")
+        )
+    if name == "sqlite":
+        from .sqlite_backend import SQLiteBackend
+        return SQLiteBackend(f"{data_dir}/callisto.db", fsync_policy=config.get("fsync_policy", "none"))
+    raise ValueError(f"Unknown storage backend: {name}")
@@ -0,0 +1,173 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Hashable, Tuple
+
+def clone_record(value: Any) -> Any:
+    """Copy a decoded JSON value so callers can't mutate the cached copy."""
+    if isinstance(value, dict):
+        return {key: clone_record(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [clone_record(item) for item in value]
+    return value
+
+class _CacheEntry:
+    """A cached user record together with the file version it was read from."""
+    __slots__ = ("data", "version", "size", "dirty", "generation")
+
+    def __init__(self, data: Dict[str, Any], version: Hashable, size: int,
+                 dirty: bool = False, generation: int = 0):
+        self.data = data
+        self.version = version
+        self.size = size
+        self.dirty = dirty
+        self.generation = generation
+
+class UserCache:
+    """
+    LRU cache of decoded user records bounded by a byte budget.
+    Entry sizes are the size of the record's JSON file, so the budget is approximate.
+    Dirty records (modified but not yet written) are never evicted.
+    """
+
+    def __init__(self, max_bytes: int = 0):
+        """Initialize the cache. A max_bytes of 0 disables caching."""
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, uuid_string: str, version: Optional[Hashable]) -> Optional[Dict[str, Any]]:
+        """
+        Get a cached record if it was read from the given file version.
+        Dirty records are returned regardless of version.
+        The cached object itself is returned, not a copy.
+        """
+        with self._lock:
+            entry = self._entries.get(uuid_string)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if not entry.dirty and entry.version != version:
+                # File was changed outside this store
+                self._remove(uuid_string)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(uuid_string)
+            self.hits += 1
+            return entry.data
+
+    def put(self, uuid_string: str, data: Dict[str, Any], version: Optional[Hashable],
+            size: Optional[int] = None, dirty: bool = False) -> None:
+        """
+        Store a record, evicting least recently used records to stay within budget.
+        A size of None keeps the size of the record being replaced.
+        """
+        with self._lock:
+            previous = self._entries.get(uuid_string)
+            if size is None:
+                size = previous.size if previous is not None else 0
+            self._generation += 1
+
+            self._remove(uuid_string)
+            if size > self.max_bytes and not dirty:
+                return
+
+            self._entries[uuid_string] = _CacheEntry(data, version, size, dirty, self._generation)
+            self.current_bytes += size
+            self._enforce_budget()
+
+    def is_dirty(self, uuid_string: str) -> bool:
+        """Check if a record has changes that haven't been written yet."""
+        with self._lock:
+            entry = self._entries.get(uuid_string)
+            return entry is not None and entry.dirty
+
+    def dirty_records(self) -> List[Tuple[str, Dict[str, Any], int]]:
+        """Get (uuid, data, generation) for every dirty record."""
+        with self._lock:
+            return [
+                (uuid_string, entry.data, entry.generation)
+                for uuid_string, entry in self._entries.items()
+                if entry.dirty
+            ]
+
+    def dirty_record(self, uuid_string: str) -> Optional[Tuple[Dict[str, Any], int]]:
+        """Get (data, generation) for a record if it is dirty."""
+        with self._lock:
+            entry = self._entries.get(uuid_string)
+            if entry is None or not entry.dirty:
+                return None
+            return entry.data, entry.generation
+
+    def mark_clean(self, uuid_string: str, generation: int,
+                   version: Hashable, size: int) -> None:
+        """
+        Mark a record as written, unless it was modified again since
+        the given generation was snapshotted.
+        """
+        with self._lock:
+            entry = self._entries.get(uuid_string)
+            if entry is None or entry.generation != generation:
+                return
+
+            entry.dirty = False
+            entry.version = version
+            self.current_bytes += size - entry.size
+            entry.size = size
+            self._enforce_budget()
+
+    def invalidate(self, uuid_string: str) -> None:
+        """Drop a record from the cache."""
+        with self._lock:
+            if self._remove(uuid_string):
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        """Drop every record from the cache."""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Get cache counters for sizing the cache."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "dirty": sum(1 for entry in self._entries.values() if entry.dirty)
+            }
+
+    def _enforce_budget(self) -> None:
+        """Evict least recently used clean records until within budget."""
+        if self.current_bytes <= self.max_bytes:
+            return
+
+        for uuid_string in list(self._entries):
+            if self.current_bytes <= self.max_bytes:
+                break
+            if self._entries[uuid_string].dirty:
+                continue
+            self._remove(uuid_string)
+            self.evictions += 1
+
+    def _remove(self, uuid_string: str) -> bool:
+        """Remove a record without touching the counters."""
+        entry = self._entries.pop(uuid_string, None)
+        if entry is None:
+            return False
+        self.current_bytes -= entry.size
+        return True
@@ -0,0 +1,121 @@
+import threading
+from typing import Dict, Any, List, Optional, Hashable, Iterable, Set, Tuple
+
+from .user_merge import canonical_key
+
+# Field paths are dotted keys; "[]" after a key goes through every item of
+# a list, e.g. "preferences.theme" or "interests[].value". Values stored as
+# {"value": ..., "date_added": ...} entries (as update_user_field and
+# add_to_user_list write them) are matched by their "value".
+# Values only match values of the same type, so True, 1 and 1.0 (which are
+# equal in Python) are told apart, as they are in JSON.
+
+def parse_field_path(path: str) -> List[Tuple[str, bool]]:
+    """Split a field path into (key, is_list) segments."""
+    if not isinstance(path, str) or not path:
+        raise ValueError(f"Invalid field path: {path}")
+
+    segments = []
+    for part in path.split("."):
+        is_list = part.endswith("[]")
+        key = part[:-2] if is_list else part
+        if not key or "[" in key or "]" in key:
+            raise ValueError(f"Invalid field path: {path}")
+        segments.append((key, is_list))
+    return segments
+
+def field_values(data: Any, segments: List[Tuple[str, bool]]) -> List[Any]:
+    """Get the values a field path reaches in a record (none if it's missing)."""
+    values = [data]
+    for key, is_list in segments:
+        reached = []
+        for value in values:
+            if not isinstance(value, dict) or key not in value:
+                continue
+            child = value[key]
+            if is_list:
+                if isinstance(child, list):
+                    reached.extend(child)
+            else:
+                reached.append(child)
+        values = reached
+
+    return [
+        value["value"] if isinstance(value, dict) and "value" in value else value
+        for value in values
+    ]
+
+def value_key(value: Any) -> Hashable:
+    """Get the index key of a value: its canonical key, qualified by its type."""
+    return type(value).__name__, canonical_key(value)
+
+def field_keys(data: Any, segments: List[Tuple[str, bool]]) -> Set[Hashable]:
+    """Get the index keys of the values a field path reaches."""
+    return {value_key(value) for value in field_values(data, segments)}
+
+class FieldIndex:
+    """
+    Maps the values of one field path to the users that have them.
+    ready is False while the index is being built and can't be queried yet.
+    """
+
+    def __init__(self, path: str):
+        """Initialize an empty index for a field path."""
+        self.path = path
+        self.segments = parse_field_path(path)
+        self.ready = False
+        self._users: Dict[Hashable, Set[str]] = {}
+        self._keys: Dict[str, Set[Hashable]] = {}
+        self._lock = threading.Lock()
+
+    def update(self, uuid_string: str, data: Dict[str, Any]) -> None:
+        """Reindex a user's record."""
+        keys = field_keys(data, self.segments)
+        with self._lock:
+            old_keys = self._keys.get(uuid_string, set())
+            if keys == old_keys:
+                return
+            self._remove_keys(uuid_string, old_keys - keys)
+            for key in keys - old_keys:
+                self._users.setdefault(key, set()).add(uuid_string)
+            if keys:
+                self._keys[uuid_string] = keys
+            else:
+                self._keys.pop(uuid_string, None)
+
+    def discard(self, uuid_string: str) -> None:
+        """Remove a deleted user from the index."""
+        with self._lock:
+            self._remove_keys(uuid_string, self._keys.pop(uuid_string, set()))
+
+    def _remove_keys(self, uuid_string: str, keys: Iterable[Hashable]) -> None:
+        """Unlink a user from some of its keys, dropping keys nobody has."""
+        for key in keys:
+            users = self._users.get(key)
+            if users is not None:
+                users.discard(uuid_string)
+                if not users:
+                    del self._users[key]
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        with self._lock:
+            self._users.clear()
+            self._keys.clear()
+
+    def lookup(self, value: Any) -> Set[str]:
+        """Get the users whose field has the given value."""
+        with self._lock:
+            return set(self._users.get(value_key(value), ()))
+
+    def stats(self) -> Dict[str, int]:
+        """Get the number of distinct values and indexed users."""
+        with self._lock:
+            return {"values": len(self._users), "users": len(self._keys)}
+
+def matches(data: Dict[str, Any], filters: Dict[str, Any]) -> bool:
+    """Check a record against {field path: value} filters."""
+    return all(
+        value_key(value) in field_keys(data, parse_field_path(path))
+        for path, value in filters.items()
+    )
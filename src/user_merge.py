@@ -0,0 +1,199 @@
+import json
+import heapq
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Hashable, Tuple
+
+# Fields managed by the store itself; the target's are always kept
+_PROTECTED_FIELDS = ("uuid", "created")
+
+def canonical_key(value: Any) -> Hashable:
+    """
+    Get a hashable key for deduplicating a value. Hashable values are their
+    own key; dicts and lists use their canonical JSON (sorted keys), so
+    equal structures get equal keys.
+    """
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return ("json", json.dumps(value, sort_keys=True, separators=(",", ":"), default=str))
+
+#
+# Strategies
+#
+
+class MergeStrategy:
+    """
+    Combines the values of one field when users are merged. values holds
+    the target's value first (if it has the field), then each source's.
+    """
+
+    def merge(self, values: List[Any]) -> Any:
+        """Combine the values into the merged value."""
+        raise NotImplementedError
+
+class KeepFirst(MergeStrategy):
+    """Keep the target's value, or the first source's if the target has none."""
+
+    def merge(self, values: List[Any]) -> Any:
+        return values[0]
+
+class KeepNewest(MergeStrategy):
+    """Keep the entry (a dict) with the latest date_field; entries without a date lose."""
+
+    def __init__(self, date_field: str = "date_added"):
+        self.date_field = date_field
+
+    def merge(self, values: List[Any]) -> Any:
+        if not (isinstance(values[0], dict) and self.date_field in values[0]):
+            return values[0]
+        newest = values[0]
+        for value in values[1:]:
+            if isinstance(value, dict) and value.get(self.date_field, "") > newest[self.date_field]:
+                newest = value
+        return newest
+
+class ListUnion(MergeStrategy):
+    """
+    Combine lists, skipping source items already present. Dict items are
+    compared by their key_field (e.g. "value"), other items by themselves.
+    The target's items are kept as they are, duplicates included.
+    """
+
+    def __init__(self, key_field: Optional[str] = "value"):
+        self.key_field = key_field
+
+    def merge(self, values: List[Any]) -> Any:
+        if not all(isinstance(value, list) for value in values):
+            return values[0]
+        merged = list(values[0])
+        seen = {self._key(item) for item in merged}
+        for value in values[1:]:
+            for item in value:
+                key = self._key(item)
+                if key not in seen:
+                    seen.add(key)
+                    merged.append(item)
+        return merged
+
+    def _key(self, item: Any) -> Hashable:
+        """Get the deduplication key of a list item."""
+        if self.key_field is not None and isinstance(item, dict) and self.key_field in item:
+            return canonical_key(item[self.key_field])
+        return canonical_key(item)
+
+class Concat(MergeStrategy):
+    """Join lists end to end."""
+
+    def merge(self, values: List[Any]) -> Any:
+        if not all(isinstance(value, list) for value in values):
+            return values[0]
+        return [item for value in values for item in value]
+
+class Sum(MergeStrategy):
+    """Add numbers, e.g. conversation counts."""
+
+    def merge(self, values: List[Any]) -> Any:
+        numbers = [value for value in values if isinstance(value, (int, float))]
+        return sum(numbers) if numbers else values[0]
+
+class TopK(MergeStrategy):
+    """Combine lists and keep the k entries with the latest date_field, newest first."""
+
+    def __init__(self, k: int, date_field: str):
+        self.k = k
+        self.date_field = date_field
+
+    def merge(self, values: List[Any]) -> Any:
+        if not all(isinstance(value, list) for value in values):
+            return values[0]
+        items = [item for value in values for item in value]
+        if not all(isinstance(item, dict) and self.date_field in item for item in items):
+            return items
+        return heapq.nlargest(self.k, items, key=lambda item: item[self.date_field])
+
+# Strategies by field path ("category.field"; "*" matches any category)
+DEFAULT_STRATEGIES: Dict[str, MergeStrategy] = {
+    "*.total_conversations": Sum(),
+    "*.recent_topics": TopK(10, "date_discussed"),
+}
+
+#
+# Merging
+#
+
+class UserMerger:
+    """
+    Merges the records of any number of source users into a target record
+    in one pass. Each field is combined by the strategy registered for its
+    path, falling back to defaults by type: top-level lists are unioned,
+    category dictionaries are merged field by field, lists inside
+    categories are joined, entries with a date_added keep the newest, and
+    anything else keeps the target's value.
+    """
+
+    def __init__(self, strategies: Optional[Dict[str, MergeStrategy]] = None):
+        """Initialize the merger with strategies that override the defaults."""
+        self.strategies = dict(DEFAULT_STRATEGIES)
+        self.strategies.update(strategies or {})
+
+    def merge(self, target_data: Dict[str, Any], sources: List[Dict[str, Any]],
+              now: Optional[str] = None) -> Dict[str, Any]:
+        """Return the merged record; the inputs aren't modified."""
+        now = now or datetime.now().strftime("%Y-%m-%d")
+        result = self._merge_fields([target_data] + sources, (), now)
+        for field in _PROTECTED_FIELDS:
+            if field in target_data:
+                result[field] = target_data[field]
+            else:
+                result.pop(field, None)
+        result["last_modified"] = now
+        return result
+
+    def _merge_fields(self, records: List[Dict[str, Any]], path: Tuple[str, ...], now: str) -> Dict[str, Any]:
+        """Merge dictionaries key by key, keeping the order keys are first seen in."""
+        collected: Dict[str, List[Any]] = {}
+        for record in records:
+            for key, value in record.items():
+                collected.setdefault(key, []).append(value)
+
+        merged = {}
+        for key, values in collected.items():
+            if path and key == "last_modified" and any(key in record for record in records[1:]):
+                # A category's date only changes when a merged record had one too
+                merged[key] = now
+            elif len(values) == 1:
+                merged[key] = values[0]
+            else:
+                merged[key] = self._merge_values(values, path + (key,), now)
+        return merged
+
+    def _merge_values(self, values: List[Any], path: Tuple[str, ...], now: str) -> Any:
+        """Combine the values of one field."""
+        strategy = self._strategy(path)
+        if strategy is not None:
+            return strategy.merge(values)
+
+        if len(path) == 1:
+            if all(isinstance(value, list) for value in values):
+                return _UNION.merge(values)
+            if all(isinstance(value, dict) for value in values):
+                return self._merge_fields(values, path, now)
+            return values[0]
+
+        if any(isinstance(value, dict) and "date_added" in value for value in values[1:]):
+            return _KEEP_NEWEST.merge(values)
+        if all(isinstance(value, list) for value in values):
+            return _CONCAT.merge(values)
+        return values[0]
+
+    def _strategy(self, path: Tuple[str, ...]) -> Optional[MergeStrategy]:
+        """Find the strategy registered for a field path."""
+        strategy = self.strategies.get(".".join(path))
+        if strategy is None and len(path) > 1:
+            strategy = self.strategies.get(".".join(("*",) + path[1:]))
+        return strategy
+
+_UNION = ListUnion()
+_KEEP_NEWEST = KeepNewest()
+_CONCAT = Concat()
@@ -0,0 +1,186 @@
+from typing import Dict, Any, List, Union, Callable
+
+from .user_cache import clone_record
+
+# Supported operations:
+#   {"op": "set", "path": "/preferences/theme", "value": "dark"}
+#   {"op": "append", "path": "/interests", "value": {...}}
+#   {"op": "increment", "path": "/stats/total_conversations", "value": 1}
+#   {"op": "remove", "path": "/preferences/theme"}
+# Paths are JSON Pointers ("/a/b", with ~0 and ~1 escapes) or lists of keys.
+# Missing dictionaries along the path are created for set/append/increment.
+PATCH_OPERATIONS = ("set", "append", "increment", "remove")
+
+# Fields managed by the store itself
+_PROTECTED_FIELDS = ("uuid", "created")
+
+_MISSING = object()
+
+Path = Union[str, List[Union[str, int]]]
+
+def parse_path(path: Path) -> List[str]:
+    """Split a JSON Pointer (or list of keys) into path segments."""
+    if isinstance(path, (list, tuple)):
+        segments = [str(segment) for segment in path]
+    elif isinstance(path, str) and path.startswith("/"):
+        segments = [
+            segment.replace("~1", "/").replace("~0", "~")
+            for segment in path[1:].split("/")
+        ]
+    else:
+        raise ValueError(f"Invalid patch path: {path}")
+
+    if not segments or segments[0] == "":
+        raise ValueError(f"Invalid patch path: {path}")
+    if segments[0] in _PROTECTED_FIELDS:
+        raise ValueError(f"Cannot modify {segments[0]}")
+    return segments
+
+def apply_patch(data: Dict[str, Any], ops: List[Dict[str, Any]]) -> None:
+    """
+    Apply patch operations to a user record in place.
+    Either every operation is applied or, if one fails, none are.
+    """
+    undo: List[Callable[[], None]] = []
+    try:
+        for op in ops:
+            _apply_op(data, op, undo)
+    except Exception:
+        for action in reversed(undo):
+            action()
+        raise
+
+def category_field_ops(category: str, field: str, value: Any, date: str) -> List[Dict[str, Any]]:
+    """Operations that set a field within a category, as update_category_field does."""
+    if isinstance(value, dict) and "value" in value:
+        if "date_added" not in value:
+            value["date_added"] = date
+        entry = value
+    else:
+        entry = {
+            "value": value,
+            "date_added": date
+        }
+
+    return [
+        {"op": "set", "path": [category, field], "value": entry},
+        {"op": "set", "path": [category, "last_modified"], "value": date}
+    ]
+
+def list_append_ops(list_name: str, value: Any, date: str) -> List[Dict[str, Any]]:
+    """Operations that add an item to a list, as add_to_list does."""
+    if isinstance(value, dict) and "value" in value:
+        if "date_added" not in value:
+            value["date_added"] = date
+        entry = value
+    else:
+        entry = {
+            "value": value,
+            "date_added": date
+        }
+
+    return [{"op": "append", "path": [list_name], "value": entry}]
+
+def _apply_op(data: Dict[str, Any], op: Dict[str, Any],
+              undo: List[Callable[[], None]]) -> None:
+    """Apply a single operation, recording how to revert it."""
+    kind = op.get("op")
+    if kind not in PATCH_OPERATIONS:
+        raise ValueError(f"Invalid patch operation: {kind}")
+
+    segments = parse_path(op.get("path"))
+    parent = _resolve_parent(data, segments[:-1], kind != "remove", undo)
+    key = segments[-1]
+    current = _get_child(parent, key)
+
+    if kind == "set":
+        _set_child(parent, key, clone_record(op.get("value")), undo)
+    elif kind == "append":
+        if current is _MISSING:
+            current = []
+            _set_child(parent, key, current, undo)
+        if not isinstance(current, list):
+            raise ValueError(f"{key} is not a list in user data")
+        current.append(clone_record(op.get("value")))
+        undo.append(current.pop)
+    elif kind == "increment":
+        amount = op.get("value", 1)
+        if current is _MISSING:
+            current = 0
+        if not _is_number(current) or not _is_number(amount):
+            raise ValueError(f"{key} is not a number in user data")
+        _set_child(parent, key, current + amount, undo)
+    else:
+        if current is _MISSING:
+            raise ValueError(f"Path not found: {op.get('path')}")
+        _remove_child(parent, key, undo)
+
+def _resolve_parent(data: Any, segments: List[str], create: bool,
+                    undo: List[Callable[[], None]]) -> Any:
+    """Walk to the container holding the target, creating dictionaries if allowed."""
+    node = data
+    for segment in segments:
+        child = _get_child(node, segment)
+        if child is _MISSING:
+            if not create:
+                raise ValueError(f"Path not found: {segment}")
+            child = {}
+            _set_child(node, segment, child, undo)
+        if not isinstance(child, (dict, list)):
+            raise ValueError(f"{segment} is not a dictionary in user data")
+        node = child
+    return node
+
+def _get_child(node: Any, key: str) -> Any:
+    """Get a child of a dictionary or list, or _MISSING."""
+    if isinstance(node, dict):
+        return node.get(key, _MISSING)
+    index = _list_index(node, key)
+    if index is None or index >= len(node):
+        return _MISSING
+    return node[index]
+
+def _set_child(node: Any, key: str, value: Any, undo: List[Callable[[], None]]) -> None:
+    """Set a child of a dictionary or list ("-" appends to a list)."""
+    if isinstance(node, dict):
+        previous = node.get(key, _MISSING)
+        node[key] = value
+        if previous is _MISSING:
+            undo.append(lambda: node.pop(key, None))
+        else:
+            undo.append(lambda: node.__setitem__(key, previous))
+        return
+
+    index = _list_index(node, key)
+    if index is None or index > len(node):
+        raise ValueError(f"Invalid list index: {key}")
+    if index == len(node):
+        node.append(value)
+        undo.append(node.pop)
+    else:
+        previous = node[index]
+        node[index] = value
+        undo.append(lambda: node.__setitem__(index, previous))
+
+def _remove_child(node: Any, key: str, undo: List[Callable[[], None]]) -> None:
+    """Remove a child of a dictionary or list."""
+    if isinstance(node, dict):
+        previous = node.pop(key)
+        undo.append(lambda: node.__setitem__(key, previous))
+        return
+
+    index = _list_index(node, key)
+    previous = node.pop(index)
+    undo.append(lambda: node.insert(index, previous))
+
+def _list_index(node: List[Any], key: str) -> Union[int, None]:
+    """Convert a path segment to a list index ("-" means the end)."""
+    if key == "-":
+        return len(node)
+    if key.isdigit():
+        return int(key)
+    return None
+
+def _is_number(value: Any) -> bool:
+    """Check for an int or float (but not a bool)."""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
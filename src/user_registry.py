@@ -0,0 +1,207 @@
+import json
+import threading
+from typing import Dict, Any, List, Optional, Callable, Hashable, Tuple
+
+from .file_utils import atomic_write_text
+
+REGISTRY_FORMAT = 1
+
+# Fields list_users can sort by
+ORDER_FIELDS = ("uuid", "created", "last_modified", "size")
+
+class _Entry:
+    """What the registry knows about one user."""
+    __slots__ = ("version", "size", "created", "last_modified")
+
+    def __init__(self, version: Optional[Hashable], size: int,
+                 created: Optional[str] = None, last_modified: Optional[str] = None):
+        self.version = version
+        self.size = size
+        self.created = created
+        self.last_modified = last_modified
+
+class UserRegistry:
+    """
+    In-memory index of the known users, with each record's version, size,
+    created and last_modified dates. It is built once from a single scan of
+    the backend and then kept up to date by the UserStore, so existence
+    checks and listings don't touch the disk.
+    Dates are only read from the records when a listing is sorted by them.
+    If a path is given, the index is saved there on flush and reloaded at
+    startup; entries whose record hasn't changed since are reused.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """Initialize an empty registry, persisted to path if given."""
+        self.path = path
+        self._entries: Dict[str, _Entry] = {}
+        self._lock = threading.RLock()
+        # Sorted UUID lists by (order_by, descending), dropped on any change
+        self._orders: Dict[Tuple[str, bool], List[str]] = {}
+        self._changed = False
+        self.loaded = False
+
+    def load(self, scan: Callable[[], Any]) -> None:
+        """
+        Build the registry from scan(), which yields (uuid, version, size)
+        for every stored user. Dates saved for an unchanged version are kept.
+        """
+        saved = self._read_saved()
+        entries = {}
+        for uuid_string, version, size in scan():
+            entry = _Entry(version, size)
+            previous = saved.get(uuid_string)
+            # Versions come back from JSON with tuples as lists
+            if previous and previous[0] == (list(version) if isinstance(version, tuple) else version):
+                entry.created, entry.last_modified = previous[2], previous[3]
+            entries[uuid_string] = entry
+
+        with self._lock:
+            self._entries = entries
+            self._orders.clear()
+            self._changed = True
+            self.loaded = True
+
+    def _read_saved(self) -> Dict[str, List[Any]]:
+        """Read the saved entries as {uuid: [version, size, created, last_modified]}."""
+        if self.path is None:
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                saved = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        if not isinstance(saved, dict) or saved.get("format") != REGISTRY_FORMAT:
+            return {}
+        return saved.get("users", {})
+
+    def save(self) -> bool:
+        """Write the registry to its path if it changed. Returns True if written."""
+        if self.path is None:
+            return False
+        with self._lock:
+            if not self._changed or not self.loaded:
+                return False
+            users = {
+                uuid_string: [entry.version, entry.size, entry.created, entry.last_modified]
+                for uuid_string, entry in self._entries.items()
+                if entry.version is not None
+            }
+            self._changed = False
+        try:
+            atomic_write_text(self.path, json.dumps({"format": REGISTRY_FORMAT, "users": users}))
+        except OSError:
+            with self._lock:
+                self._changed = True
+            raise
+        return True
+
+    #
+    # Updates
+    #
+
+    def record(self, uuid_string: str, data: Dict[str, Any],
+               version: Optional[Hashable] = None, size: Optional[int] = None) -> None:
+        """
+        Note that a user's record was saved. A version of None means the
+        record isn't written yet (write-back mode); its last size is kept.
+        """
+        with self._lock:
+            entry = self._entries.get(uuid_string)
+            if entry is None:
+                entry = self._entries[uuid_string] = _Entry(None, 0)
+            entry.version = version
+            if size is not None:
+                entry.size = size
+            entry.created = data.get("created", "")
+            entry.last_modified = data.get("last_modified", "")
+            self._orders.clear()
+            self._changed = True
+
+    def update(self, uuid_string: str, version: Hashable, size: int) -> None:
+        """Note a record's new version, e.g. once a pending record is written."""
+        with self._lock:
+            entry = self._entries.get(uuid_string)
+            if entry is None:
+                entry = self._entries[uuid_string] = _Entry(version, size)
+            entry.version = version
+            entry.size = size
+            self._orders.clear()
+            self._changed = True
+
+    def discard(self, uuid_string: str) -> None:
+        """Forget a deleted user."""
+        with self._lock:
+            if self._entries.pop(uuid_string, None) is not None:
+                self._orders.clear()
+                self._changed = True
+
+    #
+    # Queries
+    #
+
+    def __contains__(self, uuid_string: str) -> bool:
+        return uuid_string in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def fill_dates(self, read: Callable[[str], Optional[Dict[str, Any]]]) -> None:
+        """Read created/last_modified for the entries that don't have them yet."""
+        with self._lock:
+            missing = [
+                uuid_string for uuid_string, entry in self._entries.items()
+                if entry.created is None and entry.last_modified is None
+            ]
+        for uuid_string in missing:
+            data = read(uuid_string) or {}
+            with self._lock:
+                entry = self._entries.get(uuid_string)
+                if entry is not None and entry.created is None and entry.last_modified is None:
+                    entry.created = data.get("created", "")
+                    entry.last_modified = data.get("last_modified", "")
+                    self._orders.clear()
+                    self._changed = True
+
+    def list(self, offset: int = 0, limit: Optional[int] = None,
+             order_by: str = "uuid", descending: bool = False) -> List[str]:
+        """List UUIDs sorted by one of ORDER_FIELDS (ties broken by UUID)."""
+        if order_by not in ORDER_FIELDS:
+            raise ValueError(f"Invalid order_by: {order_by}")
+        if offset < 0 or (limit is not None and limit < 0):
+            raise ValueError("offset and limit must not be negative")
+
+        with self._lock:
+            key = (order_by, descending)
+            ordered = self._orders.get(key)
+            if ordered is None:
+                if order_by == "uuid":
+                    ordered = sorted(self._entries, reverse=descending)
+                else:
+                    ordered = sorted(
+                        self._entries,
+                        key=lambda uuid_string: (self._sort_value(uuid_string, order_by), uuid_string),
+                        reverse=descending
+                    )
+                self._orders[key] = ordered
+
+        end = None if limit is None else offset + limit
+        return ordered[offset:end]
+
+    def _sort_value(self, uuid_string: str, order_by: str) -> Any:
+        """Get the value an entry is sorted by; missing dates sort first."""
+        value = getattr(self._entries[uuid_string], order_by)
+        return value if value is not None else ""
+
+    def info(self, uuid_string: str) -> Optional[Dict[str, Any]]:
+        """Get what the registry knows about a user, or None if it's unknown."""
+        with self._lock:
+            entry = self._entries.get(uuid_string)
+            if entry is None:
+                return None
+            return {
+                "uuid": uuid_string,
+                "created": entry.created,
+                "last_modified": entry.last_modified,
+                "size": entry.size
+            }
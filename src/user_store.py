@@ -2,24 +2,67 @@ import os
 import json
 import uuid
 import re
+import atexit
+import threading
 from datetime import datetime
-from typing import Dict, Any, List, Optional, Union
+from typing import Dict, Any, List, Optional, Union, Tuple
 
-from .file_utils import (
-    ensure_directory_exists,
-    read_json_file,
-    write_json_file,
-    list_files,
-    delete_file
-)
+from .storage_backend import StorageBackend, FileBackend
+from .user_cache import UserCache, clone_record
+from .user_patch import apply_patch, category_field_ops, list_append_ops
+from .user_merge import UserMerger, MergeStrategy
+from .user_registry import UserRegistry
+from .user_index import FieldIndex, parse_field_path, matches
+from .locks import StripedLocks
 
 class UserStore:
     """Class for managing user data storage."""
     
-    def __init__(self, data_dir: str = "data"):
-        """Initialize the UserStore with the data directory."""
-        self.users_dir = f"{data_dir}/users"
-        ensure_directory_exists(self.users_dir)
+    def __init__(self, data_dir: str = "data", cache_size: int = 0,
+                 write_back: bool = False, auto_save_interval: float = 300,
+                 backend: Optional[StorageBackend] = None,
+                 merge_strategies: Optional[Dict[str, MergeStrategy]] = None,
+                 registry_path: Optional[str] = None,
+                 locks: Optional[StripedLocks] = None):
+        """
+        Initialize the UserStore with the data directory.
+        cache_size is the byte budget for cached user records (0 disables the cache).
+        In write-back mode, changes are kept in memory and written every
+        auto_save_interval seconds, on flush() and on close().
+        The file layout under data_dir is used unless another backend is given.
+        merge_strategies overrides how fields are combined when users are merged.
+        The registry of known users is saved to registry_path (if given) on
+        flush, so the next startup only re-reads records that changed.
+        locks guards each user's load-modify-save cycles; pass locks with a
+        directory to also coordinate with other processes.
+        """
+        self.backend = backend if backend is not None else FileBackend(data_dir)
+        self.cache = UserCache(cache_size)
+        self.merger = UserMerger(merge_strategies)
+        self.registry = UserRegistry(registry_path)
+        self.registry.load(self.backend.scan_users)
+        # Secondary indexes by field path
+        self.indexes: Dict[str, FieldIndex] = {}
+        
+        # Per-user reader/writer locks around load-modify-save cycles
+        self.locks = locks if locks is not None else StripedLocks()
+        # Serializes flushes with each other and with registry rebuilds
+        self._flush_lock = threading.Lock()
+        # Serializes creating, dropping and rebuilding secondary indexes
+        self._index_lock = threading.Lock()
+        
+        self.write_back = write_back
+        self.auto_save_interval = auto_save_interval
+        self._stop_event = threading.Event()
+        self._flusher = None
+        if write_back:
+            self._flusher = threading.Thread(
+                target=self._flush_periodically,
+                name="callisto-user-flusher",
+                daemon=True
+            )
+            self._flusher.start()
+            atexit.register(self.close)
     
     def _is_valid_uuid(self, uuid_string: str) -> bool:
         """Check if the given string is a valid UUID."""
@@ -34,247 +77,365 @@ class UserStore:
         if not self._is_valid_uuid(uuid_string):
             raise ValueError(f"Invalid UUID: {uuid_string}")
         
-        return f"{self.users_dir}/{uuid_string}.json"
+        return self.backend.user_location(uuid_string)
     
     def user_exists(self, uuid_string: str) -> bool:
         """Check if a user with the given UUID exists."""
         if not self._is_valid_uuid(uuid_string):
             return False
-        return os.path.exists(self.get_user_file_path(uuid_string))
+        if uuid_string in self.registry:
+            return True
+        
+        # Pick up users created outside this store
+        version = self.backend.user_version(uuid_string)
+        if version is None:
+            return False
+        self.registry.update(uuid_string, version[0], version[1])
+        return True
+    
+    def refresh_registry(self) -> int:
+        """Rebuild the registry of known users from storage. Returns the user count."""
+        with self._flush_lock, self._index_lock:
+            pending = [(uuid_string, user_data) for uuid_string, user_data, _ in self.cache.dirty_records()]
+            self.registry.load(self.backend.scan_users)
+            for uuid_string, user_data in pending:
+                self.registry.record(uuid_string, user_data)
+            for index in list(self.indexes.values()):
+                self._build_index(index)
+            return len(self.registry)
+    
+    def _load_user(self, uuid_string: str) -> Optional[Dict[str, Any]]:
+        """
+        Load a user record through the cache.
+        Returns the cached object itself, so callers must not leak it.
+        """
+        if self.write_back and self.cache.is_dirty(uuid_string):
+            return self.cache.get(uuid_string, None)
+        
+        version = self.backend.user_version(uuid_string)
+        if version is None:
+            self.cache.invalidate(uuid_string)
+            self._forget(uuid_string)
+            return None
+        
+        user_data = self.cache.get(uuid_string, version)
+        if user_data is None:
+            user_data = self.backend.read_user(uuid_string)
+            if user_data is not None:
+                self.cache.put(uuid_string, user_data, version, version[1])
+        
+        return user_data
+    
+    def _save_user(self, uuid_string: str, user_data: Dict[str, Any]) -> None:
+        """
+        Write a user record and refresh its cache entry.
+        In write-back mode the record is only marked dirty.
+        """
+        if self.write_back:
+            self.cache.put(uuid_string, user_data, None, dirty=True)
+            self.registry.record(uuid_string, user_data)
+            self._update_indexes(uuid_string, user_data)
+            return
+        
+        try:
+            version = self.backend.write_user(uuid_string, user_data)
+        except Exception:
+            self.cache.invalidate(uuid_string)
+            raise
+        
+        if version is not None:
+            self.cache.put(uuid_string, user_data, version, version[1])
+            self.registry.record(uuid_string, user_data, version[0], version[1])
+        else:
+            self.registry.record(uuid_string, user_data)
+        self._update_indexes(uuid_string, user_data)
+    
+    def _update_indexes(self, uuid_string: str, user_data: Dict[str, Any]) -> None:
+        """Reindex a saved record in every secondary index."""
+        for index in list(self.indexes.values()):
+            index.update(uuid_string, user_data)
+    
+    def _forget(self, uuid_string: str) -> None:
+        """Remove a deleted user from the registry and the secondary indexes."""
+        self.registry.discard(uuid_string)
+        for index in list(self.indexes.values()):
+            index.discard(uuid_string)
+    
+    def _require_user(self, uuid_string: str) -> Dict[str, Any]:
+        """Load a user record for modification, raising if it doesn't exist."""
+        if not self._is_valid_uuid(uuid_string):
+            raise ValueError(f"Invalid UUID: {uuid_string}")
+        
+        user_data = self._load_user(uuid_string)
+        if user_data is None:
+            raise ValueError(f"User does not exist: {uuid_string}")
+        return user_data
     
     def get_user_data(self, uuid_string: str) -> Optional[Dict[str, Any]]:
         """Get the data for a user."""
         if not self._is_valid_uuid(uuid_string):
             raise ValueError(f"Invalid UUID: {uuid_string}")
         
-        file_path = self.get_user_file_path(uuid_string)
-        return read_json_file(file_path)
+        with self.locks.read(uuid_string):
+            user_data = self._load_user(uuid_string)
+            return clone_record(user_data) if user_data is not None else None
+    
+    def cache_stats(self) -> Dict[str, int]:
+        """Get the user cache hit/miss/eviction counters."""
+        return self.cache.stats()
+    
+    def flush(self) -> int:
+        """Write all dirty user records to disk. Returns the number written."""
+        with self._flush_lock:
+            written = 0
+            with self.backend.batch():
+                for uuid_string, _, _ in self.cache.dirty_records():
+                    # The user's lock keeps the record from changing mid-write, and
+                    # from being deleted and then resurrected by this write
+                    with self.locks.read(uuid_string):
+                        pending = self.cache.dirty_record(uuid_string)
+                        if pending is None:
+                            continue
+                        user_data, generation = pending
+                        version = self.backend.write_user(uuid_string, clone_record(user_data))
+                        written += 1
+                        if version is not None:
+                            self.cache.mark_clean(uuid_string, generation, version, version[1])
+                            self.registry.update(uuid_string, version[0], version[1])
+            
+            self.registry.save()
+            return written
+    
+    def close(self) -> None:
+        """Stop the background flusher and write any pending changes."""
+        if self._flusher is not None:
+            self._stop_event.set()
+            self._flusher.join()
+            self._flusher = None
+            atexit.unregister(self.close)
+        self.flush()
+    
+    def _flush_periodically(self) -> None:
+        """Background loop that flushes dirty records every auto_save_interval seconds."""
+        while not self._stop_event.wait(self.auto_save_interval):
+            try:
+                self.flush()
+            except OSError:
+                # Records stay dirty and are retried on the next pass
+                pass
     
     def create_user(self, uuid_string: str, initial_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """Create a new user with optional initial data."""
         if not self._is_valid_uuid(uuid_string):
             raise ValueError(f"Invalid UUID: {uuid_string}")
         
-        if self.user_exists(uuid_string):
-            raise ValueError(f"User already exists: {uuid_string}")
+        with self.locks.write(uuid_string):
+            if self.user_exists(uuid_string):
+                raise ValueError(f"User already exists: {uuid_string}")
         
-        now = datetime.now().strftime("%Y-%m-%d")
+            now = datetime.now().strftime("%Y-%m-%d")
         
-        user_data = {
-            "uuid": uuid_string,
-            "created": now,
-            "last_modified": now
-        }
+            user_data = {
+                "uuid": uuid_string,
+                "created": now,
+                "last_modified": now
+            }
         
-        if initial_data:
-            # Don't allow overriding uuid, created
-            for key in ["uuid", "created"]:
-                if key in initial_data:
-                    del initial_data[key]
-            user_data.update(initial_data)
+            if initial_data:
+                # Don't allow overriding uuid, created
+                for key in ["uuid", "created"]:
+                    if key in initial_data:
+                        del initial_data[key]
+                user_data.update(clone_record(initial_data))
         
-        file_path = self.get_user_file_path(uuid_string)
-        write_json_file(file_path, user_data)
+            self._save_user(uuid_string, user_data)
         
-        return user_data
+            return clone_record(user_data)
     
     def update_user(self, uuid_string: str, data: Dict[str, Any]) -> Dict[str, Any]:
         """Update a user's data."""
-        if not self._is_valid_uuid(uuid_string):
-            raise ValueError(f"Invalid UUID: {uuid_string}")
-        
-        if not self.user_exists(uuid_string):
-            raise ValueError(f"User does not exist: {uuid_string}")
-        
-        user_data = self.get_user_data(uuid_string)
+        with self.locks.write(uuid_string):
+            user_data = self._require_user(uuid_string)
         
-        # Update the last_modified timestamp
-        now = datetime.now().strftime("%Y-%m-%d")
-        user_data["last_modified"] = now
+            # Update the last_modified timestamp
+            now = datetime.now().strftime("%Y-%m-%d")
+            user_data["last_modified"] = now
         
-        # Update the user data with the new data
-        for key, value in data.items():
-            if key in ["uuid", "created"]:
-                continue  # Don't allow updating these fields
-            user_data[key] = value
+            # Update the user data with the new data
+            for key, value in data.items():
+                if key in ["uuid", "created"]:
+                    continue  # Don't allow updating these fields
+                user_data[key] = clone_record(value)
         
-        file_path = self.get_user_file_path(uuid_string)
-        write_json_file(file_path, user_data)
+            self._save_user(uuid_string, user_data)
         
-        return user_data
+            return clone_record(user_data)
+    
+    def patch(self, uuid_string: str, ops: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Apply a list of JSON-Patch-style operations (set, append, increment,
+        remove) to a user's data in a single load/save cycle.
+        If any operation fails, none of them are applied.
+        """
+        with self.locks.write(uuid_string):
+            user_data = self._require_user(uuid_string)
+            apply_patch(user_data, ops)
+            
+            # Update the last_modified timestamp
+            user_data["last_modified"] = datetime.now().strftime("%Y-%m-%d")
+            
+            self._save_user(uuid_string, user_data)
+            
+            return clone_record(user_data)
     
     def update_category_field(self, uuid_string: str, category: str, field: str, value: Any) -> Dict[str, Any]:
         """Update a field within a category in the user's data."""
-        if not self._is_valid_uuid(uuid_string):
-            raise ValueError(f"Invalid UUID: {uuid_string}")
-        
-        if not self.user_exists(uuid_string):
-            raise ValueError(f"User does not exist: {uuid_string}")
-        
-        user_data = self.get_user_data(uuid_string)
         now = datetime.now().strftime("%Y-%m-%d")
-        
-        # Create category if it doesn't exist
-        if category not in user_data:
-            user_data[category] = {}
-        
-        # Ensure the category is a dictionary
-        if not isinstance(user_data[category], dict):
-            raise ValueError(f"{category} is not a dictionary in user data")
-        
-        # Format the value with date_added if needed
-        if isinstance(value, dict) and "value" in value:
-            if "date_added" not in value:
-                value["date_added"] = now
-            user_data[category][field] = value
-        else:
-            user_data[category][field] = {
-                "value": value,
-                "date_added": now
-            }
-        
-        # Update last_modified timestamps
-        user_data[category]["last_modified"] = now
-        user_data["last_modified"] = now
-        
-        file_path = self.get_user_file_path(uuid_string)
-        write_json_file(file_path, user_data)
-        
-        return user_data
+        return self.patch(uuid_string, category_field_ops(category, field, value, now))
     
     def add_to_list(self, uuid_string: str, list_name: str, value: Any) -> Dict[str, Any]:
         """Add an item to a list in the user's data."""
-        if not self._is_valid_uuid(uuid_string):
-            raise ValueError(f"Invalid UUID: {uuid_string}")
-        
-        if not self.user_exists(uuid_string):
-            raise ValueError(f"User does not exist: {uuid_string}")
-        
-        user_data = self.get_user_data(uuid_string)
         now = datetime.now().strftime("%Y-%m-%d")
-        
-        # Create the list if it doesn't exist
-        if list_name not in user_data:
-            user_data[list_name] = []
-        
-        # Ensure it's a list
-        if not isinstance(user_data[list_name], list):
-            raise ValueError(f"{list_name} is not a list in user data")
-        
-        # Add the value with date_added
-        if isinstance(value, dict) and "value" in value:
-            if "date_added" not in value:
-                value["date_added"] = now
-            user_data[list_name].append(value)
-        else:
-            entry = {
-                "value": value,
-                "date_added": now
-            }
-            user_data[list_name].append(entry)
-        
-        # Update the last_modified timestamp
-        user_data["last_modified"] = now
-        
-        file_path = self.get_user_file_path(uuid_string)
-        write_json_file(file_path, user_data)
-        
-        return user_data
+        return self.patch(uuid_string, list_append_ops(list_name, value, now))
     
     def delete_user(self, uuid_string: str) -> bool:
         """Delete a user's data file."""
         if not self._is_valid_uuid(uuid_string):
             raise ValueError(f"Invalid UUID: {uuid_string}")
         
-        file_path = self.get_user_file_path(uuid_string)
-        return delete_file(file_path)
+        with self.locks.write(uuid_string):
+            was_pending = self.cache.is_dirty(uuid_string)
+            self.cache.invalidate(uuid_string)
+            self._forget(uuid_string)
+            return self.backend.delete_user(uuid_string) or was_pending
     
     def merge_users(self, source_uuid: str, target_uuid: str) -> Dict[str, Any]:
         """
         Merge data from the source user to the target user.
         After merging, the source user data is deleted.
         """
-        if not self._is_valid_uuid(source_uuid) or not self._is_valid_uuid(target_uuid):
+        return self.merge_users_into([source_uuid], target_uuid)
+    
+    def merge_users_into(self, source_uuids: List[str], target_uuid: str) -> Dict[str, Any]:
+        """
+        Merge data from several source users into the target user in one pass.
+        After merging, the source users' data is deleted.
+        """
+        if not source_uuids:
+            raise ValueError("At least one source UUID is required")
+        if not all(self._is_valid_uuid(uuid_string) for uuid_string in source_uuids + [target_uuid]):
             raise ValueError(f"Invalid UUID provided")
         
-        if source_uuid == target_uuid:
+        if target_uuid in source_uuids:
             raise ValueError("Source and target UUIDs must be different")
+        if len(set(source_uuids)) != len(source_uuids):
+            raise ValueError("Source UUIDs must be different")
         
-        if not self.user_exists(source_uuid):
-            raise ValueError(f"Source user does not exist: {source_uuid}")
-        
-        # Create target user if it doesn't exist
-        if not self.user_exists(target_uuid):
-            self.create_user(target_uuid)
-        
-        source_data = self.get_user_data(source_uuid)
-        target_data = self.get_user_data(target_uuid)
-        
-        # Merge data
-        merged_data = self._merge_user_data(source_data, target_data)
-        
-        # Update the target user
-        file_path = self.get_user_file_path(target_uuid)
-        write_json_file(file_path, merged_data)
+        for source_uuid in source_uuids:
+            if not self.user_exists(source_uuid):
+                raise ValueError(f"Source user does not exist: {source_uuid}")
         
-        # Delete the source user
-        self.delete_user(source_uuid)
+        with self.locks.write(target_uuid, *source_uuids):
+            # Create target user if it doesn't exist
+            if not self.user_exists(target_uuid):
+                self.create_user(target_uuid)
+            
+            sources_data = [self._load_user(source_uuid) for source_uuid in source_uuids]
+            if any(source_data is None for source_data in sources_data):
+                raise ValueError("Source user was deleted during the merge")
+            target_data = self.get_user_data(target_uuid)
+            
+            # Merge data
+            merged_data = self.merger.merge(target_data, sources_data)
+            
+            # Update the target user
+            self._save_user(target_uuid, merged_data)
+            
+            # Delete the source users while still holding their locks, so
+            # nothing written to them after the merge is lost
+            for source_uuid in source_uuids:
+                self.delete_user(source_uuid)
         
-        return merged_data
+        return clone_record(merged_data)
     
-    def _merge_user_data(self, source_data: Dict[str, Any], target_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Merge source user data into target user data."""
-        result = target_data.copy()
-        now = datetime.now().strftime("%Y-%m-%d")
-        result["last_modified"] = now
+    def list_users(self, offset: int = 0, limit: Optional[int] = None,
+                   order_by: str = "uuid", descending: bool = False) -> List[str]:
+        """
+        List user UUIDs from the registry, sorted by order_by ("uuid",
+        "created", "last_modified" or "size"), skipping offset and returning
+        at most limit. The first listing by a date reads the records' dates.
+        """
+        if order_by in ("created", "last_modified"):
+            self.registry.fill_dates(self.backend.read_user)
+        return self.registry.list(offset, limit, order_by, descending)
+    
+    #
+    # Secondary indexes
+    #
+    
+    def create_index(self, path: str) -> int:
+        """
+        Index a field path such as "preferences.theme" or "interests[].value"
+        so find_users can look it up without reading every record. Builds the
+        index from all users once; every write keeps it up to date after that.
+        Returns the number of users with a value for the field.
+        """
+        with self._index_lock:
+            index = self.indexes.get(path)
+            if index is None:
+                index = FieldIndex(path)
+                # Registered first, so writes made during the build reach it
+                self.indexes[path] = index
+                self._build_index(index)
+            return index.stats()["users"]
+    
+    def drop_index(self, path: str) -> bool:
+        """Remove a secondary index. Returns False if there wasn't one."""
+        with self._index_lock:
+            return self.indexes.pop(path, None) is not None
+    
+    def _build_index(self, index: FieldIndex) -> None:
+        """Fill an index from every user's record."""
+        index.ready = False
+        index.clear()
+        for uuid_string in self.registry.list():
+            with self.locks.read(uuid_string):
+                user_data = self._load_user(uuid_string)
+                if user_data is not None:
+                    index.update(uuid_string, user_data)
+        index.ready = True
+    
+    def find_users(self, filters: Dict[str, Any]) -> List[str]:
+        """
+        Find the users matching all {field path: value} filters, e.g.
+        {"preferences.theme": "dark"}. Indexed paths are looked up; other
+        paths are checked by reading the remaining candidates' records.
+        """
+        if not filters:
+            raise ValueError("At least one filter is required")
+        for path in filters:
+            parse_field_path(path)
+        
+        indexes = {path: index for path, index in list(self.indexes.items()) if index.ready}
+        indexed = [(path, value) for path, value in filters.items() if path in indexes]
+        unindexed = {path: value for path, value in filters.items() if path not in indexes}
+        
+        if indexed:
+            # Start from the most selective index
+            lookups = sorted((indexes[path].lookup(value) for path, value in indexed), key=len)
+            candidates = set.intersection(*lookups)
+        else:
+            candidates = self.registry.list()
         
-        # Loop through each key in source_data
-        for key, value in source_data.items():
-            # Skip UUID and created date
-            if key in ["uuid", "created"]:
-                continue
-            
-            # Handle different data types
-            if key not in result:
-                # If the key doesn't exist in target, copy it directly
-                result[key] = value
-            elif isinstance(value, list) and isinstance(result[key], list):
-                # Merge lists, avoiding duplicates by value field
-                existing_values = [item.get("value") for item in result[key] 
-                                  if isinstance(item, dict) and "value" in item]
-                
-                for item in value:
-                    if isinstance(item, dict) and "value" in item and item["value"] not in existing_values:
-                        result[key].append(item)
-                        existing_values.append(item["value"])
-            elif isinstance(value, dict) and isinstance(result[key], dict):
-                # Handle nested dictionaries
-                for field, field_value in value.items():
-                    if field == "last_modified":
-                        result[key]["last_modified"] = now
-                    elif field not in result[key] or field == "total_conversations":
-                        # Copy missing fields or add conversation counts
-                        if field == "total_conversations":
-                            result[key][field] = result[key].get(field, 0) + value.get(field, 0)
-                        else:
-                            result[key][field] = field_value
-                    elif isinstance(field_value, dict) and "date_added" in field_value:
-                        # For fields with date_added, keep the newer one
-                        if "date_added" in result[key][field]:
-                            if field_value["date_added"] > result[key][field]["date_added"]:
-                                result[key][field] = field_value
-                    elif isinstance(field_value, list) and isinstance(result[key][field], list):
-                        # For nested lists (like recent_topics), merge and sort
-                        combined = result[key][field] + field_value
-                        if field == "recent_topics" and all("date_discussed" in item for item in combined):
-                            combined.sort(key=lambda x: x["date_discussed"], reverse=True)
-                            result[key][field] = combined[:10]  # Keep only 10 most recent
-                        else:
-                            result[key][field] = combined
+        if unindexed:
+            candidates = [
+                uuid_string for uuid_string in candidates
+                if self._matches(uuid_string, unindexed)
+            ]
         
-        return result
+        return sorted(candidates)
     
-    def list_users(self) -> List[str]:
-        """List all user UUIDs."""
-        files = list_files(self.users_dir, ".json")
-        return [file.replace(".json", "") for file in files]
\ No newline at end of file
+    def _matches(self, uuid_string: str, filters: Dict[str, Any]) -> bool:
+        """Check a user's record against filters."""
+        with self.locks.read(uuid_string):
+            return matches(self._load_user(uuid_string) or {}, filters)
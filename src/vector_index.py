@@ -0,0 +1,542 @@
+import os
+import json
+import mmap
+import heapq
+import struct
+import operator
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Iterable, Tuple, Callable, BinaryIO
+
+from .embedding import Embedder, HashedNgramEmbedder
+from .file_utils import check_fsync_policy, ensure_directory_exists, delete_file, move_file, sync_descriptor
+from .log_format import HEADER_PREFIX, message_parts, render_line
+from .locks import StripedLocks, create_locks
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional; recall falls back to pure Python
+    numpy = None
+
+# Per-user files:
+#   <uuid>.vec  - header, then one fixed-size record per message:
+#                 metadata offset (u64), scale (f32), vector (int8 or float16)
+#   <uuid>.meta - header, then one JSON line per message: log name, timestamp and text
+# Records are fixed-size, so the .vec file can be memory-mapped as a matrix.
+# Both headers carry a random generation, new whenever the files are
+# rewritten, so a reader can tell that it opened two files that belong together.
+# Metadata is always written before the vector records pointing to it.
+VECTOR_DTYPES = ("int8", "float16")
+_MAGIC = b"CLXVEC02"
+_HEADER = struct.Struct("<8sHB32sQ")  # magic, dimensions, dtype, embedder name, generation
+_META_MAGIC = b"CLXMETA1"
+_META_HEADER = struct.Struct("<8sQ")  # magic, generation
+_RECORD_PREFIX = struct.Struct("<Qf")  # metadata offset, scale
+
+# Rows scored per step in recall
+_CHUNK_ROWS = 65536
+
+class VectorIndex:
+    """
+    Per-user store of message embeddings for similarity recall.
+    Vectors are quantized to int8 (with a per-vector scale) or float16 and
+    kept in memory-mappable files, so many processes can share them.
+    Appended messages are buffered and embedded in batches; recall always
+    sees them. Changes to a user's files hold that user's write lock from
+    locks, which is taken last (after any log lock), so pass locks with a
+    directory when other processes share the index.
+    """
+
+    def __init__(self, directory: str, embedder: Optional[Embedder] = None,
+                 dtype: str = "int8", batch_size: int = 256,
+                 locks: Optional[StripedLocks] = None, fsync_policy: str = "none"):
+        """Initialize the index in a directory with an embedder, vector type, locks and fsync policy."""
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Invalid vector dtype: {dtype}")
+        self.directory = directory
+        self.fsync_policy = check_fsync_policy(fsync_policy)
+        self.embedder = embedder or HashedNgramEmbedder()
+        self.dtype = dtype
+        self.batch_size = max(1, batch_size)
+        self.dimensions = self.embedder.dimensions
+        self._item_size = 1 if dtype == "int8" else 2
+        self._record_size = _RECORD_PREFIX.size + self.dimensions * self._item_size
+        # The header without its generation
+        self._format = _HEADER.pack(
+            _MAGIC, self.dimensions, VECTOR_DTYPES.index(dtype), self.embedder.name.encode("utf-8"), 0
+        )[:-8]
+        self._pending: List[Tuple[str, str, str]] = []
+        self._lock = threading.RLock()
+        self.locks = locks if locks is not None else StripedLocks()
+        ensure_directory_exists(directory)
+
+    #
+    # Updates (called by ConversationStore)
+    #
+
+    def add_lines(self, uuid_string: str, log_name: str, lines: Iterable[str]) -> None:
+        """Queue lines appended to a log for embedding."""
+        with self._lock:
+            self._pending.extend((uuid_string, log_name, line) for line in lines)
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def replace_log(self, uuid_string: str, log_name: str, lines: Iterable[str]) -> None:
+        """Re-embed a log whose content was replaced, reusing vectors of unchanged messages."""
+        with self._lock:
+            self.flush()
+            previous: Dict[str, bytes] = {}
+
+            def drop_log(meta: Dict[str, Any], payload: bytes) -> Optional[Dict[str, Any]]:
+                if meta["log"] != log_name:
+                    return meta
+                previous[meta["line"]] = payload
+                return None
+
+            self._rewrite(uuid_string, drop_log)
+            entries = self._entries(log_name, lines)
+            self._append(uuid_string, entries, reuse=previous)
+
+    def delete_log(self, uuid_string: str, log_name: str) -> None:
+        """Remove a log's vectors."""
+        with self._lock:
+            self.flush()
+            self._rewrite(uuid_string, lambda meta, payload: None if meta["log"] == log_name else meta)
+
+    def move_log(self, source_uuid: str, log_name: str,
+                 target_uuid: str, target_log_name: str) -> None:
+        """Move a log's vectors to another user or name without re-embedding them."""
+        with self._lock:
+            self.flush()
+            moved: List[Tuple[Dict[str, Any], bytes]] = []
+
+            def take_log(meta: Dict[str, Any], payload: bytes) -> Optional[Dict[str, Any]]:
+                if meta["log"] != log_name:
+                    return meta
+                moved.append((dict(meta, log=target_log_name), payload))
+                return None
+
+            self._rewrite(source_uuid, take_log)
+            self.delete_log(target_uuid, target_log_name)
+            self._append_records(target_uuid, moved)
+
+    def move_user(self, source_uuid: str, target_uuid: str) -> None:
+        """Move all of a user's vectors to a user without logs by renaming the files."""
+        with self._lock:
+            # Flush first, so other users' locks aren't taken while holding these
+            self.flush()
+            with self.locks.write(source_uuid, target_uuid):
+                for source_path, target_path in zip(self._paths(source_uuid), self._paths(target_uuid)):
+                    delete_file(target_path)
+                    try:
+                        move_file(source_path, target_path, self.fsync_policy)
+                    except FileNotFoundError:
+                        pass
+
+    def flush(self) -> None:
+        """Embed and store queued lines."""
+        with self._lock:
+            if not self._pending:
+                return
+            pending = self._pending
+            self._pending = []
+
+            by_user: "OrderedDict[str, List[Tuple[Dict[str, Any], str]]]" = OrderedDict()
+            for uuid_string, log_name, line in pending:
+                by_user.setdefault(uuid_string, []).extend(self._entries(log_name, (line,)))
+            for uuid_string, entries in by_user.items():
+                self._append(uuid_string, entries)
+
+    def clear(self) -> None:
+        """Remove every stored vector."""
+        with self._lock:
+            self._pending = []
+            for file_name in os.listdir(self.directory):
+                if file_name.endswith((".vec", ".meta")):
+                    delete_file(os.path.join(self.directory, file_name))
+
+    def close(self) -> None:
+        """Store any queued lines."""
+        self.flush()
+
+    #
+    # Recall
+    #
+
+    def recall(self, uuid_string: str, text: str, k: int = 5) -> List[Dict[str, Any]]:
+        """
+        Find a user's k messages most similar to text (cosine similarity),
+        best first. Each result has log_name, timestamp, line and score.
+        """
+        query = self.embedder.embed([text])[0]
+        if k <= 0 or not any(query):
+            return []
+
+        with self._lock:
+            if any(pending[0] == uuid_string for pending in self._pending):
+                self.flush()
+            files = self._open_files(uuid_string)
+            if files is None:
+                return []
+
+        vector_file, meta_file = files
+        with vector_file, meta_file:
+            # Vector records are written after their metadata, so every record
+            # counted here points into metadata that is already complete
+            rows = (os.fstat(vector_file.fileno()).st_size - _HEADER.size) // self._record_size
+            meta_size = os.fstat(meta_file.fileno()).st_size
+            if rows <= 0:
+                return []
+            with mmap.mmap(vector_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if numpy is not None:
+                    best = self._top_k_numpy(mapped, rows, query, k)
+                else:
+                    best = self._top_k_python(mapped, rows, query, k)
+
+                results = []
+                for score, row in best:
+                    meta_offset = _RECORD_PREFIX.unpack_from(mapped, self._row_start(row))[0]
+                    meta = self._read_meta(meta_file, meta_offset, meta_size)
+                    if meta is None:
+                        # Left without metadata by a crash
+                        continue
+                    results.append({
+                        "log_name": meta["log"],
+                        "timestamp": meta["timestamp"],
+                        "line": meta["line"],
+                        "score": score
+                    })
+        return results
+
+    def stats(self, uuid_string: str) -> Dict[str, Any]:
+        """Get the number of stored vectors and bytes used for a user."""
+        self.flush()
+        vector_path, meta_path = self._paths(uuid_string)
+        try:
+            vector_bytes = os.path.getsize(vector_path)
+            meta_bytes = os.path.getsize(meta_path)
+        except FileNotFoundError:
+            return {"vectors": 0, "bytes": 0}
+        return {
+            "vectors": (vector_bytes - _HEADER.size) // self._record_size,
+            "bytes": vector_bytes + meta_bytes
+        }
+
+    #
+    # Internals
+    #
+
+    def _paths(self, uuid_string: str) -> Tuple[str, str]:
+        """Get the vector and metadata file paths of a user."""
+        base = os.path.join(self.directory, uuid_string)
+        return f"{base}.vec", f"{base}.meta"
+
+    def _row_start(self, row: int) -> int:
+        """Get the byte offset of a record in the .vec file."""
+        return _HEADER.size + row * self._record_size
+
+    def _check_header(self, header: bytes, vector_path: str) -> int:
+        """Reject vector files written with another embedder or format. Returns the generation."""
+        if not header.startswith(self._format):
+            raise ValueError(
+                f"Vectors in {vector_path} were made with a different embedder or dtype; "
+                "rebuild the vector index"
+            )
+        return _HEADER.unpack(header)[-1]
+
+    def _meta_generation(self, header: bytes) -> Optional[int]:
+        """Get the generation from a metadata header, or None if it isn't one."""
+        if len(header) != _META_HEADER.size:
+            return None
+        magic, generation = _META_HEADER.unpack(header)
+        return generation if magic == _META_MAGIC else None
+
+    def _new_headers(self) -> Tuple[bytes, bytes]:
+        """Make vector and metadata headers for a new generation of a user's files."""
+        generation = int.from_bytes(os.urandom(8), "little")
+        return self._format + struct.pack("<Q", generation), _META_HEADER.pack(_META_MAGIC, generation)
+
+    def _open_files(self, uuid_string: str) -> Optional[Tuple[BinaryIO, BinaryIO]]:
+        """
+        Open a user's vector and metadata files, positioned after their headers.
+        Returns None if the user has no vectors.
+        """
+        files = self._open_generation(uuid_string)
+        if files is False:
+            # Opened across a rewrite in another process; rewrites hold the write lock
+            with self.locks.write(uuid_string):
+                files = self._open_generation(uuid_string)
+        # Still unmatched means a rewrite was interrupted by a crash
+        return files or None
+
+    def _open_generation(self, uuid_string: str) -> Any:
+        """
+        Open a user's files if they're from the same generation. Returns None
+        if either is missing, or False if they're from different generations
+        or not complete.
+        """
+        vector_path, meta_path = self._paths(uuid_string)
+        try:
+            vector_file = open(vector_path, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            meta_file = open(meta_path, 'rb')
+        except FileNotFoundError:
+            vector_file.close()
+            return None
+
+        try:
+            header = vector_file.read(_HEADER.size)
+            # A short header is still being written by the process creating the files
+            if len(header) == _HEADER.size:
+                generation = self._check_header(header, vector_path)
+                if self._meta_generation(meta_file.read(_META_HEADER.size)) == generation:
+                    return vector_file, meta_file
+        except BaseException:
+            vector_file.close()
+            meta_file.close()
+            raise
+        vector_file.close()
+        meta_file.close()
+        return False
+
+    def _read_meta(self, meta_file: BinaryIO, offset: int, meta_size: int) -> Optional[Dict[str, Any]]:
+        """Read the metadata line at offset, or None if it's out of range or incomplete."""
+        if offset < _META_HEADER.size or offset >= meta_size:
+            return None
+        meta_file.seek(offset)
+        line = meta_file.readline()
+        if not line.endswith(b"\n"):
+            return None
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+
+    def _entries(self, log_name: str, lines: Iterable[str]) -> List[Tuple[Dict[str, Any], str]]:
+        """Turn message lines into (metadata, text to embed) pairs, skipping headers and blanks."""
+        entries = []
+        for line in lines:
+            line = line.rstrip("\n")
+            if not line.strip() or line.startswith(HEADER_PREFIX):
+                continue
+            timestamp, text = message_parts(line)
+            line = render_line(line).rstrip("\n")
+            entries.append(({"log": log_name, "timestamp": timestamp, "line": line}, text))
+        return entries
+
+    def _encode(self, vector: List[float]) -> bytes:
+        """Quantize a vector into a record payload (scale and values)."""
+        if self.dtype == "float16":
+            return struct.pack(f"<f{self.dimensions}e", 1.0, *vector)
+        largest = max(map(abs, vector), default=0.0)
+        if not largest:
+            return struct.pack(f"<f{self.dimensions}b", 1.0, *([0] * self.dimensions))
+        factor = 127 / largest
+        return struct.pack(f"<f{self.dimensions}b", largest / 127, *[round(value * factor) for value in vector])
+
+    def _append(self, uuid_string: str, entries: List[Tuple[Dict[str, Any], str]],
+                reuse: Optional[Dict[str, bytes]] = None) -> None:
+        """Embed entries (unless the same line already has a vector in reuse) and store them."""
+        reuse = reuse or {}
+        missing = [text for meta, text in entries if meta["line"] not in reuse]
+        embedded = iter(self._encode(vector) for vector in self.embedder.embed(missing))
+        self._append_records(
+            uuid_string,
+            [(meta, reuse[meta["line"]] if meta["line"] in reuse else next(embedded))
+             for meta, _ in entries]
+        )
+
+    def _append_records(self, uuid_string: str, records: List[Tuple[Dict[str, Any], bytes]]) -> None:
+        """Append metadata lines and vector records for a user."""
+        if not records:
+            return
+        vector_path, meta_path = self._paths(uuid_string)
+        with self.locks.write(uuid_string):
+            files = self._open_generation(uuid_string)
+            if files:
+                for file in files:
+                    file.close()
+            with open(meta_path, 'ab') as meta_file, open(vector_path, 'ab') as vector_file:
+                if not files:
+                    # A new user, or files left unmatched by a crash: start both over
+                    vector_header, meta_header = self._new_headers()
+                    for file, header in ((meta_file, meta_header), (vector_file, vector_header)):
+                        file.truncate(0)
+                        file.seek(0)
+                        file.write(header)
+                self._write_records(vector_file, meta_file, records)
+
+    def _write_records(self, vector_file: BinaryIO, meta_file: BinaryIO,
+                       records: List[Tuple[Dict[str, Any], bytes]]) -> None:
+        """
+        Write records at the end of open vector and metadata files. The
+        metadata is written out first, so readers in other processes never see
+        a vector record before its metadata.
+        """
+        offset = meta_file.tell()
+        meta_lines = []
+        vector_records = []
+        for meta, payload in records:
+            data = (json.dumps(meta, ensure_ascii=False) + "\n").encode("utf-8")
+            meta_lines.append(data)
+            vector_records.append(struct.pack("<Q", offset) + payload)
+            offset += len(data)
+        meta_file.write(b"".join(meta_lines))
+        meta_file.flush()
+        sync_descriptor(meta_file.fileno(), meta_file.name, self.fsync_policy)
+        vector_file.write(b"".join(vector_records))
+
+    def _rewrite(self, uuid_string: str,
+                 keep: Callable[[Dict[str, Any], bytes], Optional[Dict[str, Any]]]) -> None:
+        """
+        Rewrite a user's files, keeping each record for which keep(meta, payload)
+        returns metadata. Records are streamed to temporary files, which are
+        then swapped in.
+        """
+        with self.locks.write(uuid_string):
+            vector_path, meta_path = self._paths(uuid_string)
+            files = self._open_generation(uuid_string)
+            if not files:
+                # Missing, or left unmatched by a crash: nothing usable to keep
+                if files is False:
+                    delete_file(vector_path)
+                    delete_file(meta_path)
+                return
+            vector_file, meta_file = files
+
+            temp_vector_path = self._temp_path(vector_path)
+            temp_meta_path = self._temp_path(meta_path)
+            try:
+                with vector_file, meta_file:
+                    changed, kept = self._copy_records(
+                        vector_file, meta_file, temp_vector_path, temp_meta_path, keep
+                    )
+                    mode = os.fstat(vector_file.fileno()).st_mode & 0o777
+            except BaseException:
+                delete_file(temp_vector_path)
+                delete_file(temp_meta_path)
+                raise
+
+            if not changed:
+                delete_file(temp_vector_path)
+                delete_file(temp_meta_path)
+            elif kept == 0:
+                for path in (temp_vector_path, temp_meta_path, vector_path, meta_path):
+                    delete_file(path)
+            else:
+                for path in (temp_vector_path, temp_meta_path):
+                    os.chmod(path, mode)
+                # Readers opening the files in between see two generations and retry
+                os.replace(temp_meta_path, meta_path)
+                os.replace(temp_vector_path, vector_path)
+
+    def _temp_path(self, path: str) -> str:
+        """Create an empty, uniquely named temporary file next to path."""
+        fd, temp_path = tempfile.mkstemp(
+            prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=self.directory
+        )
+        os.close(fd)
+        return temp_path
+
+    def _copy_records(self, vector_file: BinaryIO, meta_file: BinaryIO,
+                      temp_vector_path: str, temp_meta_path: str,
+                      keep: Callable[[Dict[str, Any], bytes], Optional[Dict[str, Any]]]) -> Tuple[bool, int]:
+        """
+        Copy the records kept by keep, from files positioned after their
+        headers, to temporary files. Returns (changed, records kept).
+        """
+        kept = 0
+        changed = False
+        meta_size = os.fstat(meta_file.fileno()).st_size
+        with open(temp_meta_path, 'wb') as temp_meta_file, \
+                open(temp_vector_path, 'wb') as temp_vector_file:
+            vector_header, meta_header = self._new_headers()
+            temp_vector_file.write(vector_header)
+            temp_meta_file.write(meta_header)
+            batch: List[Tuple[Dict[str, Any], bytes]] = []
+            while True:
+                record = vector_file.read(self._record_size)
+                if len(record) < self._record_size:
+                    break
+                meta = self._read_meta(meta_file, _RECORD_PREFIX.unpack_from(record)[0], meta_size)
+                if meta is None:
+                    changed = True
+                    continue
+                payload = record[8:]
+                new_meta = keep(meta, payload)
+                if new_meta is None:
+                    changed = True
+                    continue
+                changed = changed or new_meta is not meta
+                batch.append((new_meta, payload))
+                kept += 1
+                if len(batch) >= _CHUNK_ROWS:
+                    self._write_records(temp_vector_file, temp_meta_file, batch)
+                    batch = []
+            self._write_records(temp_vector_file, temp_meta_file, batch)
+        return changed, kept
+
+    def _top_k_numpy(self, mapped: mmap.mmap, rows: int, query: List[float],
+                     k: int) -> List[Tuple[float, int]]:
+        """Score all rows with chunked matrix-vector products and pick the best k."""
+        value_type = "i1" if self.dtype == "int8" else "<f2"
+        record_type = numpy.dtype([
+            ("meta", "<u8"),
+            ("scale", "<f4"),
+            ("vector", value_type, (self.dimensions,))
+        ])
+        matrix = numpy.frombuffer(mapped, dtype=record_type, count=rows, offset=_HEADER.size)
+        query_vector = numpy.asarray(query, dtype=numpy.float32)
+
+        scores = numpy.empty(rows, dtype=numpy.float32)
+        for start in range(0, rows, _CHUNK_ROWS):
+            chunk = matrix[start:start + _CHUNK_ROWS]
+            scores[start:start + len(chunk)] = (
+                chunk["vector"].astype(numpy.float32) @ query_vector
+            ) * chunk["scale"]
+
+        k = min(k, rows)
+        best = numpy.argpartition(-scores, k - 1)[:k]
+        best = best[numpy.argsort(-scores[best])]
+        return [(float(scores[row]), int(row)) for row in best]
+
+    def _top_k_python(self, mapped: mmap.mmap, rows: int, query: List[float],
+                      k: int) -> List[Tuple[float, int]]:
+        """Score all rows without NumPy and pick the best k."""
+        view = memoryview(mapped)
+        values_format = f"<{self.dimensions}e"
+
+        def scores() -> Iterable[Tuple[float, int]]:
+            multiply = operator.mul
+            for row in range(rows):
+                start = self._row_start(row) + 8
+                scale = struct.unpack_from("<f", mapped, start)[0]
+                values_start = start + 4
+                if self.dtype == "int8":
+                    values = view[values_start:values_start + self.dimensions].cast("b")
+                else:
+                    values = struct.unpack_from(values_format, mapped, values_start)
+                yield (sum(map(multiply, values, query)) * scale, row)
+
+        try:
+            return heapq.nlargest(k, scores())
+        finally:
+            view.release()
+
+def create_vector_index(data_dir: str, config: Dict[str, Any],
+                        embedder: Optional[Embedder] = None) -> Optional[VectorIndex]:
+    """Create the vector index described by config, or None if it isn't enabled."""
+    if not config.get("vector_index", False):
+        return None
+    if embedder is None:
+        embedder = HashedNgramEmbedder(dimensions=config.get("embedding_dimensions", 256))
+    return VectorIndex(
+        os.path.join(data_dir, "vectors"),
+        embedder=embedder,
+        dtype=config.get("vector_dtype", "int8"),
+        locks=create_locks(data_dir, config, "vectors"),
+        fsync_policy=config.get("fsync_policy", "none")
+    )
@@ -0,0 +1,129 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+from src.async_callisto import AsyncCallisto
+from src.config import load_config
+
+ALICE = "00000000-0000-4000-8000-00000000000a"
+BOB = "00000000-0000-4000-8000-00000000000b"
+CAROL = "00000000-0000-4000-8000-00000000000c"
+
+@pytest.fixture
+def config():
+    return dict(load_config(), persist_user_registry=False)
+
+def _run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, timeout=30))
+
+def _slow_down(callisto, name: str, delays) -> None:
+    """Make a Callisto method sleep before running, for each call in turn."""
+    real = getattr(callisto, name)
+    delays = iter(delays)
+
+    def slow(*args, **kwargs):
+        time.sleep(next(delays, 0))
+        return real(*args, **kwargs)
+
+    setattr(callisto, name, slow)
+
+def test_calls_for_the_same_user_run_in_call_order(tmp_path, config):
+    async def scenario():
+        async with AsyncCallisto(str(tmp_path), config=config, max_workers=8) as client:
+            # Earlier calls take longer, so without ordering they'd finish last
+            _slow_down(client.callisto, "append_to_conversation", [0.05 * (10 - n) for n in range(10)])
+            await asyncio.gather(*(
+                client.append_to_conversation(ALICE, "chat", f"message {n}", with_timestamp=False)
+                for n in range(10)
+            ))
+            return await client.get_recent_messages(ALICE, "chat", 10)
+
+    assert _run(scenario()) == [f"message {n}" for n in range(10)]
+
+def test_reads_see_earlier_writes_to_the_same_user(tmp_path, config):
+    async def scenario():
+        async with AsyncCallisto(str(tmp_path), config=config) as client:
+            await client.create_user(ALICE)
+            _slow_down(client.callisto, "update_user", [0.2])
+            _, data = await asyncio.gather(
+                client.update_user(ALICE, {"age": 30}),
+                client.get_user_data(ALICE)
+            )
+            return data
+
+    assert _run(scenario())["age"] == 30
+
+def test_calls_for_different_users_run_concurrently(tmp_path, config):
+    started = threading.Event()
+
+    async def scenario():
+        async with AsyncCallisto(str(tmp_path), config=config, max_workers=2) as client:
+            await client.create_user(ALICE)
+            await client.create_user(BOB)
+            real_update = client.callisto.update_user
+
+            def update(uuid, data):
+                if uuid == ALICE:
+                    # Only finishes if Bob's call runs while this one is still going
+                    assert started.wait(5)
+                else:
+                    started.set()
+                return real_update(uuid, data)
+
+            client.callisto.update_user = update
+            return await asyncio.gather(
+                client.update_user(ALICE, {"age": 30}),
+                client.update_user(BOB, {"age": 40})
+            )
+
+    alice, bob = _run(scenario())
+    assert (alice["age"], bob["age"]) == (30, 40)
+
+def test_apply_batch_waits_for_each_user_it_touches(tmp_path, config):
+    async def scenario():
+        async with AsyncCallisto(str(tmp_path), config=config) as client:
+            await client.create_user(ALICE)
+            await client.create_user(BOB)
+            _slow_down(client.callisto, "update_user", [0.2])
+            results = await asyncio.gather(
+                client.update_user(ALICE, {"topics": [{"value": "first"}]}),
+                client.apply_batch([
+                    {"op": "add_to_user_list", "uuid": ALICE, "list_name": "topics", "value": "second"},
+                    {"op": "update_user", "uuid": BOB, "data": {"age": 40}},
+                ]),
+                client.get_user_data(ALICE),
+                client.get_user_data(BOB)
+            )
+            async with client.batch() as batch:
+                batch.append_to_conversation(ALICE, "chat", "batched", with_timestamp=False)
+            messages = await client.get_recent_messages(ALICE, "chat", 1)
+            return results, messages
+
+    (_, committed, alice, bob), messages = _run(scenario())
+    assert committed == {"users": 2, "logs": 0}
+    assert [topic["value"] for topic in alice["topics"]] == ["first", "second"]
+    assert bob["age"] == 40
+    assert messages == ["batched"]
+
+def test_merge_many_users_is_ordered_with_calls_on_its_users(tmp_path, config):
+    async def scenario():
+        async with AsyncCallisto(str(tmp_path), config=config) as client:
+            for uuid in (ALICE, BOB, CAROL):
+                await client.create_user(uuid)
+            _slow_down(client.callisto, "append_to_conversation", [0.2])
+            results = await asyncio.gather(
+                client.append_to_conversation(ALICE, "chat", "before the merge", with_timestamp=False),
+                client.merge_many_users([(ALICE, BOB)]),
+                client.get_recent_messages(BOB, "chat", 5),
+                client.user_exists(ALICE),
+                client.update_user(CAROL, {"age": 50})
+            )
+            return results
+
+    _, merged, messages, alice_exists, carol = _run(scenario())
+    assert len(merged) == 1
+    assert messages == ["before the merge"]
+    assert not alice_exists
+    assert carol["age"] == 50
@@ -0,0 +1,119 @@
+from collections import Counter
+
+import pytest
+
+from src.callisto import Callisto
+from src.config import load_config
+
+ALICE = "00000000-0000-4000-8000-00000000000a"
+BOB = "00000000-0000-4000-8000-00000000000b"
+CAROL = "00000000-0000-4000-8000-00000000000c"
+
+@pytest.fixture(params=["files", "sqlite"])
+def callisto(request, tmp_path):
+    config = dict(load_config(), persist_user_registry=False)
+    callisto = Callisto(str(tmp_path), config=config, backend=request.param)
+    for uuid in (ALICE, BOB, CAROL):
+        callisto.create_user(uuid, {"name": uuid[-1]})
+    yield callisto
+    callisto.close()
+
+@pytest.fixture
+def writes(callisto, monkeypatch):
+    """Count backend writes per user and per log."""
+    counts = Counter()
+    backend = callisto.backend
+    for method in ("write_user", "write_log", "append_log"):
+        real = getattr(backend, method)
+
+        def counting(uuid, *args, _method=method, _real=real):
+            key = (_method, uuid) if _method == "write_user" else (_method, uuid, args[0])
+            counts[key] += 1
+            return _real(uuid, *args)
+
+        monkeypatch.setattr(backend, method, counting)
+    return counts
+
+def _without_identity(data):
+    return {key: value for key, value in data.items() if key not in ("uuid", "name")}
+
+def test_batch_gives_the_same_data_as_separate_calls(callisto):
+    with callisto.batch() as batch:
+        batch.update_user(ALICE, {"age": 30})
+        batch.update_user_field(ALICE, "preferences", "color", "blue")
+        batch.add_to_user_list(ALICE, "topics", "hiking")
+        batch.add_to_user_list(ALICE, "topics", "cooking")
+
+    callisto.update_user(BOB, {"age": 30})
+    callisto.update_user_field(BOB, "preferences", "color", "blue")
+    callisto.add_to_user_list(BOB, "topics", "hiking")
+    callisto.add_to_user_list(BOB, "topics", "cooking")
+
+    assert _without_identity(callisto.get_user_data(ALICE)) == _without_identity(callisto.get_user_data(BOB))
+
+def test_each_user_and_log_is_written_once(callisto, writes):
+    result = callisto.apply_batch([
+        {"op": "update_user", "uuid": ALICE, "data": {"age": 30}},
+        {"op": "update_user_field", "uuid": ALICE, "category": "preferences", "field": "color", "value": "blue"},
+        {"op": "add_to_user_list", "uuid": BOB, "list_name": "topics", "value": "hiking"},
+        {"op": "append_to_conversation", "uuid": ALICE, "log_name": "chat", "message": "one", "with_timestamp": False},
+        {"op": "append_to_conversation", "uuid": ALICE, "log_name": "chat", "message": "two", "with_timestamp": False},
+        {"op": "append_to_conversation", "uuid": BOB, "log_name": "chat", "message": "three", "with_timestamp": False},
+        {"op": "add_to_user_list", "uuid": BOB, "list_name": "topics", "value": "cooking"},
+    ])
+
+    assert result == {"users": 2, "logs": 2}
+    assert writes[("write_user", ALICE)] == 1
+    assert writes[("write_user", BOB)] == 1
+    assert writes[("write_user", CAROL)] == 0
+    # New logs are created with one write holding the header and both messages
+    alice_log_writes = sum(count for key, count in writes.items() if key[1:] == (ALICE, "chat"))
+    assert alice_log_writes == 1
+    assert callisto.get_user_data(ALICE)["age"] == 30
+    assert callisto.get_recent_messages(ALICE, "chat", 2) == ["one", "two"]
+    assert callisto.get_recent_messages(BOB, "chat", 1) == ["three"]
+
+def test_appends_to_an_existing_log_are_coalesced(callisto, writes):
+    callisto.append_to_conversation(ALICE, "chat", "zero", with_timestamp=False)
+    writes.clear()
+
+    with callisto.batch() as batch:
+        for message in ("one", "two", "three"):
+            batch.append_to_conversation(ALICE, "chat", message, with_timestamp=False)
+
+    assert writes == Counter({("append_log", ALICE, "chat"): 1})
+    assert callisto.get_recent_messages(ALICE, "chat", 4) == ["zero", "one", "two", "three"]
+
+def test_store_conversation_drops_earlier_queued_appends(callisto):
+    with callisto.batch() as batch:
+        batch.append_to_conversation(ALICE, "chat", "dropped", with_timestamp=False)
+        batch.store_conversation(ALICE, "chat", "replaced\n")
+        batch.append_to_conversation(ALICE, "chat", "kept", with_timestamp=False)
+
+    assert callisto.get_recent_messages(ALICE, "chat", 5) == ["replaced", "kept"]
+
+def test_an_exception_inside_the_block_discards_the_batch(callisto, writes):
+    with pytest.raises(RuntimeError):
+        with callisto.batch() as batch:
+            batch.update_user(ALICE, {"age": 30})
+            batch.append_to_conversation(ALICE, "chat", "never", with_timestamp=False)
+            raise RuntimeError("abort")
+
+    assert sum(writes.values()) == 0
+    assert "age" not in callisto.get_user_data(ALICE)
+    assert callisto.get_conversation(ALICE, "chat") is None
+
+def test_invalid_operations_are_rejected_before_anything_is_written(callisto, writes):
+    with pytest.raises(ValueError):
+        callisto.apply_batch([
+            {"op": "update_user", "uuid": ALICE, "data": {"age": 30}},
+            {"op": "delete_user", "uuid": BOB},
+        ])
+    with pytest.raises(ValueError):
+        callisto.apply_batch([
+            {"op": "update_user", "uuid": ALICE, "data": {"age": 30}},
+            {"op": "update_user", "uuid": "not-a-uuid", "data": {}},
+        ])
+
+    assert sum(writes.values()) == 0
+    assert "age" not in callisto.get_user_data(ALICE)
@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+from src.callisto import Callisto
+from src.config import load_config
+
+UUIDS = [f"00000000-0000-4000-8000-{n:012d}" for n in range(1, 13)]
+MISSING = "00000000-0000-4000-8000-999999999999"
+
+@pytest.fixture(params=[1, 4])
+def callisto(request, tmp_path):
+    config = dict(load_config(), persist_user_registry=False, read_workers=request.param)
+    setup = Callisto(str(tmp_path), config=config)
+    for n, uuid in enumerate(UUIDS):
+        setup.create_user(uuid, {"number": n})
+        setup.append_to_conversation(uuid, "chat", f"message {n}", with_timestamp=False)
+    setup.close()
+
+    # A fresh instance, so nothing starts out cached
+    callisto = Callisto(str(tmp_path), config=config)
+    yield callisto
+    callisto.close()
+
+@pytest.fixture
+def reads(callisto, monkeypatch):
+    """Record the user records read from the backend."""
+    reads = []
+    real = callisto.backend.read_user
+
+    def counting(uuid):
+        reads.append(uuid)
+        return real(uuid)
+
+    monkeypatch.setattr(callisto.backend, "read_user", counting)
+    return reads
+
+def test_users_come_back_in_the_given_order(callisto):
+    uuids = [UUIDS[5], MISSING, UUIDS[0], UUIDS[5]] + UUIDS[6:]
+    results = callisto.get_many_users(uuids)
+
+    assert [data and data["number"] for data in results] == [5, None, 0, 5] + list(range(6, 12))
+    # Each result is a copy of its own
+    results[0]["number"] = -1
+    assert results[3]["number"] == 5
+    assert callisto.get_user_data(UUIDS[5])["number"] == 5
+
+def test_order_holds_when_earlier_reads_finish_last(callisto, monkeypatch):
+    real = callisto.user_store.get_user_data
+
+    def slow_for_early_users(uuid):
+        time.sleep(0.01 * (len(UUIDS) - UUIDS.index(uuid)))
+        return real(uuid)
+
+    monkeypatch.setattr(callisto.user_store, "get_user_data", slow_for_early_users)
+    assert [data["number"] for data in callisto.get_many_users(UUIDS)] == list(range(len(UUIDS)))
+
+def test_second_read_is_served_from_the_cache(callisto, reads):
+    callisto.get_many_users(UUIDS)
+    assert sorted(reads) == UUIDS
+    hits = callisto.get_cache_stats()["hits"]
+
+    reads.clear()
+    callisto.get_many_users(UUIDS)
+    assert reads == []
+    assert callisto.get_cache_stats()["hits"] == hits + len(UUIDS)
+
+def test_invalid_uuids_are_rejected_before_reading(callisto, reads):
+    with pytest.raises(ValueError):
+        callisto.get_many_users(UUIDS[:3] + ["not-a-uuid"])
+    with pytest.raises(ValueError):
+        callisto.get_many_conversations([(UUIDS[0], "chat"), ("not-a-uuid", "chat")])
+    assert reads == []
+
+def test_streamed_users_cover_every_uuid(callisto):
+    streamed = dict(callisto.iter_many_users(UUIDS + [MISSING]))
+    assert streamed.pop(MISSING) is None
+    assert {uuid: data["number"] for uuid, data in streamed.items()} == {uuid: n for n, uuid in enumerate(UUIDS)}
+
+def test_conversations_come_back_in_the_given_order(callisto):
+    logs = [(UUIDS[3], "chat"), (UUIDS[3], "missing"), (MISSING, "chat"), (UUIDS[0], "chat"), (UUIDS[3], "chat")]
+    results = callisto.get_many_conversations(logs)
+
+    assert results[1] is None and results[2] is None
+    assert results[0] == results[4] == callisto.get_conversation(UUIDS[3], "chat")
+    assert results[0].rstrip().endswith("message 3")
+    assert results[3].rstrip().endswith("message 0")
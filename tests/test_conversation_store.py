@@ -0,0 +1,142 @@
+import re
+import json
+
+import pytest
+
+from src.conversation_store import ConversationStore
+from src.storage_backend import FileBackend
+
+ALICE = "00000000-0000-4000-8000-00000000000a"
+BOB = "00000000-0000-4000-8000-00000000000b"
+
+@pytest.fixture
+def store(tmp_path):
+    backend = FileBackend(str(tmp_path), log_buffer_size=64 * 1024, log_flush_interval=60)
+    yield ConversationStore(str(tmp_path), backend=backend)
+    backend.close()
+
+def _messages(content: str):
+    return [line for line in content.splitlines() if line and not line.startswith("===")]
+
+def test_shared_log_appends_keep_their_order(store):
+    store.store_multi_user_conversation([ALICE, BOB], "chat", "")
+    store.append_to_conversation(ALICE, "chat", "x", with_timestamp=False)
+    store.append_to_conversation(BOB, "chat", "y", with_timestamp=False)
+    store.append_to_conversation(ALICE, "chat", "z", with_timestamp=False)
+
+    assert _messages(store.get_conversation(ALICE, "chat")) == ["x", "y", "z"]
+    assert _messages(store.get_conversation(BOB, "chat")) == ["x", "y", "z"]
+
+def test_unshared_log_appends_are_buffered(store):
+    store.append_to_conversation(ALICE, "chat", "x", with_timestamp=False)
+    assert store.backend.appender.stats()["buffered_bytes"] > 0
+    assert _messages(store.get_conversation(ALICE, "chat")) == ["x"]
+
+LOG = (
+    "=== Conversation ===\n"
+    "\n"
+    "[2025-03-01 10:00:00] User: first\n"
+    "a continuation line\n"
+    "[2025-03-02 10:00:00] User: second\n"
+    "a note without a timestamp\n"
+    "[2025-03-03 10:00:00] User: third\n"
+)
+
+def test_date_pruning_keeps_untimestamped_lines(store):
+    store.store_conversation(ALICE, "chat", LOG)
+    assert store.prune_conversation(ALICE, "chat", start_date="2025-03-02", end_date="2025-03-02 23:59:59")
+    assert store.get_conversation(ALICE, "chat").splitlines()[2:] == [
+        "a continuation line",
+        "[2025-03-02 10:00:00] User: second",
+        "a note without a timestamp",
+    ]
+
+@pytest.mark.parametrize("options, expected", [
+    ({"keep_lines": 0}, []),
+    ({"keep_lines": 2}, ["a note without a timestamp", "[2025-03-03 10:00:00] User: third"]),
+    ({"keep_lines": 100}, LOG.splitlines()[2:]),
+    ({"keep_bytes": 5}, []),
+    ({"keep_bytes": len("[2025-03-03 10:00:00] User: third\n")}, ["[2025-03-03 10:00:00] User: third"]),
+    ({"start_date": "2025-04-01"}, ["a continuation line", "a note without a timestamp"]),
+    ({"keep_lines": 3, "start_date": "2025-03-03"}, ["a note without a timestamp", "[2025-03-03 10:00:00] User: third"]),
+])
+def test_pruning_keeps_the_header(store, options, expected):
+    store.store_conversation(ALICE, "chat", LOG)
+    assert store.prune_conversation(ALICE, "chat", **options)
+    lines = store.get_conversation(ALICE, "chat").splitlines()
+    assert lines[:2] == ["=== Conversation ===", ""]
+    assert lines[2:] == expected
+
+def test_pruning_a_missing_log_returns_false(store):
+    assert not store.prune_conversation(ALICE, "missing", keep_lines=1)
+    assert not store.prune_conversation(ALICE, "missing", start_date="2025-03-01")
+
+def test_pruning_sees_buffered_appends(store):
+    store.store_conversation(ALICE, "chat", LOG)
+    store.append_to_conversation(ALICE, "chat", "fourth", with_timestamp=False)
+    assert store.prune_conversation(ALICE, "chat", keep_lines=1)
+    assert store.get_conversation(ALICE, "chat").splitlines()[2:] == ["fourth"]
+
+def test_jsonl_records_are_pruned_by_date(tmp_path):
+    backend = FileBackend(str(tmp_path), log_buffer_size=0)
+    store = ConversationStore(str(tmp_path), backend=backend, log_format="jsonl")
+    store.store_conversation(ALICE, "chat", LOG)
+    assert store.prune_conversation(ALICE, "chat", start_date="2025-03-02")
+    lines = store.get_conversation(ALICE, "chat", as_text=True).splitlines()
+    # Continuation lines are part of their message's record, so they go with it
+    assert lines == [
+        "[2025-03-02 10:00:00] User: second",
+        "a note without a timestamp",
+        "[2025-03-03 10:00:00] User: third",
+    ]
+    backend.close()
+
+@pytest.fixture
+def jsonl_store(tmp_path):
+    backend = FileBackend(str(tmp_path), log_buffer_size=0)
+    yield ConversationStore(str(tmp_path), backend=backend, log_format="jsonl")
+    backend.close()
+
+def _records(content: str):
+    return [json.loads(line) for line in content.splitlines()]
+
+def test_jsonl_appends_store_the_text_verbatim(jsonl_store):
+    jsonl_store.append_to_conversation(ALICE, "chat", "Reminder: buy milk", with_timestamp=False)
+    jsonl_store.append_to_conversation(
+        ALICE, "chat", "Good morning", with_timestamp=False, metadata={"speaker": "User", "mood": "happy"}
+    )
+
+    assert _records(jsonl_store.get_conversation(ALICE, "chat")) == [
+        {"ts": None, "speaker": None, "text": "Reminder: buy milk", "metadata": {}},
+        {"ts": None, "speaker": "User", "text": "Good morning", "metadata": {"mood": "happy"}},
+    ]
+    assert jsonl_store.get_conversation(ALICE, "chat", as_text=True) == "Reminder: buy milk\nUser: Good morning\n"
+
+def test_jsonl_speaker_must_be_a_string(jsonl_store):
+    with pytest.raises(ValueError):
+        jsonl_store.append_to_conversation(ALICE, "chat", "hi", metadata={"speaker": 7})
+
+def test_jsonl_as_text_renders_timestamps(jsonl_store):
+    jsonl_store.append_to_conversation(ALICE, "chat", "Note: call Bob", metadata={"speaker": "User"})
+
+    [line] = jsonl_store.get_conversation(ALICE, "chat", as_text=True).splitlines()
+    record = _records(jsonl_store.get_conversation(ALICE, "chat"))[0]
+    assert isinstance(record["ts"], float)
+    assert re.fullmatch(r"\[\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\] User: Note: call Bob", line)
+
+def test_jsonl_multi_user_logs_keep_text_verbatim(jsonl_store):
+    jsonl_store.store_multi_user_conversation(
+        [ALICE, BOB], "chat", "=== Header ===\n\n[2025-03-01 10:00:00] User1: Hi everyone\nUser2: Hello\n"
+    )
+    jsonl_store.append_to_conversation(BOB, "chat", "Reminder: lunch", with_timestamp=False)
+
+    for uuid in (ALICE, BOB):
+        records = _records(jsonl_store.get_conversation(uuid, "chat"))
+        assert [(record["speaker"], record["text"]) for record in records] == [
+            (None, "User1: Hi everyone"),
+            (None, "User2: Hello"),
+            (None, "Reminder: lunch"),
+        ]
+        assert jsonl_store.get_conversation(uuid, "chat", as_text=True) == (
+            "[2025-03-01 10:00:00] User1: Hi everyone\nUser2: Hello\nReminder: lunch\n"
+        )
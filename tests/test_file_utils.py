@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from src import file_utils
+from src.file_utils import atomic_write_text, fsync_batch, link_file
+from src.sqlite_backend import SQLiteBackend
+from src.storage_backend import FileBackend
+
+USER = "00000000-0000-4000-8000-000000000001"
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Record fsyncs and renames in the order they happen."""
+    events = []
+    real_fsync = file_utils._fsync_descriptor
+    real_replace = os.replace
+    monkeypatch.setattr(file_utils, "_fsync_descriptor",
+                        lambda fd: (events.append("fsync"), real_fsync(fd)))
+    monkeypatch.setattr(file_utils.os, "replace",
+                        lambda src, dst: (events.append("replace"), real_replace(src, dst)))
+    return events
+
+def test_replaced_files_are_synced_before_the_rename_in_a_batch(tmp_path, calls):
+    with fsync_batch():
+        atomic_write_text(str(tmp_path / "a.json"), "a", "data")
+        atomic_write_text(str(tmp_path / "b.json"), "b", "data")
+    assert calls == ["fsync", "replace", "fsync", "replace"]
+
+def test_appends_in_a_batch_are_synced_once_at_the_end(tmp_path, calls):
+    path = str(tmp_path / "log.txt")
+    with fsync_batch():
+        file_utils.write_text_file(path, "one\n", mode="a", fsync_policy="data")
+        file_utils.write_text_file(path, "two\n", mode="a", fsync_policy="data")
+        assert calls == []
+    assert calls == ["fsync"]
+
+def test_each_backend_keeps_its_own_fsync_policy(tmp_path, calls):
+    durable = FileBackend(str(tmp_path / "durable"), log_buffer_size=0, fsync_policy="data")
+    fast = FileBackend(str(tmp_path / "fast"), log_buffer_size=0)
+    try:
+        fast.write_log(USER, "chat", "fast\n")
+        assert calls == ["replace"]
+
+        calls.clear()
+        durable.write_log(USER, "chat", "durable\n")
+        assert calls == ["fsync", "replace"]
+
+        calls.clear()
+        fast.append_log(USER, "chat", "more\n")
+        assert calls == []
+        durable.append_log(USER, "chat", "more\n")
+        assert calls == ["fsync"]
+    finally:
+        durable.close()
+        fast.close()
+
+    with pytest.raises(ValueError):
+        FileBackend(str(tmp_path / "bad"), fsync_policy="sometimes")
+
+def test_sqlite_commits_are_durable_unless_the_policy_is_none(tmp_path):
+    for policy, synchronous in (("none", 1), ("data", 2), ("full", 2)):
+        backend = SQLiteBackend(str(tmp_path / f"{policy}.db"), fsync_policy=policy)
+        try:
+            assert backend._connection().execute("PRAGMA synchronous").fetchone() == (synchronous,)
+        finally:
+            backend.close()
+
+def test_link_file_replaces_the_target_and_leaves_no_temporary_files(tmp_path):
+    source = tmp_path / "source.txt"
+    source.write_text("shared")
+    target = tmp_path / "links" / "target.txt"
+    target.parent.mkdir()
+    target.write_text("old")
+
+    assert link_file(str(source), str(target))
+    assert link_file(str(source), str(target))
+    assert target.read_text() == "shared"
+    assert os.path.samefile(source, target)
+    assert os.listdir(target.parent) == ["target.txt"]
+
+def test_read_tail_lines_strips_carriage_returns(tmp_path):
+    path = tmp_path / "log.txt"
+    path.write_bytes("one\r\ntwo\r\nthrée\r\n".encode("utf-8"))
+    assert file_utils.read_tail_lines(str(path), 2) == ["two", "thrée"]
+    assert file_utils.read_tail_lines(str(path), 5, block_size=4) == ["one", "two", "thrée"]
@@ -0,0 +1,129 @@
+import os
+import threading
+import multiprocessing
+
+import pytest
+
+from src import locks
+from src.callisto import Callisto
+from src.config import load_config
+from src.locks import ReadWriteLock
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="process locks need fcntl")
+
+USER = "00000000-0000-4000-8000-000000000001"
+APPENDERS = 2
+MESSAGES = 2000
+
+def _config() -> dict:
+    return dict(load_config(), process_locks=True, search_index=False, vector_index=False)
+
+def _append(data_dir: str, worker: int) -> None:
+    callisto = Callisto(data_dir, config=_config())
+    for number in range(MESSAGES):
+        callisto.append_to_conversation(USER, "chat", f"worker {worker} message {number}")
+    callisto.close()
+
+def _prune(data_dir: str, started, stop) -> None:
+    callisto = Callisto(data_dir, config=_config())
+    while not stop.is_set():
+        # Keeps every line, but still swaps in a rewritten copy of the log
+        callisto.prune_conversation(USER, "chat", keep_lines=APPENDERS * MESSAGES * 2)
+        started.set()
+    callisto.close()
+
+def _add_to_list(data_dir: str, worker: int) -> None:
+    callisto = Callisto(data_dir, config=_config())
+    for number in range(200):
+        callisto.add_to_user_list(USER, "items", f"{worker}-{number}")
+    callisto.close()
+
+def test_appends_survive_concurrent_prunes_in_other_processes(tmp_path):
+    data_dir = str(tmp_path)
+    callisto = Callisto(data_dir, config=_config())
+    callisto.store_conversation(USER, "chat", "=== Conversation ===\n")
+    callisto.close()
+
+    context = multiprocessing.get_context("fork")
+    started = context.Event()
+    stop = context.Event()
+    pruner = context.Process(target=_prune, args=(data_dir, started, stop))
+    pruner.start()
+    assert started.wait(30)
+    appenders = [context.Process(target=_append, args=(data_dir, worker))
+                 for worker in range(APPENDERS)]
+    for process in appenders:
+        process.start()
+    for process in appenders:
+        process.join()
+    stop.set()
+    pruner.join()
+    assert all(process.exitcode == 0 for process in appenders + [pruner])
+
+    callisto = Callisto(data_dir, config=_config())
+    content = callisto.get_conversation(USER, "chat")
+    callisto.close()
+    for worker in range(APPENDERS):
+        messages = [line for line in content.splitlines() if f"worker {worker} message" in line]
+        # Each worker's messages are all there, in the order they were sent
+        assert [line.rsplit(" ", 1)[1] for line in messages] == [str(n) for n in range(MESSAGES)]
+
+def test_list_updates_from_several_processes_are_not_lost(tmp_path):
+    data_dir = str(tmp_path)
+    callisto = Callisto(data_dir, config=_config())
+    callisto.create_user(USER)
+    callisto.close()
+
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_add_to_list, args=(data_dir, worker)) for worker in range(4)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+    assert all(process.exitcode == 0 for process in workers)
+
+    callisto = Callisto(data_dir, config=_config())
+    items = callisto.get_user_data(USER)["items"]
+    callisto.close()
+    assert len(items) == 4 * 200
+
+def test_waiting_for_the_file_lock_leaves_the_mutex_free(tmp_path):
+    path = str(tmp_path / "stripe.lock")
+    lock = ReadWriteLock(path)
+    # Another process holds the file lock
+    fd = os.open(path, os.O_RDWR | os.O_CREAT)
+    locks.fcntl.flock(fd, locks.fcntl.LOCK_EX)
+
+    acquired = threading.Event()
+
+    def write() -> None:
+        with lock.writing:
+            acquired.set()
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    try:
+        assert not acquired.wait(0.2)
+        assert lock._mutex.acquire(timeout=1)
+        lock._mutex.release()
+    finally:
+        locks.fcntl.flock(fd, locks.fcntl.LOCK_UN)
+        os.close(fd)
+    thread.join()
+    assert acquired.is_set()
+
+def test_failing_to_take_the_file_lock_releases_the_write_lock(tmp_path, monkeypatch):
+    lock = ReadWriteLock(str(tmp_path / "stripe.lock"))
+
+    def fail(fd, operation):
+        raise OSError("no locks here")
+
+    monkeypatch.setattr(locks.fcntl, "flock", fail)
+    with pytest.raises(OSError):
+        lock.acquire_write()
+    monkeypatch.undo()
+
+    with lock.reading:
+        pass
+    with lock.writing:
+        pass
@@ -0,0 +1,95 @@
+import os
+import time
+
+import pytest
+
+from src.config import load_config
+from src.log_appender import LogAppender
+from src.storage_backend import create_backend
+
+def _read(path) -> str:
+    with open(path, encoding="utf-8") as file:
+        return file.read()
+
+def test_buffer_is_written_once_it_reaches_buffer_size(tmp_path):
+    path = str(tmp_path / "log.txt")
+    appender = LogAppender(buffer_size=10, flush_interval=0)
+    try:
+        appender.append("log", path, "abcd\n")
+        assert _read(path) == ""
+        assert appender.stats()["buffered_bytes"] == 5
+
+        appender.append("log", path, "efgh\n")
+        assert _read(path) == "abcd\nefgh\n"
+        assert appender.stats()["buffered_bytes"] == 0
+    finally:
+        appender.close()
+
+def test_buffer_is_written_after_flush_interval(tmp_path):
+    path = str(tmp_path / "log.txt")
+    appender = LogAppender(buffer_size=1024 * 1024, flush_interval=0.1)
+    try:
+        appender.append("log", path, "later\n")
+        assert _read(path) == ""
+
+        deadline = time.monotonic() + 5
+        while _read(path) == "" and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert _read(path) == "later\n"
+        assert appender.stats()["buffered_bytes"] == 0
+    finally:
+        appender.close()
+
+def test_least_recently_used_handle_is_closed_and_flushed(tmp_path):
+    paths = {name: str(tmp_path / f"{name}.txt") for name in "abc"}
+    appender = LogAppender(max_handles=2, buffer_size=1024, flush_interval=0)
+    try:
+        appender.append("a", paths["a"], "a1\n")
+        appender.append("b", paths["b"], "b1\n")
+        # Touching a makes b the least recently used
+        appender.append("a", paths["a"], "a2\n")
+        appender.append("c", paths["c"], "c1\n")
+
+        assert not appender.is_open("b")
+        assert appender.is_open("a") and appender.is_open("c")
+        assert appender.stats()["open_handles"] == 2
+        assert _read(paths["b"]) == "b1\n"
+        assert _read(paths["a"]) == ""
+
+        # An evicted log reopens and keeps appending
+        appender.append("b", paths["b"], "b2\n")
+        assert not appender.is_open("a")
+        assert _read(paths["a"]) == "a1\na2\n"
+    finally:
+        appender.close()
+    assert _read(paths["b"]) == "b1\nb2\n"
+    assert _read(paths["c"]) == "c1\n"
+
+def test_shared_files_are_never_buffered(tmp_path):
+    path = str(tmp_path / "log.txt")
+    open(path, "w").close()
+    os.link(path, str(tmp_path / "link.txt"))
+    appender = LogAppender(buffer_size=1024, flush_interval=0)
+    try:
+        appender.append("log", path, "now\n")
+        assert _read(str(tmp_path / "link.txt")) == "now\n"
+    finally:
+        appender.close()
+
+def test_buffering_is_off_by_default_and_needs_process_locks_off(tmp_path):
+    backend = create_backend("files", str(tmp_path), load_config())
+    try:
+        assert backend.appender.buffer_size == 0
+    finally:
+        backend.close()
+
+    with pytest.raises(ValueError, match="process_locks"):
+        create_backend("files", str(tmp_path), dict(load_config(), log_buffer_size="64KB"))
+
+    backend = create_backend(
+        "files", str(tmp_path), dict(load_config(), log_buffer_size="64KB", process_locks=False)
+    )
+    try:
+        assert backend.appender.buffer_size == 64 * 1024
+    finally:
+        backend.close()
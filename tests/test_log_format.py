@@ -0,0 +1,20 @@
+from src.log_format import Message, lines_with_offsets, parse_messages
+
+LINES = [
+    "[2025-03-01 10:00:00] User: hello\n",
+    "second line\n",
+    "[2025-03-01 10:01:00]  indented\n",
+    "Jupiter: no timestamp\n",
+]
+
+def test_parse_messages_groups_continuations_and_strips_one_space():
+    assert list(parse_messages(lines_with_offsets(LINES))) == [
+        Message("2025-03-01 10:00:00", "User", "hello\nsecond line", 0),
+        Message("2025-03-01 10:01:00", None, " indented", 46),
+        Message(None, "Jupiter", "no timestamp", 78),
+    ]
+
+def test_parse_messages_in_reverse():
+    forward = list(parse_messages(lines_with_offsets(LINES)))
+    backward = list(parse_messages(reversed(list(lines_with_offsets(LINES))), reverse=True))
+    assert backward == forward[::-1]
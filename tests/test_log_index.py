@@ -0,0 +1,145 @@
+import os
+
+import pytest
+
+from src.log_index import LogIndex, index_path_for
+from src.storage_backend import FileBackend
+
+USER = "00000000-0000-4000-8000-000000000001"
+HEADER = "=== Conversation ===\n\n"
+
+def _log(days) -> str:
+    return HEADER + "".join(f"[2025-03-{day:02d} 10:00:00] day {day}\n" for day in days)
+
+@pytest.fixture
+def log_path(tmp_path):
+    path = tmp_path / "chat.txt"
+    path.write_text(_log(range(1, 6)))
+    return str(path)
+
+@pytest.fixture
+def rebuilds(monkeypatch):
+    """Count full rebuilds of any index."""
+    counts = []
+    real = LogIndex._rebuild
+
+    def counting(self):
+        counts.append(self.log_path)
+        real(self)
+
+    monkeypatch.setattr(LogIndex, "_rebuild", counting)
+    return counts
+
+def _lines_between(log_path, start_date, end_date):
+    index = LogIndex(log_path)
+    assert index.refresh()
+    start, end = index.offset_range(start_date, end_date)
+    with open(log_path, "rb") as file:
+        file.seek(start)
+        return file.read(end - start).decode().splitlines()
+
+def _days(lines):
+    return [int(line.rsplit(" ", 1)[1]) for line in lines]
+
+def _set_mtime(path, mtime_ns):
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+def test_ranges_are_found_in_the_index(log_path, rebuilds):
+    assert _days(_lines_between(log_path, "2025-03-02", "2025-03-04 23:59:59")) == [2, 3, 4]
+    assert _days(_lines_between(log_path, None, "2025-03-01 23:59:59")) == [1]
+    assert _days(_lines_between(log_path, "2025-03-06", None)) == []
+    assert len(rebuilds) == 1
+    assert os.path.exists(index_path_for(log_path))
+
+def test_appends_extend_the_index_without_a_rebuild(log_path, rebuilds):
+    _lines_between(log_path, None, None)
+    with open(log_path, "a") as file:
+        file.write("[2025-03-06 10:00:00] day 6\n[2025-03-07 10:00:00] day 7\n")
+
+    assert _days(_lines_between(log_path, "2025-03-05", None)) == [5, 6, 7]
+    assert len(rebuilds) == 1
+
+def test_missing_index_is_rebuilt(log_path, rebuilds):
+    _lines_between(log_path, None, None)
+    os.remove(index_path_for(log_path))
+
+    assert _days(_lines_between(log_path, "2025-03-04", None)) == [4, 5]
+    assert len(rebuilds) == 2
+
+def test_corrupt_index_is_rebuilt(log_path, rebuilds):
+    _lines_between(log_path, None, None)
+    with open(index_path_for(log_path), "r+b") as file:
+        file.write(b"garbage!")
+
+    assert _days(_lines_between(log_path, "2025-03-04", None)) == [4, 5]
+    assert len(rebuilds) == 2
+
+def test_index_is_rebuilt_when_the_log_shrank(log_path, rebuilds):
+    _lines_between(log_path, None, None)
+    with open(log_path, "w") as file:
+        file.write(_log([4, 5]))
+
+    assert _days(_lines_between(log_path, "2025-03-01", None)) == [4, 5]
+    assert len(rebuilds) == 2
+
+def test_index_is_rebuilt_when_the_covered_prefix_changed(log_path, rebuilds):
+    _lines_between(log_path, None, None)
+    # Longer than before, but the last indexed line no longer lines up
+    with open(log_path, "w") as file:
+        file.write(_log([11, 12, 13, 14, 15, 16, 17]))
+
+    assert _days(_lines_between(log_path, "2025-03-15", None)) == [15, 16, 17]
+    assert len(rebuilds) == 2
+
+def test_index_is_rebuilt_when_the_log_was_edited_in_place(log_path, rebuilds):
+    _lines_between(log_path, None, None)
+    mtime = os.stat(log_path).st_mtime_ns
+    # Same size and same last line, but an earlier timestamp changed
+    with open(log_path, "w") as file:
+        file.write(_log([1, 2, 3, 4, 5]).replace("2025-03-02", "2025-03-09"))
+    _set_mtime(log_path, mtime + 10**9)
+
+    index = LogIndex(log_path)
+    index.refresh()
+    assert not index.sorted
+    assert len(rebuilds) == 2
+
+def test_unchanged_log_reuses_the_index(log_path, rebuilds):
+    _lines_between(log_path, None, None)
+    _lines_between(log_path, "2025-03-02", None)
+    assert len(rebuilds) == 1
+
+def test_partly_written_last_line_is_indexed_once_complete(log_path):
+    with open(log_path, "a") as file:
+        file.write("[2025-03-06 10:00:00] da")
+    assert _days(_lines_between(log_path, "2025-03-05", None)[:1]) == [5]
+
+    with open(log_path, "a") as file:
+        file.write("y 6\n")
+    assert _days(_lines_between(log_path, "2025-03-06", None)) == [6]
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = FileBackend(str(tmp_path), log_buffer_size=0)
+    yield backend
+    backend.close()
+
+def test_out_of_order_timestamps_fall_back_to_a_scan(backend):
+    backend.write_log(USER, "chat", _log([1, 5, 2, 4, 3]) + "a note about day 3\n")
+
+    index = LogIndex(backend._log_path(USER, "chat"))
+    index.refresh()
+    assert not index.sorted
+    assert index.offset_range("2025-03-02", "2025-03-03 23:59:59") is None
+
+    lines = list(backend.iter_log_range(USER, "chat", "2025-03-02", "2025-03-03 23:59:59"))
+    assert lines == [
+        "[2025-03-02 10:00:00] day 2\n",
+        "[2025-03-03 10:00:00] day 3\n",
+        "a note about day 3\n",
+    ]
+    entries = list(backend.iter_log_offsets(USER, "chat", "2025-03-04", None, reverse=True))
+    # Newest first in file order, which here is not timestamp order
+    assert [line for _, line in entries] == ["[2025-03-04 10:00:00] day 4\n", "[2025-03-05 10:00:00] day 5\n"]
+    content = backend.read_log(USER, "chat").encode()
+    assert all(content[offset:].startswith(line.encode()) for offset, line in entries)
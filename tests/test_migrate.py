@@ -0,0 +1,67 @@
+import pytest
+
+from src.migrate import Migration, checksum_user
+from src.sqlite_backend import SQLiteBackend
+from src.storage_backend import FileBackend
+
+USERS = [f"00000000-0000-4000-8000-{number:012x}" for number in range(10)]
+
+@pytest.fixture
+def source(tmp_path):
+    backend = FileBackend(str(tmp_path / "files"), log_buffer_size=0)
+    for number, uuid in enumerate(USERS):
+        backend.write_user(uuid, {"uuid": uuid, "number": number})
+        backend.write_log(uuid, "chat", "=== Conversation ===\n\n" + "".join(
+            f"[2025-03-01 10:00:{second:02d}] message {second} of {number}\n" for second in range(7)
+        ))
+    yield backend
+    backend.close()
+
+def _interrupt_after(backend: SQLiteBackend, writes: int) -> None:
+    """Make the target fail partway through, like a crash would."""
+    write_user = backend.write_user
+    calls = []
+
+    def failing_write_user(uuid_string, data):
+        calls.append(uuid_string)
+        if len(calls) > writes:
+            raise RuntimeError("interrupted")
+        return write_user(uuid_string, data)
+
+    backend.write_user = failing_write_user
+
+def test_interrupted_migration_resumes_from_the_checkpoint(tmp_path, source):
+    checkpoint = str(tmp_path / "checkpoint")
+    target_path = str(tmp_path / "callisto.db")
+
+    target = SQLiteBackend(target_path)
+    _interrupt_after(target, 5)
+    with pytest.raises(RuntimeError):
+        Migration(source, target, checkpoint_path=checkpoint, readers=1,
+                  batch_size=3, chunk_lines=2).run()
+    target.close()
+    with open(checkpoint) as file:
+        done = [line.split()[0] for line in file]
+    assert 0 < len(done) < len(USERS)
+
+    target = SQLiteBackend(target_path)
+    stats = Migration(source, target, checkpoint_path=checkpoint, chunk_lines=2).run()
+    assert stats["skipped_users"] == len(done)
+    assert stats["users"] == len(USERS) - len(done)
+    assert stats["verification"]["ok"]
+    for uuid in USERS:
+        assert target.read_user(uuid) == source.read_user(uuid)
+        assert target.read_log(uuid, "chat") == source.read_log(uuid, "chat")
+        assert checksum_user(target, uuid) == checksum_user(source, uuid)
+    target.close()
+
+def test_verification_reports_changed_users(tmp_path, source):
+    target = SQLiteBackend(str(tmp_path / "callisto.db"))
+    migration = Migration(source, target)
+    assert migration.run()["verification"]["ok"]
+
+    target.append_log(USERS[3], "chat", "an extra line\n")
+    verification = migration.verify(USERS)
+    assert verification["checksum_mismatches"] == [USERS[3]]
+    assert not verification["ok"]
+    target.close()
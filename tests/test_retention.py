@@ -0,0 +1,131 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from src import retention
+from src.config import load_config
+from src.log_format import TIMESTAMP_FORMAT
+from src.retention import Retention
+from src.storage_backend import FileBackend
+
+USERS = [f"00000000-0000-4000-8000-{number:012x}" for number in range(6)]
+OLD = "[2000-01-01 10:00:00] old news\n"
+
+def _recent() -> str:
+    return f"[{datetime.now().strftime(TIMESTAMP_FORMAT)}] fresh news\n"
+
+@pytest.fixture
+def data_dir(tmp_path):
+    backend = FileBackend(str(tmp_path), log_buffer_size=0)
+    for uuid in USERS:
+        backend.write_log(uuid, "chat", "=== Conversation ===\n\n" + OLD + _recent())
+        backend.write_log(uuid, "archive", "=== Conversation ===\n\n" + OLD * 3)
+    backend.close()
+    return str(tmp_path)
+
+def _retention(data_dir, **kwargs) -> Retention:
+    config = dict(load_config(), search_index=False, vector_index=False)
+    return Retention("files", data_dir, {"max_age_days": 30}, config=config, **kwargs)
+
+def _logs(data_dir):
+    backend = FileBackend(data_dir, log_buffer_size=0)
+    try:
+        return {uuid: {name: backend.read_log(uuid, name) for name in backend.list_logs(uuid)} for uuid in USERS}
+    finally:
+        backend.close()
+
+def _check_pruned(data_dir):
+    for logs in _logs(data_dir).values():
+        # Logs with nothing left are deleted rather than kept empty
+        assert list(logs) == ["chat"]
+        assert "old news" not in logs["chat"]
+        assert "fresh news" in logs["chat"]
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_old_messages_are_dropped_and_emptied_logs_deleted(data_dir, workers):
+    stats = _retention(data_dir, workers=workers).run()
+
+    _check_pruned(data_dir)
+    assert stats["errors"] == []
+    assert stats["users"] == len(USERS)
+    assert stats["logs"] == 2 * len(USERS)
+    assert stats["pruned_logs"] == 2 * len(USERS)
+    assert stats["deleted_logs"] == len(USERS)
+    assert stats["bytes_reclaimed"] == stats["bytes_before"] - stats["bytes_after"] > 0
+    if workers:
+        assert all(pid != os.getpid() for pid in stats["workers"])
+        assert sum(worker["users"] for worker in stats["workers"].values()) == len(USERS)
+
+def test_compliant_logs_are_left_untouched(data_dir):
+    _retention(data_dir, workers=0).run()
+    before = _logs(data_dir)
+
+    stats = _retention(data_dir, workers=0).run()
+
+    assert stats["pruned_logs"] == 0
+    assert stats["bytes_reclaimed"] == 0
+    assert _logs(data_dir) == before
+
+def test_interrupted_run_resumes_from_the_checkpoint(tmp_path, data_dir, monkeypatch):
+    checkpoint = str(tmp_path / "retention.ckpt")
+    apply = retention.apply_retention_to_user
+    calls = []
+
+    def interrupted(store, uuid_string, policy, cutoff):
+        calls.append(uuid_string)
+        if len(calls) > 2:
+            raise KeyboardInterrupt
+        return apply(store, uuid_string, policy, cutoff)
+
+    monkeypatch.setattr(retention, "apply_retention_to_user", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        _retention(data_dir, workers=0, checkpoint_path=checkpoint).run()
+    monkeypatch.setattr(retention, "apply_retention_to_user", apply)
+    assert os.path.exists(checkpoint)
+
+    stats = _retention(data_dir, workers=0, checkpoint_path=checkpoint).run()
+
+    assert stats["skipped_users"] == 2
+    assert stats["users"] == len(USERS) - 2
+    _check_pruned(data_dir)
+
+def test_finished_run_removes_its_checkpoint(tmp_path, data_dir):
+    checkpoint = str(tmp_path / "retention.ckpt")
+    _retention(data_dir, workers=0, checkpoint_path=checkpoint).run()
+    assert not os.path.exists(checkpoint)
+
+    # New old messages arrive; a rerun with the same file must check everyone again
+    backend = FileBackend(data_dir, log_buffer_size=0)
+    for uuid in USERS:
+        backend.write_log(uuid, "chat", "=== Conversation ===\n\n" + OLD + _recent())
+    backend.close()
+
+    stats = _retention(data_dir, workers=0, checkpoint_path=checkpoint).run()
+
+    assert stats["skipped_users"] == 0
+    assert stats["pruned_logs"] == len(USERS)
+    _check_pruned(data_dir)
+
+def test_failed_users_keep_the_checkpoint_for_a_retry(tmp_path, data_dir, monkeypatch):
+    checkpoint = str(tmp_path / "retention.ckpt")
+    apply = retention.apply_retention_to_user
+
+    def failing(store, uuid_string, policy, cutoff):
+        if uuid_string == USERS[0]:
+            raise OSError("disk trouble")
+        return apply(store, uuid_string, policy, cutoff)
+
+    monkeypatch.setattr(retention, "apply_retention_to_user", failing)
+    stats = _retention(data_dir, workers=0, checkpoint_path=checkpoint).run()
+    monkeypatch.setattr(retention, "apply_retention_to_user", apply)
+
+    assert [error["uuid"] for error in stats["errors"]] == [USERS[0]]
+    assert os.path.exists(checkpoint)
+
+    stats = _retention(data_dir, workers=0, checkpoint_path=checkpoint).run()
+
+    assert stats["users"] == 1
+    assert stats["skipped_users"] == len(USERS) - 1
+    assert not os.path.exists(checkpoint)
+    _check_pruned(data_dir)
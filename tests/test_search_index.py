@@ -0,0 +1,130 @@
+import sqlite3
+
+import pytest
+
+from src import search_index as search_index_module
+from src.config import load_config
+from src.conversation_store import ConversationStore
+from src.search_index import SearchIndex, create_search_index
+from src.storage_backend import FileBackend
+
+ALICE = "00000000-0000-4000-8000-00000000000a"
+BOB = "00000000-0000-4000-8000-00000000000b"
+CAROL = "00000000-0000-4000-8000-00000000000c"
+
+@pytest.fixture
+def store(tmp_path):
+    backend = FileBackend(str(tmp_path))
+    index = SearchIndex(str(tmp_path / "search.db"))
+    yield ConversationStore(str(tmp_path), backend=backend, search_index=index)
+    index.close()
+    backend.close()
+
+def _lines(results):
+    return [(result["uuid"], result["log_name"], result["line"]) for result in results]
+
+def test_search_index_is_off_by_default(tmp_path):
+    assert create_search_index(str(tmp_path), load_config()) is None
+    assert not (tmp_path / "search.db").exists()
+    index = create_search_index(str(tmp_path), dict(load_config(), search_index=True))
+    assert index is not None
+    index.close()
+
+def test_missing_fts5_raises_a_clear_error(tmp_path, monkeypatch):
+    # An unknown module fails the same way as an SQLite built without FTS5
+    monkeypatch.setattr(search_index_module, "_SCHEMA", "CREATE VIRTUAL TABLE postings USING fts5x(message);")
+    with pytest.raises(RuntimeError, match="FTS5"):
+        SearchIndex(str(tmp_path / "search.db"))
+
+def test_results_are_ranked_best_match_first(store):
+    store.append_to_conversation(ALICE, "chat", "boots for the weekend", with_timestamp=False)
+    store.append_to_conversation(ALICE, "chat", "hiking boots, hiking poles and hiking maps", with_timestamp=False)
+    store.append_to_conversation(ALICE, "chat", "nothing relevant here", with_timestamp=False)
+
+    results = store.search("hiking boots")
+
+    assert [result["line"] for result in results] == [
+        "hiking boots, hiking poles and hiking maps",
+        "boots for the weekend",
+    ]
+    assert results[0]["score"] > results[1]["score"] > 0
+
+def test_timestamps_and_headers_are_not_searchable(store):
+    store.append_to_conversation(ALICE, "chat", "lunch at noon")
+
+    results = store.search("lunch")
+    assert len(results) == 1
+    assert results[0]["timestamp"] is not None
+    assert results[0]["line"] == f"[{results[0]['timestamp']}] lunch at noon"
+    assert store.search(results[0]["timestamp"][:4]) == []
+    assert store.search("Conversation") == []
+
+def test_uuid_filter_limits_results_to_one_user(store):
+    store.append_to_conversation(ALICE, "chat", "pizza tonight", with_timestamp=False)
+    store.append_to_conversation(BOB, "chat", "pizza tomorrow", with_timestamp=False)
+
+    assert _lines(store.search("pizza", BOB)) == [(BOB, "chat", "pizza tomorrow")]
+    assert len(store.search("pizza")) == 2
+    assert store.search("pizza", limit=1)[0]["uuid"] in (ALICE, BOB)
+
+def test_pruning_reindexes_the_log(store):
+    for message in ("apples", "bananas", "cherries"):
+        store.append_to_conversation(ALICE, "chat", message, with_timestamp=False)
+
+    store.prune_conversation(ALICE, "chat", keep_lines=1)
+
+    assert store.search("apples bananas") == []
+    assert _lines(store.search("cherries")) == [(ALICE, "chat", "cherries")]
+    assert store.search_index.stats() == {"messages": 1, "logs": 1}
+
+def test_deleting_a_log_removes_it_from_the_index(store):
+    store.append_to_conversation(ALICE, "chat", "secret plans", with_timestamp=False)
+    store.append_to_conversation(ALICE, "notes", "public plans", with_timestamp=False)
+
+    store.delete_conversation(ALICE, "chat")
+
+    assert _lines(store.search("plans")) == [(ALICE, "notes", "public plans")]
+
+def test_moved_logs_are_found_under_their_new_owner(store):
+    store.append_to_conversation(ALICE, "chat", "moving day", with_timestamp=False)
+    store.move_conversations(ALICE, BOB)
+    assert _lines(store.search("moving")) == [(BOB, "chat", "moving day")]
+
+    # Logs moved onto a user who already has logs go one by one
+    store.append_to_conversation(CAROL, "notes", "moving again", with_timestamp=False)
+    store.move_conversations(BOB, CAROL)
+    assert sorted(_lines(store.search("moving"))) == [
+        (CAROL, "chat", "moving day"),
+        (CAROL, "notes", "moving again"),
+    ]
+    assert store.search("moving", BOB) == []
+
+def test_appends_are_indexed_before_the_call_returns(tmp_path, store):
+    store.append_to_conversation(ALICE, "chat", "durable words", with_timestamp=False)
+
+    # A crash now (no flush or close) must not lose the line
+    connection = sqlite3.connect(str(tmp_path / "search.db"))
+    try:
+        assert connection.execute("SELECT count(*) FROM documents").fetchone() == (1,)
+    finally:
+        connection.close()
+
+def test_reindexing_from_another_process_does_not_duplicate_appends(tmp_path, store):
+    store.append_to_conversation(ALICE, "chat", "only once", with_timestamp=False)
+
+    # Another process sharing the database reindexes the log from disk
+    other = SearchIndex(str(tmp_path / "search.db"))
+    try:
+        other.replace_log(ALICE, "chat", store.backend.iter_log_lines(ALICE, "chat"))
+    finally:
+        other.close()
+    store.search_index.flush()
+
+    assert _lines(store.search("once")) == [(ALICE, "chat", "only once")]
+
+def test_rebuild_restores_an_index_that_missed_writes(tmp_path, store):
+    store.backend.write_log(ALICE, "chat", "copied in by hand\n")
+    assert store.search("copied") == []
+
+    assert store.rebuild_search_index() == {"messages": 1, "logs": 1}
+    assert _lines(store.search("copied")) == [(ALICE, "chat", "copied in by hand")]
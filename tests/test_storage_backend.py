@@ -0,0 +1,114 @@
+import os
+import multiprocessing
+
+import pytest
+
+from src.callisto import Callisto
+from src.config import load_config
+from src.locks import create_locks
+from src.storage_backend import FileBackend
+
+USERS = [f"00000000-0000-4000-8000-{number:012x}" for number in range(20)]
+
+def _config() -> dict:
+    return dict(load_config(), process_locks=True, search_index=False, vector_index=False)
+
+def _write(data_dir: str, started) -> None:
+    callisto = Callisto(data_dir, config=_config())
+    for round_number in range(20):
+        for uuid in USERS:
+            callisto.append_to_conversation(uuid, "chat", f"message {round_number}")
+            callisto.add_to_user_list(uuid, "items", round_number)
+        started.set()
+    callisto.close()
+
+@pytest.mark.skipif(os.name != "posix", reason="process locks need fcntl")
+def test_reshard_while_another_process_writes(tmp_path):
+    data_dir = str(tmp_path)
+    callisto = Callisto(data_dir, config=_config())
+    for uuid in USERS:
+        callisto.create_user(uuid)
+        callisto.store_conversation(uuid, "chat", "=== Conversation ===\n")
+    callisto.close()
+
+    context = multiprocessing.get_context("fork")
+    started = context.Event()
+    writer = context.Process(target=_write, args=(data_dir, started))
+    writer.start()
+    assert started.wait(30)
+    # Move everything back and forth between the layouts while the writer runs
+    layout = "sharded"
+    while writer.is_alive():
+        backend = FileBackend(data_dir, log_buffer_size=0, layout=layout)
+        backend.reshard(create_locks(data_dir, _config(), "users"),
+                        create_locks(data_dir, _config(), "logs"))
+        backend.close()
+        layout = "flat" if layout == "sharded" else "sharded"
+    writer.join()
+    assert writer.exitcode == 0
+    backend = FileBackend(data_dir, log_buffer_size=0, layout="sharded")
+    backend.reshard()
+    backend.close()
+
+    assert os.listdir(f"{data_dir}/users") != []
+    assert not any(name.endswith(".json") for name in os.listdir(f"{data_dir}/users"))
+    callisto = Callisto(data_dir, config=dict(_config(), storage_layout="sharded"))
+    for uuid in USERS:
+        assert len(callisto.get_user_data(uuid)["items"]) == 20
+        messages = [line for line in callisto.get_conversation(uuid, "chat").splitlines()
+                    if "message" in line]
+        assert len(messages) == 20
+    callisto.close()
+
+#
+# Backend parity
+#
+
+ALICE, BOB = USERS[:2]
+
+def _exercise(callisto: Callisto) -> list:
+    """Run the same operations on a backend and collect everything they return."""
+    results = []
+    record = results.append
+
+    callisto.create_user(ALICE, {"name": "Ada", "tags": ["a"]})
+    callisto.create_user(BOB)
+    callisto.update_user_field(ALICE, "preferences", "theme", "dark")
+    callisto.add_to_user_list(ALICE, "tags", "b")
+    callisto.patch_user(BOB, [{"op": "increment", "path": "/stats/visits", "value": 3}])
+    for uuid in (ALICE, BOB):
+        record({key: value for key, value in callisto.get_user_data(uuid).items()
+                if key not in ("created", "last_modified")})
+    record(sorted(callisto.list_users()))
+
+    callisto.store_conversation(ALICE, "chat", (
+        "=== Conversation ===\n\n"
+        "[2025-03-01 10:00:00] User: first\n"
+        "more of the first\n"
+        "[2025-03-02 10:00:00] Jupiter: second\n"
+    ))
+    callisto.append_to_conversation(ALICE, "chat", "[2025-03-03 10:00:00] User: third", with_timestamp=False)
+    callisto.append_to_conversation(ALICE, "notes", "a note", with_timestamp=False)
+    record(callisto.get_conversation(ALICE, "chat"))
+    record(callisto.get_recent_messages(ALICE, "chat", 2))
+    record(callisto.get_conversation_range(ALICE, "chat", "2025-03-02", "2025-03-02 23:59:59"))
+    record([tuple(message[:3]) for message in callisto.iter_messages(ALICE, "chat", reverse=True)])
+    record(sorted(callisto.list_conversations(ALICE)))
+
+    record(callisto.prune_conversation(ALICE, "chat", keep_lines=3))
+    record(callisto.get_conversation(ALICE, "chat"))
+    record(callisto.delete_conversation(ALICE, "notes"))
+    record(callisto.delete_conversation(ALICE, "notes"))
+    record(callisto.list_conversations(ALICE))
+    record(callisto.delete_user(BOB))
+    record(callisto.user_exists(BOB))
+    return results
+
+def test_file_and_sqlite_backends_behave_the_same(tmp_path):
+    config = dict(load_config(), search_index=False, vector_index=False, process_locks=False)
+    results = {}
+    for backend in ("files", "sqlite"):
+        callisto = Callisto(str(tmp_path / backend), config=config, backend=backend)
+        results[backend] = _exercise(callisto)
+        callisto.close()
+    assert results["files"] == results["sqlite"]
@@ -0,0 +1,95 @@
+import pytest
+
+from src.callisto import Callisto
+from src.config import load_config
+from src.user_index import FieldIndex
+
+ALICE = "00000000-0000-4000-8000-00000000000a"
+BOB = "00000000-0000-4000-8000-00000000000b"
+CAROL = "00000000-0000-4000-8000-00000000000c"
+
+@pytest.fixture
+def callisto(tmp_path):
+    config = dict(load_config(), persist_user_registry=False)
+    callisto = Callisto(str(tmp_path), config=config)
+    callisto.create_user(ALICE, {"preferences": {"theme": "dark"}})
+    callisto.create_user(BOB, {"preferences": {"theme": "light"}})
+    callisto.create_user(CAROL)
+    yield callisto
+    callisto.close()
+
+def _find(callisto, filters):
+    """Find users with the filtered paths indexed, and again without any index."""
+    indexed = callisto.find_users(filters)
+    indexes = list(callisto.user_store.indexes)
+    for path in indexes:
+        callisto.drop_user_index(path)
+    unindexed = callisto.find_users(filters)
+    for path in indexes:
+        callisto.create_user_index(path)
+    assert indexed == unindexed
+    return indexed
+
+def test_index_is_built_from_existing_users(callisto):
+    assert callisto.create_user_index("preferences.theme") == 2
+    assert _find(callisto, {"preferences.theme": "dark"}) == [ALICE]
+
+def test_index_follows_updates(callisto):
+    callisto.create_user_index("preferences.theme")
+    callisto.create_user_index("interests[].value")
+
+    callisto.update_user_field(BOB, "preferences", "theme", "dark")
+    callisto.update_user(ALICE, {"preferences": {"theme": "solarized"}})
+    callisto.add_to_user_list(CAROL, "interests", "chess")
+    callisto.add_to_user_list(ALICE, "interests", "chess")
+
+    assert _find(callisto, {"preferences.theme": "dark"}) == [BOB]
+    assert _find(callisto, {"preferences.theme": "solarized"}) == [ALICE]
+    assert _find(callisto, {"interests[].value": "chess"}) == [ALICE, CAROL]
+    assert _find(callisto, {"interests[].value": "chess", "preferences.theme": "solarized"}) == [ALICE]
+
+def test_index_follows_deletes(callisto):
+    callisto.create_user_index("preferences.theme")
+    callisto.delete_user(ALICE)
+
+    assert _find(callisto, {"preferences.theme": "dark"}) == []
+    assert callisto.user_store.indexes["preferences.theme"].stats() == {"values": 1, "users": 1}
+
+def test_index_follows_merges(callisto):
+    callisto.create_user_index("preferences.theme")
+    callisto.create_user_index("interests[].value")
+    callisto.add_to_user_list(ALICE, "interests", "chess")
+    callisto.add_to_user_list(BOB, "interests", "go")
+
+    callisto.merge_users(ALICE, CAROL)
+    callisto.merge_users_into([BOB], CAROL)
+
+    assert _find(callisto, {"interests[].value": "chess"}) == [CAROL]
+    assert _find(callisto, {"interests[].value": "go"}) == [CAROL]
+    # The target keeps its own value once it has one
+    assert _find(callisto, {"preferences.theme": "dark"}) == [CAROL]
+    assert _find(callisto, {"preferences.theme": "light"}) == []
+    assert callisto.user_store.indexes["interests[].value"].stats()["users"] == 1
+
+def test_values_only_match_the_same_type(callisto):
+    callisto.update_user(ALICE, {"flag": True})
+    callisto.update_user(BOB, {"flag": 1})
+    callisto.update_user(CAROL, {"flag": 1.0})
+    callisto.create_user_index("flag")
+
+    assert _find(callisto, {"flag": True}) == [ALICE]
+    assert _find(callisto, {"flag": 1}) == [BOB]
+    assert _find(callisto, {"flag": 1.0}) == [CAROL]
+    assert _find(callisto, {"flag": "1"}) == []
+
+def test_structured_values_match_by_content():
+    index = FieldIndex("tags[]")
+    index.update(ALICE, {"tags": [{"b": 1, "a": [1, 2]}, "x"]})
+    index.update(BOB, {"tags": [{"a": [1, 2], "b": True}]})
+
+    assert index.lookup({"a": [1, 2], "b": 1}) == {ALICE}
+    assert index.lookup({"a": [1, 2], "b": True}) == {BOB}
+
+    index.update(ALICE, {"tags": ["x"]})
+    assert index.lookup({"a": [1, 2], "b": 1}) == set()
+    assert index.lookup("x") == {ALICE}
@@ -0,0 +1,189 @@
+import copy
+
+import pytest
+
+from src.callisto import Callisto
+from src.config import load_config
+from src.user_merge import UserMerger
+
+NOW = "2025-06-01"
+
+TARGET = {
+    "uuid": "target",
+    "created": "2025-01-01",
+    "last_modified": "2025-05-01",
+    "name": "Target",
+    "interests": [
+        {"value": "chess", "date_added": "2025-01-02"},
+        {"value": "hiking", "date_added": "2025-01-03"},
+    ],
+    "preferences": {
+        "theme": {"value": "dark", "date_added": "2025-02-01"},
+        "language": {"value": "en", "date_added": "2025-03-01"},
+        "last_modified": "2025-05-01",
+    },
+    "stats": {
+        "total_conversations": 5,
+        "recent_topics": [
+            {"topic": f"target {n}", "date_discussed": f"2025-04-{n:02d}"} for n in range(1, 8)
+        ],
+        "notes": ["target note"],
+    },
+}
+
+SOURCE = {
+    "uuid": "source",
+    "created": "2024-12-01",
+    "last_modified": "2025-05-15",
+    "name": "Source",
+    "email": "source@example.com",
+    "interests": [
+        {"value": "hiking", "date_added": "2025-05-01"},
+        {"value": "cooking", "date_added": "2025-05-02"},
+    ],
+    "preferences": {
+        "theme": {"value": "light", "date_added": "2025-04-01"},
+        "language": {"value": "fr", "date_added": "2025-01-01"},
+        "timezone": {"value": "UTC", "date_added": "2025-01-01"},
+    },
+    "stats": {
+        "last_modified": "2025-05-15",
+        "total_conversations": 3,
+        "recent_topics": [
+            {"topic": f"source {n}", "date_discussed": f"2025-04-{n:02d}"} for n in range(4, 12, 2)
+        ],
+        "notes": ["source note"],
+    },
+}
+
+# The result of merging SOURCE into TARGET under the original merge rules
+GOLDEN = {
+    "uuid": "target",
+    "created": "2025-01-01",
+    "last_modified": NOW,
+    "name": "Target",
+    # Lists of dicts are deduplicated by "value"; the target's entry is kept
+    "interests": [
+        {"value": "chess", "date_added": "2025-01-02"},
+        {"value": "hiking", "date_added": "2025-01-03"},
+        {"value": "cooking", "date_added": "2025-05-02"},
+    ],
+    "preferences": {
+        # The entry with the newest date_added wins
+        "theme": {"value": "light", "date_added": "2025-04-01"},
+        "language": {"value": "en", "date_added": "2025-03-01"},
+        # Only touched when the source's category has a date too
+        "last_modified": "2025-05-01",
+        "timezone": {"value": "UTC", "date_added": "2025-01-01"},
+    },
+    "stats": {
+        "total_conversations": 8,
+        # The 10 most recently discussed topics, newest first
+        "recent_topics": [
+            {"topic": "source 10", "date_discussed": "2025-04-10"},
+            {"topic": "source 8", "date_discussed": "2025-04-08"},
+            {"topic": "target 7", "date_discussed": "2025-04-07"},
+            {"topic": "target 6", "date_discussed": "2025-04-06"},
+            {"topic": "source 6", "date_discussed": "2025-04-06"},
+            {"topic": "target 5", "date_discussed": "2025-04-05"},
+            {"topic": "target 4", "date_discussed": "2025-04-04"},
+            {"topic": "source 4", "date_discussed": "2025-04-04"},
+            {"topic": "target 3", "date_discussed": "2025-04-03"},
+            {"topic": "target 2", "date_discussed": "2025-04-02"},
+        ],
+        "notes": ["target note", "source note"],
+        "last_modified": NOW,
+    },
+    "email": "source@example.com",
+}
+
+def test_merge_matches_the_original_rules():
+    target, source = copy.deepcopy(TARGET), copy.deepcopy(SOURCE)
+    assert UserMerger().merge(target, [source], now=NOW) == GOLDEN
+    # The inputs are left alone
+    assert (target, source) == (TARGET, SOURCE)
+
+def test_merge_keeps_key_order_of_the_target_first():
+    assert list(UserMerger().merge(TARGET, [SOURCE], now=NOW)) == list(GOLDEN)
+
+def test_undated_topics_are_joined_without_a_limit():
+    target = {"stats": {"recent_topics": [{"topic": "a"}] * 6}}
+    source = {"stats": {"recent_topics": [{"topic": "b"}] * 6}}
+    merged = UserMerger().merge(target, [source], now=NOW)
+    assert merged["stats"]["recent_topics"] == [{"topic": "a"}] * 6 + [{"topic": "b"}] * 6
+
+def test_several_sources_merge_like_one_after_another():
+    second = {
+        "uuid": "second",
+        "interests": [{"value": "cooking", "date_added": "2025-05-20"}, {"value": "go", "date_added": "2025-05-21"}],
+        "preferences": {"theme": {"value": "solarized", "date_added": "2025-05-30"}},
+        "stats": {"total_conversations": 4, "recent_topics": [{"topic": "second", "date_discussed": "2025-05-01"}]},
+    }
+    merger = UserMerger()
+
+    at_once = merger.merge(TARGET, [SOURCE, second], now=NOW)
+    one_by_one = merger.merge(merger.merge(TARGET, [SOURCE], now=NOW), [second], now=NOW)
+
+    assert at_once == one_by_one
+    assert at_once["stats"]["total_conversations"] == 12
+    assert at_once["stats"]["recent_topics"][0]["topic"] == "second"
+    assert len(at_once["stats"]["recent_topics"]) == 10
+    assert at_once["preferences"]["theme"]["value"] == "solarized"
+    assert [interest["value"] for interest in at_once["interests"]] == ["chess", "hiking", "cooking", "go"]
+
+@pytest.fixture
+def callisto(tmp_path):
+    callisto = Callisto(str(tmp_path), config=dict(load_config(), persist_user_registry=False))
+    yield callisto
+    callisto.close()
+
+def test_merge_users_into_combines_every_source_and_deletes_them(callisto):
+    target = "00000000-0000-4000-8000-000000000000"
+    sources = [f"00000000-0000-4000-8000-00000000000{n}" for n in range(1, 4)]
+    callisto.create_user(target, {"stats": {"total_conversations": 1}})
+    for n, uuid in enumerate(sources, 1):
+        callisto.create_user(uuid, {"stats": {"total_conversations": n}})
+        callisto.add_to_user_list(uuid, "interests", f"interest {n}")
+        callisto.append_to_conversation(uuid, f"log {n}", f"message {n}", with_timestamp=False)
+
+    merged = callisto.merge_users_into(sources, target)
+
+    assert merged["stats"]["total_conversations"] == 7
+    assert [interest["value"] for interest in merged["interests"]] == ["interest 1", "interest 2", "interest 3"]
+    assert callisto.get_user_data(target) == merged
+    assert not any(callisto.user_exists(uuid) for uuid in sources)
+    assert sorted(callisto.list_conversations(target)) == ["log 1", "log 2", "log 3"]
+
+def _uuid(n: int) -> str:
+    return f"00000000-0000-4000-8000-{n:012d}"
+
+def test_pairs_sharing_a_user_are_grouped_in_order(callisto):
+    a, b, c, d, e, f = (_uuid(n) for n in range(1, 7))
+    pairs = [(a, b), (d, e), (b, c), (f, a)]
+    assert callisto._related_pair_groups(pairs) == [[0, 2, 3], [1]]
+
+def test_chained_merges_run_one_after_another(callisto):
+    a, b, c, d, e = (_uuid(n) for n in range(1, 6))
+    for n, uuid in enumerate((a, b, c, d, e), 1):
+        callisto.create_user(uuid, {"stats": {"total_conversations": n}})
+        callisto.append_to_conversation(uuid, f"log {n}", f"message {n}", with_timestamp=False)
+
+    results = callisto.merge_many_users([(a, b), (d, e), (b, c)], workers=4)
+
+    assert [(result["source"], result["target"]) for result in results] == [(a, b), (d, e), (b, c)]
+    assert [result["data"]["stats"]["total_conversations"] for result in results] == [3, 9, 6]
+    assert callisto.get_user_data(c)["stats"]["total_conversations"] == 6
+    assert sorted(callisto.list_conversations(c)) == ["log 1", "log 2", "log 3"]
+    assert sorted(callisto.list_conversations(e)) == ["log 4", "log 5"]
+    assert not any(callisto.user_exists(uuid) for uuid in (a, b, d))
+
+def test_a_failed_pair_does_not_stop_the_others(callisto):
+    a, b, c, missing = (_uuid(n) for n in range(1, 5))
+    for uuid in (a, b, c):
+        callisto.create_user(uuid)
+
+    results = callisto.merge_many_users([(missing, a), (b, c)], workers=4)
+
+    assert "data" not in results[0] and results[0]["error"]
+    assert "error" not in results[1] and results[1]["data"]["uuid"] == c
+    assert callisto.user_exists(a) and not callisto.user_exists(b)
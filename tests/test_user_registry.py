@@ -0,0 +1,124 @@
+import os
+import json
+
+import pytest
+
+from src.callisto import Callisto
+from src.config import load_config
+from src.user_registry import UserRegistry
+
+ALICE = "00000000-0000-4000-8000-00000000000a"
+BOB = "00000000-0000-4000-8000-00000000000b"
+CAROL = "00000000-0000-4000-8000-00000000000c"
+DAVE = "00000000-0000-4000-8000-00000000000d"
+
+@pytest.fixture(params=["files", "sqlite"])
+def open_callisto(request, tmp_path):
+    """Open Callisto on the same data directory, closing every instance at the end."""
+    opened = []
+
+    def open_callisto(**config):
+        callisto = Callisto(str(tmp_path), config=dict(load_config(), **config), backend=request.param)
+        opened.append(callisto)
+        return callisto
+
+    yield open_callisto
+    for callisto in opened:
+        callisto.close()
+
+def _count_reads(callisto, monkeypatch):
+    """Count the user records read straight from the backend."""
+    reads = []
+    real = callisto.backend.read_user
+
+    def counting(uuid):
+        reads.append(uuid)
+        return real(uuid)
+
+    monkeypatch.setattr(callisto.backend, "read_user", counting)
+    return reads
+
+def _create_users(callisto):
+    for uuid, created in ((ALICE, "2025-03-01"), (BOB, "2025-01-01"), (CAROL, "2025-02-01")):
+        callisto.create_user(uuid)
+        # create_user always dates new users today
+        callisto.backend.write_user(uuid, {"uuid": uuid, "created": created, "last_modified": created})
+    callisto.refresh_user_registry()
+    # Sorting by date reads the dates in, so they're saved with the registry
+    assert callisto.list_users(order_by="created") == [BOB, CAROL, ALICE]
+
+def test_registry_is_reused_after_a_restart(open_callisto, tmp_path, monkeypatch):
+    first = open_callisto()
+    _create_users(first)
+    first.close()
+    assert os.path.exists(tmp_path / "user_registry.json")
+
+    second = open_callisto()
+    reads = _count_reads(second, monkeypatch)
+    assert second.list_users(order_by="created") == [BOB, CAROL, ALICE]
+    assert second.list_users(order_by="last_modified", descending=True) == [ALICE, CAROL, BOB]
+    assert reads == []
+
+def test_records_changed_while_closed_are_read_again(open_callisto, monkeypatch):
+    first = open_callisto()
+    _create_users(first)
+    # Written behind the registry's back, so the saved entry is stale
+    first.backend.write_user(BOB, {"uuid": BOB, "created": "2025-04-01", "last_modified": "2025-04-01"})
+    first.close()
+
+    second = open_callisto()
+    reads = _count_reads(second, monkeypatch)
+    assert second.list_users(order_by="created") == [CAROL, ALICE, BOB]
+    assert reads == [BOB]
+
+def test_users_added_or_deleted_while_closed_are_picked_up(open_callisto):
+    first = open_callisto()
+    _create_users(first)
+    first.close()
+    first.backend.delete_user(ALICE)
+    first.backend.write_user(DAVE, {"uuid": DAVE, "created": "2025-05-01", "last_modified": "2025-05-01"})
+
+    second = open_callisto()
+    assert second.list_users(order_by="created") == [BOB, CAROL, DAVE]
+    assert not second.user_exists(ALICE)
+
+def test_registry_is_not_saved_when_disabled(open_callisto, tmp_path):
+    callisto = open_callisto(persist_user_registry=False)
+    _create_users(callisto)
+    callisto.close()
+    assert not os.path.exists(tmp_path / "user_registry.json")
+
+def test_registry_is_only_saved_when_it_changed(tmp_path):
+    registry = UserRegistry(str(tmp_path / "user_registry.json"))
+    registry.load(lambda: [(ALICE, 1, 10)])
+    assert registry.save()
+    assert not registry.save()
+
+    registry.record(ALICE, {"created": "2025-01-01", "last_modified": "2025-01-02"}, 2, 20)
+    assert registry.save()
+    with open(registry.path) as file:
+        assert json.load(file)["users"] == {ALICE: [2, 20, "2025-01-01", "2025-01-02"]}
+
+@pytest.mark.parametrize("content", ["not json", json.dumps({"format": 0, "users": {}}), "[]"])
+def test_unreadable_saved_registry_is_ignored(tmp_path, content):
+    path = tmp_path / "user_registry.json"
+    path.write_text(content)
+    registry = UserRegistry(str(path))
+    registry.load(lambda: [(ALICE, 1, 10)])
+
+    assert list(registry.list()) == [ALICE]
+    assert registry.info(ALICE)["created"] is None
+
+def test_saved_dates_are_kept_only_for_the_same_version(tmp_path):
+    path = str(tmp_path / "user_registry.json")
+    saved = UserRegistry(path)
+    saved.load(lambda: [])
+    saved.record(ALICE, {"created": "2025-01-01", "last_modified": "2025-01-01"}, (5, 7), 10)
+    saved.record(BOB, {"created": "2025-02-01", "last_modified": "2025-02-01"}, (6, 8), 10)
+    saved.save()
+
+    registry = UserRegistry(path)
+    # Tuple versions come back from JSON as lists but still match
+    registry.load(lambda: [(ALICE, (5, 7), 10), (BOB, (9, 8), 10)])
+    assert registry.info(ALICE)["created"] == "2025-01-01"
+    assert registry.info(BOB)["created"] is None
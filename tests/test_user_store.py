@@ -0,0 +1,160 @@
+import os
+import json
+import time
+
+import pytest
+
+from src.user_store import UserStore
+
+USER = "00000000-0000-4000-8000-000000000001"
+
+def _edit_on_disk(store: UserStore, changes: dict, in_place: bool = False) -> None:
+    """Change a user file behind the store's back, like another process would."""
+    path = store.get_user_file_path(USER)
+    with open(path) as file:
+        data = json.load(file)
+    data.update(changes)
+    if in_place:
+        with open(path, "w") as file:
+            json.dump(data, file)
+        return
+    with open(f"{path}.new", "w") as file:
+        json.dump(data, file)
+    os.replace(f"{path}.new", path)
+
+#
+# Cache
+#
+
+@pytest.fixture
+def cached_store(tmp_path):
+    return UserStore(str(tmp_path), cache_size=1024 * 1024)
+
+def test_cache_serves_repeated_reads(cached_store):
+    cached_store.create_user(USER, {"name": "Ada"})
+    cached_store.get_user_data(USER)
+    cached_store.get_user_data(USER)
+    assert cached_store.cache_stats()["hits"] >= 1
+
+@pytest.mark.parametrize("in_place", [False, True])
+def test_cache_sees_external_edits(cached_store, in_place):
+    cached_store.create_user(USER, {"name": "Ada"})
+    assert cached_store.get_user_data(USER)["name"] == "Ada"
+    # Same size, so only the mtime or inode tells the versions apart
+    _edit_on_disk(cached_store, {"name": "Bob"}, in_place=in_place)
+    assert cached_store.get_user_data(USER)["name"] == "Bob"
+
+def test_cache_sees_external_deletes(cached_store):
+    cached_store.create_user(USER)
+    cached_store.get_user_data(USER)
+    os.remove(cached_store.get_user_file_path(USER))
+    assert cached_store.get_user_data(USER) is None
+
+def test_cached_records_are_not_shared_with_callers(cached_store):
+    cached_store.create_user(USER, {"name": "Ada"})
+    cached_store.get_user_data(USER)["name"] = "changed by the caller"
+    assert cached_store.get_user_data(USER)["name"] == "Ada"
+
+#
+# Write-back
+#
+
+@pytest.fixture
+def write_back_store(tmp_path):
+    store = UserStore(str(tmp_path), cache_size=1024 * 1024, write_back=True, auto_save_interval=3600)
+    yield store
+    store.close()
+
+def _on_disk(store: UserStore):
+    try:
+        with open(store.get_user_file_path(USER)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+def test_write_back_defers_writes_until_flush(write_back_store):
+    write_back_store.create_user(USER, {"name": "Ada"})
+    write_back_store.update_user(USER, {"name": "Bob"})
+    assert _on_disk(write_back_store) is None
+    assert write_back_store.get_user_data(USER)["name"] == "Bob"
+    assert write_back_store.user_exists(USER)
+
+    assert write_back_store.flush() == 1
+    assert _on_disk(write_back_store)["name"] == "Bob"
+    assert write_back_store.flush() == 0
+
+def test_write_back_flushes_on_close(tmp_path):
+    store = UserStore(str(tmp_path), write_back=True, auto_save_interval=3600)
+    store.create_user(USER, {"name": "Ada"})
+    store.close()
+    assert _on_disk(store)["name"] == "Ada"
+
+def test_deleting_an_unflushed_user_is_not_undone_by_flush(write_back_store):
+    write_back_store.create_user(USER)
+    assert write_back_store.delete_user(USER)
+    write_back_store.flush()
+    assert _on_disk(write_back_store) is None
+    assert not write_back_store.user_exists(USER)
+
+def test_deleting_a_flushed_user_with_pending_changes(write_back_store):
+    write_back_store.create_user(USER)
+    write_back_store.flush()
+    write_back_store.update_user(USER, {"name": "Bob"})
+    assert write_back_store.delete_user(USER)
+    write_back_store.flush()
+    assert _on_disk(write_back_store) is None
+    assert write_back_store.get_user_data(USER) is None
+
+def test_write_back_flushes_in_the_background(tmp_path):
+    store = UserStore(str(tmp_path), write_back=True, auto_save_interval=0.05)
+    try:
+        store.create_user(USER, {"name": "Ada"})
+        deadline = time.monotonic() + 5
+        while _on_disk(store) is None and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert _on_disk(store)["name"] == "Ada"
+    finally:
+        store.close()
+
+#
+# Patches
+#
+
+def test_patch_applies_every_operation(cached_store):
+    cached_store.create_user(USER, {"stats": {"visits": 1}, "tags": ["a"]})
+    result = cached_store.patch(USER, [
+        {"op": "set", "path": "/preferences/theme", "value": "dark"},
+        {"op": "append", "path": "/tags", "value": "b"},
+        {"op": "increment", "path": "/stats/visits", "value": 2},
+        {"op": "remove", "path": ["stats", "visits"]},
+        {"op": "increment", "path": "/stats/visits"},
+    ])
+    assert result["preferences"] == {"theme": "dark"}
+    assert result["tags"] == ["a", "b"]
+    assert result["stats"] == {"visits": 1}
+    assert cached_store.get_user_data(USER) == result
+
+@pytest.mark.parametrize("failing_op", [
+    {"op": "increment", "path": "/name"},
+    {"op": "append", "path": "/name", "value": 1},
+    {"op": "remove", "path": "/missing"},
+    {"op": "set", "path": "/uuid", "value": "x"},
+    {"op": "rename", "path": "/name"},
+])
+def test_failed_patch_undoes_earlier_operations(cached_store, failing_op):
+    cached_store.create_user(USER, {"name": "Ada", "tags": ["a"], "stats": {"visits": 1}})
+    before = cached_store.get_user_data(USER)
+    with pytest.raises(ValueError):
+        cached_store.patch(USER, [
+            {"op": "set", "path": "/preferences/theme", "value": "dark"},
+            {"op": "append", "path": "/tags", "value": "b"},
+            {"op": "increment", "path": "/stats/visits"},
+            {"op": "remove", "path": "/name"},
+            {"op": "set", "path": "/name", "value": "Bob"},
+            {"op": "set", "path": "/tags/0", "value": "z"},
+            failing_op,
+        ])
+    # Neither the cached record nor the file changed
+    assert cached_store.get_user_data(USER) == before
+    with open(cached_store.get_user_file_path(USER)) as file:
+        assert json.load(file) == before
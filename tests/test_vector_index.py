@@ -0,0 +1,97 @@
+import os
+import threading
+import multiprocessing
+
+import pytest
+
+from src.config import load_config
+from src.locks import StripedLocks
+from src.vector_index import VectorIndex, create_vector_index
+
+USER = "00000000-0000-4000-8000-000000000001"
+
+def test_vector_index_is_off_by_default(tmp_path):
+    assert create_vector_index(str(tmp_path), load_config()) is None
+    assert create_vector_index(str(tmp_path), dict(load_config(), vector_index=True)) is not None
+
+def test_rewrites_leave_no_temporary_files(tmp_path):
+    index = VectorIndex(str(tmp_path / "vectors"))
+    index.replace_log(USER, "chat", ["[2025-03-01 10:00:00] hiking in the hills\n", "[2025-03-01 10:01:00] pizza\n"])
+    index.replace_log(USER, "chat", ["[2025-03-01 10:01:00] pizza\n"])
+    index.delete_log(USER, "other")
+
+    assert sorted(os.listdir(tmp_path / "vectors")) == [f"{USER}.meta", f"{USER}.vec"]
+    assert [result["line"] for result in index.recall(USER, "pizza", k=5)] == ["[2025-03-01 10:01:00] pizza"]
+
+def test_appends_and_rewrites_from_two_processes_keep_every_vector(tmp_path):
+    # Each index has its own lock file handles, like two processes would
+    directory = str(tmp_path / "vectors")
+    locks_directory = str(tmp_path / ".locks")
+    writer = VectorIndex(directory, batch_size=1, locks=StripedLocks(4, locks_directory, "vectors"))
+    rewriter = VectorIndex(directory, locks=StripedLocks(4, locks_directory, "vectors"))
+    rewriter.replace_log(USER, "pinned", ["[2025-03-01 10:00:00] remember this\n"])
+
+    stop = threading.Event()
+
+    def rewrite() -> None:
+        while not stop.is_set():
+            rewriter.replace_log(USER, "pinned", ["[2025-03-01 10:00:00] remember this\n"])
+
+    thread = threading.Thread(target=rewrite)
+    thread.start()
+    for number in range(200):
+        writer.add_lines(USER, "chat", [f"[2025-03-01 11:00:00] message {number}\n"])
+    stop.set()
+    thread.join()
+
+    assert writer.stats(USER)["vectors"] == 201
+
+def _churn(directory: str, locks_directory: str, stop) -> None:
+    index = VectorIndex(directory, batch_size=7, locks=StripedLocks(4, locks_directory, "vectors"))
+    number = 0
+    while not stop.is_set():
+        index.add_lines(USER, "chat", [f"[2025-03-01 11:00:00] chat about hiking {number}\n"])
+        if number % 5 == 0:
+            # Rewrites swap in new files with differently laid out metadata
+            lines = [f"[2025-03-01 10:00:00] pinned note about hiking {n}\n" for n in range(number % 13)]
+            index.replace_log(USER, "pinned", lines)
+        number += 1
+    index.close()
+
+@pytest.mark.skipif(os.name != "posix", reason="process locks need fcntl")
+def test_recall_while_another_process_appends_and_rewrites(tmp_path):
+    directory = str(tmp_path / "vectors")
+    locks_directory = str(tmp_path / ".locks")
+    context = multiprocessing.get_context("fork")
+    stop = context.Event()
+    writer = context.Process(target=_churn, args=(directory, locks_directory, stop))
+    writer.start()
+    reader = VectorIndex(directory, locks=StripedLocks(4, locks_directory, "vectors"))
+    try:
+        recalled = 0
+        for _ in range(150):
+            for result in reader.recall(USER, "hiking", k=10):
+                # Metadata always belongs to the vector it was read for
+                expected = "chat about" if result["log_name"] == "chat" else "pinned note"
+                assert expected in result["line"]
+                recalled += 1
+        assert recalled > 0
+    finally:
+        stop.set()
+        writer.join()
+    assert writer.exitcode == 0
+
+def test_recall_skips_vectors_whose_metadata_was_lost(tmp_path):
+    index = VectorIndex(str(tmp_path / "vectors"))
+    index.replace_log(USER, "chat", [f"[2025-03-01 10:00:00] pizza number {n}\n" for n in range(3)])
+    meta_path = tmp_path / "vectors" / f"{USER}.meta"
+    # Like a crash that kept the vectors but not the end of the metadata
+    meta_path.write_bytes(meta_path.read_bytes()[:-10])
+
+    results = index.recall(USER, "pizza", k=5)
+    assert sorted(result["line"] for result in results) == [
+        "[2025-03-01 10:00:00] pizza number 0",
+        "[2025-03-01 10:00:00] pizza number 1",
+    ]
+    index.delete_log(USER, "other")
+    assert index.stats(USER)["vectors"] == 2